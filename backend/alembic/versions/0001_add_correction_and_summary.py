@@ -0,0 +1,33 @@
+"""Corrección de la verificación en mensajes y resumen de conversación
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    return any(c["name"] == column for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def upgrade() -> None:
+    # Las bases creadas por init_db con los modelos actuales ya tienen las columnas
+    if not _has_column("messages", "correction"):
+        op.add_column("messages", sa.Column("correction", sa.Text(), nullable=True))
+    if not _has_column("conversations", "summary"):
+        op.add_column("conversations", sa.Column("summary", sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.drop_column("summary")
+    with op.batch_alter_table("messages") as batch_op:
+        batch_op.drop_column("correction")
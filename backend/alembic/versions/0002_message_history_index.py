@@ -0,0 +1,55 @@
+"""Índice (conversation_id, created_at) en mensajes y contador message_count
+
+El historial se lee con ORDER BY created_at DESC LIMIT n por conversación: el
+índice compuesto lo resuelve sin ordenar y sustituye al de conversation_id
+(es su prefijo). message_count evita un COUNT(*) de mensajes por turno.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    return any(c["name"] == column for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def _has_index(table: str, name: str) -> bool:
+    return any(i["name"] == name for i in sa.inspect(op.get_bind()).get_indexes(table))
+
+
+def upgrade() -> None:
+    if not _has_index("messages", "ix_messages_conversation_id_created_at"):
+        op.create_index(
+            "ix_messages_conversation_id_created_at",
+            "messages",
+            ["conversation_id", "created_at"],
+        )
+    if _has_index("messages", "ix_messages_conversation_id"):
+        op.drop_index("ix_messages_conversation_id", table_name="messages")
+
+    if not _has_column("conversations", "message_count"):
+        op.add_column(
+            "conversations",
+            sa.Column("message_count", sa.Integer(), nullable=False, server_default="0"),
+        )
+    # Backfill con el número real de mensajes de cada conversación
+    op.execute(
+        "UPDATE conversations SET message_count = "
+        "(SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.id)"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.drop_column("message_count")
+    op.create_index("ix_messages_conversation_id", "messages", ["conversation_id"])
+    op.drop_index("ix_messages_conversation_id_created_at", table_name="messages")
@@ -0,0 +1,36 @@
+"""Índice (user_id, updated_at, id) para el listado de conversaciones por cursor
+
+Sustituye al índice de user_id (es su prefijo).
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def _has_index(table: str, name: str) -> bool:
+    return any(i["name"] == name for i in sa.inspect(op.get_bind()).get_indexes(table))
+
+
+def upgrade() -> None:
+    if not _has_index("conversations", "ix_conversations_user_id_updated_at_id"):
+        op.create_index(
+            "ix_conversations_user_id_updated_at_id",
+            "conversations",
+            ["user_id", "updated_at", "id"],
+        )
+    if _has_index("conversations", "ix_conversations_user_id"):
+        op.drop_index("ix_conversations_user_id", table_name="conversations")
+
+
+def downgrade() -> None:
+    op.create_index("ix_conversations_user_id", "conversations", ["user_id"])
+    op.drop_index("ix_conversations_user_id_updated_at_id", table_name="conversations")
@@ -0,0 +1,39 @@
+"""Contador summarized_count: mensajes ya incorporados al resumen de la conversación
+
+Ordena las actualizaciones del resumen entre instancias: cada trabajo resume
+los mensajes que faltan y solo escribe si nadie avanzó el contador antes.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    return any(c["name"] == column for c in sa.inspect(op.get_bind()).get_columns(table))
+
+
+def upgrade() -> None:
+    if not _has_column("conversations", "summarized_count"):
+        op.add_column(
+            "conversations",
+            sa.Column("summarized_count", sa.Integer(), nullable=False, server_default="0"),
+        )
+    # Backfill: todo lo que está fuera de la ventana literal (2 mensajes) se da por resumido
+    op.execute(
+        "UPDATE conversations SET summarized_count = message_count - 2 "
+        "WHERE summarized_count = 0 AND message_count > 2"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("conversations") as batch_op:
+        batch_op.drop_column("summarized_count")
@@ -2,13 +2,20 @@
 Chat API endpoints for LegalBot
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List, Optional
-from uuid import UUID
+import asyncio
+import base64
+import json
+import weakref
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Tuple
+from uuid import UUID, uuid4
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, update, case, and_, or_
 
-from app.core.database import get_db
+from app.core.config import settings
+from app.core.database import get_db, async_session_maker
 from app.core.security import get_current_user, get_current_user_optional
 from app.schemas.chat import (
     MessageCreate,
@@ -18,105 +25,240 @@ from app.schemas.chat import (
     ChatResponse,
     FeedbackRequest,
     LegalSource,
+    LegalSourceRef,
 )
 from app.models.conversation import Conversation, Message, MessageRole, LegalCategory
-from app.services.rag import generate_legal_response, generate_conversation_title
+from app.services.rag import (
+    generate_legal_response,
+    stream_legal_response,
+    generate_conversation_title,
+    default_conversation_title,
+    update_conversation_summary,
+)
+from app.services.job_queue import job_queue
 from app.services.user_docs import extract_text_from_pdf
 from fastapi import UploadFile, File
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
 
-@router.post("/message", response_model=ChatResponse)
-async def send_message(
-    request: MessageCreate,
-    current_user: dict = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
-):
-    """
-    Send a message and get an AI response.
-    Creates a new conversation if conversation_id is not provided.
-    """
-    user_id = UUID(current_user["user_id"])
-    
-    # Get or create conversation
-    conversation = None
-    if request.conversation_id:
-        result = await db.execute(
-            select(Conversation).where(
-                Conversation.id == request.conversation_id,
-                Conversation.user_id == user_id
-            )
+def _sse(event: str, data: dict) -> str:
+    """Formatear un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # Evitar que proxies acumulen el stream
+}
+
+
+async def _get_user_conversation(
+    db: AsyncSession,
+    conversation_id: UUID,
+    user_id: UUID,
+) -> Conversation:
+    """Obtener una conversación del usuario o lanzar 404"""
+    result = await db.execute(
+        select(Conversation).where(
+            Conversation.id == conversation_id,
+            Conversation.user_id == user_id
         )
-        conversation = result.scalar_one_or_none()
-        
-        if not conversation:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversación no encontrada"
-            )
+    )
+    conversation = result.scalar_one_or_none()
     
-    # Get conversation history if exists
-    conversation_history = []
-    if conversation:
-        result = await db.execute(
-            select(Message)
-            .where(Message.conversation_id == conversation.id)
-            .order_by(Message.created_at)
+    if not conversation:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Conversación no encontrada"
         )
-        messages = result.scalars().all()
-        conversation_history = [
-            {"role": msg.role.value, "content": msg.content}
-            for msg in messages
-        ]
-    
-    # Generate AI response
-    answer, sources, category, needs_lawyer, confidence = await generate_legal_response(
-        request.content,
-        conversation_history,
-        user_context=request.user_context,
-        mode=request.mode
+    return conversation
+
+
+async def _load_history(db: AsyncSession, conversation: Conversation) -> List[dict]:
+    """
+    Últimos mensajes de la conversación en formato de mensajes para el LLM.
+    Lo anterior está en `conversation.summary`: la consulta es de tamaño fijo.
+    """
+    result = await db.execute(
+        select(Message)
+        .where(Message.conversation_id == conversation.id)
+        .order_by(Message.created_at.desc())
+        .limit(settings.CONVERSATION_HISTORY_MESSAGES)
     )
-    
+    # Usuario y asistente de un turno pueden tener el mismo created_at
+    messages = sorted(result.scalars().all(), key=lambda msg: (msg.created_at, msg.role != MessageRole.USER))
+    return [
+        {"role": msg.role.value, "content": msg.content}
+        for msg in messages
+    ]
+
+
+# ═══════════════════════════════════════════════════════════════
+# TRABAJOS EN SEGUNDO PLANO (job_queue): se encolan tras guardar el turno
+# ═══════════════════════════════════════════════════════════════
+
+# Un lock por conversación: en este proceso evita resumir lo mismo dos veces.
+# Entre instancias el orden lo garantiza Conversation.summarized_count
+_summary_locks: "weakref.WeakValueDictionary[UUID, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+@job_queue.handler("conversation_title")
+async def _conversation_title_job(payload: dict) -> None:
+    """Sustituir el título provisional de una conversación nueva por el generado"""
+    title = await generate_conversation_title(payload["first_message"])
+    async with async_session_maker() as session:
+        conversation = await session.get(Conversation, UUID(payload["conversation_id"]))
+        if conversation and title:
+            conversation.title = title
+            await session.commit()
+            print(f"🏷️ [Chat] Título generado para {conversation.id}: {title}")
+
+
+@job_queue.handler("conversation_summary")
+async def _conversation_summary_job(payload: dict) -> None:
+    """
+    Incorporar al resumen los mensajes que salieron de la ventana del historial.
+    `summarized_count` (mensajes ya resumidos desde el inicio) hace que los trabajos
+    sean idempotentes y ordenados aunque corran en varias instancias: se resume lo
+    que falta hasta `upto`, un trabajo ya cubierto por otro posterior se descarta
+    y la escritura es condicional. Si el resumen falla, la cola lo reintenta.
+    """
+    conversation_id = UUID(payload["conversation_id"])
+    lock = _summary_locks.setdefault(conversation_id, asyncio.Lock())
+    async with lock:
+        async with async_session_maker() as session:
+            conversation = await session.get(Conversation, conversation_id)
+            if not conversation:
+                return
+            start, upto = conversation.summarized_count, payload["upto"]
+            if upto <= start:
+                return  # Ya incorporados por otro trabajo
+            result = await session.execute(
+                select(Message)
+                .where(Message.conversation_id == conversation_id)
+                # Usuario y asistente de un turno pueden tener el mismo created_at
+                .order_by(Message.created_at, case((Message.role == MessageRole.USER, 0), else_=1))
+                .offset(start)
+                .limit(upto - start)
+            )
+            messages = [{"role": msg.role.value, "content": msg.content} for msg in result.scalars().all()]
+            summary = await update_conversation_summary(conversation.summary, messages)
+            if not summary:
+                raise RuntimeError(f"no se pudo actualizar el resumen de {conversation_id}")
+            updated = await session.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id, Conversation.summarized_count == start)
+                .values(summary=summary, summarized_count=upto)
+            )
+            await session.commit()
+            if updated.rowcount == 0:
+                # Otra instancia avanzó el resumen entre la lectura y la escritura
+                raise RuntimeError(f"el resumen de {conversation_id} cambió durante la actualización")
+            print(f"🧠 [Chat] Resumen actualizado ({len(summary)} caracteres) en {conversation_id}")
+
+
+@job_queue.handler("message_correction")
+async def _message_correction_job(payload: dict) -> None:
+    """
+    Anotar en el mensaje la corrección de la verificación asíncrona.
+    La verificación se encola antes de guardar el turno: si el mensaje aún no
+    existe, el trabajo falla y la cola lo reintenta.
+    """
+    async with async_session_maker() as session:
+        message = await session.get(Message, UUID(payload["message_id"]))
+        if not message:
+            raise LookupError(f"el mensaje {payload['message_id']} aún no está guardado")
+        message.correction = payload["correction"]
+        await session.commit()
+        print(f"⚖️ [Chat] Corrección guardada en el mensaje {message.id}")
+
+
+async def _enqueue_turn_jobs(conversation: Conversation, first_message: Optional[str]) -> None:
+    """
+    Trabajo posterior a guardar un turno: el título de una conversación nueva
+    y el resumen con los mensajes que salen de la ventana del historial.
+    """
+    if first_message:
+        await job_queue.enqueue("conversation_title", {
+            "conversation_id": str(conversation.id),
+            "first_message": first_message,
+        })
+    # El turno nuevo (2 mensajes) desplaza a los más antiguos de la ventana:
+    # el resumen debe cubrir todos los mensajes hasta `upto`
+    upto = conversation.message_count - settings.CONVERSATION_HISTORY_MESSAGES
+    if upto > conversation.summarized_count:
+        await job_queue.enqueue("conversation_summary", {
+            "conversation_id": str(conversation.id),
+            "upto": upto,
+        })
+
+
+async def _save_turn(
+    db: AsyncSession,
+    user_id: UUID,
+    conversation: Optional[Conversation],
+    content: str,
+    answer: str,
+    sources: List[LegalSource],
+    category: LegalCategory,
+    title: Optional[str],
+    assistant_message_id: Optional[UUID] = None,
+) -> Tuple[Conversation, Message, int]:
+    """Guardar el mensaje del usuario y la respuesta. Crea la conversación si es nueva."""
     # Create conversation if new
     if not conversation:
-        title = await generate_conversation_title(request.content)
         conversation = Conversation(
             user_id=user_id,
             title=title,
             category=category,
+            message_count=0,
         )
         db.add(conversation)
         await db.flush()
     
+    # Contador mantenido en la conversación (UPDATE atómico, sin COUNT de mensajes)
+    conversation.message_count = Conversation.message_count + 2
+    
+    # La respuesta va 1 µs después de la pregunta: (created_at, id) ordena el
+    # turno sin empates, y es la clave de la paginación del historial
+    created_at = datetime.utcnow()
+    
     # Save user message
     user_message = Message(
         conversation_id=conversation.id,
         role=MessageRole.USER,
-        content=request.content,
+        content=content,
+        created_at=created_at,
     )
     db.add(user_message)
     
     # Save assistant message
     sources_dict = [source.model_dump() for source in sources] if sources else None
     assistant_message = Message(
+        id=assistant_message_id or uuid4(),
         conversation_id=conversation.id,
         role=MessageRole.ASSISTANT,
         content=answer,
         sources=sources_dict,
+        created_at=created_at + timedelta(microseconds=1),
     )
     db.add(assistant_message)
     
     await db.commit()
     await db.refresh(conversation)
     await db.refresh(assistant_message)
-    
-    # Get message count
-    count_result = await db.execute(
-        select(func.count(Message.id)).where(Message.conversation_id == conversation.id)
-    )
-    message_count = count_result.scalar() or 0
-    
+    return conversation, assistant_message, conversation.message_count
+
+
+def _build_chat_response(
+    conversation: Conversation,
+    assistant_message: Message,
+    message_count: int,
+    needs_lawyer: bool,
+    confidence: float,
+) -> ChatResponse:
+    sources_dict = assistant_message.sources
     return ChatResponse(
         message=MessageResponse(
             id=assistant_message.id,
@@ -124,6 +266,7 @@ async def send_message(
             role=assistant_message.role.value,
             content=assistant_message.content,
             sources=[LegalSource(**s) for s in sources_dict] if sources_dict else None,
+            correction=assistant_message.correction,
             created_at=assistant_message.created_at,
         ),
         conversation=ConversationResponse(
@@ -139,6 +282,118 @@ async def send_message(
     )
 
 
+@router.post("/message", response_model=ChatResponse)
+async def send_message(
+    request: MessageCreate,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Send a message and get an AI response.
+    Creates a new conversation if conversation_id is not provided.
+    """
+    user_id = UUID(current_user["user_id"])
+    
+    # Get or create conversation
+    conversation = None
+    if request.conversation_id:
+        conversation = await _get_user_conversation(db, request.conversation_id, user_id)
+    
+    # Get conversation history if exists (resumen + últimos mensajes)
+    conversation_history = []
+    conversation_summary = None
+    if conversation:
+        conversation_history = await _load_history(db, conversation)
+        conversation_summary = conversation.summary
+    
+    # El id se asigna antes para que la verificación en segundo plano sepa dónde guardar
+    assistant_message_id = uuid4()
+    
+    # Generate AI response
+    answer, sources, category, needs_lawyer, confidence = await generate_legal_response(
+        request.content,
+        conversation_history,
+        user_context=request.user_context,
+        mode=request.mode,
+        message_id=assistant_message_id,
+        conversation_summary=conversation_summary,
+    )
+    
+    # Una conversación nueva se guarda con un título provisional; el definitivo
+    # se genera en la cola de trabajos
+    new_conversation = conversation is None
+    title = default_conversation_title(request.content) if new_conversation else None
+    conversation, assistant_message, message_count = await _save_turn(
+        db, user_id, conversation, request.content, answer, sources, category, title,
+        assistant_message_id=assistant_message_id,
+    )
+    await _enqueue_turn_jobs(conversation, request.content if new_conversation else None)
+    
+    return _build_chat_response(conversation, assistant_message, message_count, needs_lawyer, confidence)
+
+
+@router.post("/message/stream")
+async def send_message_stream(
+    request: MessageCreate,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Streaming (SSE) variant of /message.
+    Emits `sources` first, then `token` events as the answer is generated,
+    and a final `done` event with the saved message and conversation.
+    """
+    user_id = UUID(current_user["user_id"])
+    
+    conversation_id = None
+    conversation_history = []
+    conversation_summary = None
+    if request.conversation_id:
+        conversation = await _get_user_conversation(db, request.conversation_id, user_id)
+        conversation_id = conversation.id
+        conversation_history = await _load_history(db, conversation)
+        conversation_summary = conversation.summary
+    
+    async def event_stream():
+        assistant_message_id = uuid4()
+        sources: List[LegalSource] = []
+        final = None
+        async for event, data in stream_legal_response(
+            request.content,
+            conversation_history,
+            user_context=request.user_context,
+            mode=request.mode,
+            message_id=assistant_message_id,
+            conversation_summary=conversation_summary,
+        ):
+            if event == "done":
+                final = data
+                continue
+            if event == "sources":
+                sources = [LegalSource(**s) for s in data["sources"]]
+            yield _sse(event, data)
+            if event == "error":
+                return
+        
+        # La sesión de la petición puede cerrarse antes que el stream; usamos una propia
+        async with async_session_maker() as session:
+            conversation = await session.get(Conversation, conversation_id) if conversation_id else None
+            title = default_conversation_title(request.content) if conversation_id is None else None
+            conversation, assistant_message, message_count = await _save_turn(
+                session, user_id, conversation, request.content, final["content"],
+                sources, LegalCategory(final["category"]), title,
+                assistant_message_id=assistant_message_id,
+            )
+            await _enqueue_turn_jobs(conversation, request.content if conversation_id is None else None)
+            response = _build_chat_response(
+                conversation, assistant_message, message_count,
+                final["needs_lawyer"], final["confidence"]
+            )
+        yield _sse("done", response.model_dump(mode="json"))
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 # ═══════════════════════════════════════════════════════════════
 # PUBLIC DEMO ENDPOINT (No authentication required)
 # ═══════════════════════════════════════════════════════════════
@@ -180,53 +435,155 @@ async def demo_chat(request: DemoMessageRequest):
     )
 
 
+@router.post("/demo/stream")
+async def demo_chat_stream(request: DemoMessageRequest):
+    """
+    Streaming (SSE) variant of the public demo endpoint.
+    The final `done` event carries the same payload as /demo.
+    """
+    async def event_stream():
+        sources = None
+        async for event, data in stream_legal_response(
+            request.content,
+            conversation_history=None,
+            user_context=request.user_context,
+            mode=request.mode
+        ):
+            if event == "sources":
+                sources = data["sources"] or None
+            if event == "done":
+                data = DemoMessageResponse(
+                    content=data["content"],
+                    sources=sources,
+                    category=data["category"],
+                    needs_lawyer=data["needs_lawyer"],
+                    confidence=data["confidence"],
+                ).model_dump(mode="json")
+            yield _sse(event, data)
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def _encode_cursor(conversation: Conversation) -> str:
+    """Cursor opaco con la posición (updated_at, id) de la última conversación de la página"""
+    raw = f"{conversation.updated_at.isoformat()}|{conversation.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated_at, conversation_id = raw.split("|")
+        return datetime.fromisoformat(updated_at), UUID(conversation_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor inválido",
+        )
+
+
 @router.get("/conversations", response_model=List[ConversationResponse])
 async def list_conversations(
+    response: Response,
     skip: int = 0,
     limit: int = 20,
+    cursor: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """List user's conversations"""
+    """
+    List user's conversations (más recientes primero).
+    Paginación por cursor (keyset sobre updated_at, id): la siguiente página se
+    pide con el valor de la cabecera X-Next-Cursor. `skip` se mantiene por
+    compatibilidad y se ignora si se envía `cursor`.
+    """
     user_id = UUID(current_user["user_id"])
+    limit = max(1, min(limit, 100))
     
-    result = await db.execute(
+    query = (
         select(Conversation)
         .where(Conversation.user_id == user_id)
-        .order_by(Conversation.updated_at.desc())
-        .offset(skip)
-        .limit(limit)
+        .order_by(Conversation.updated_at.desc(), Conversation.id.desc())
+        .limit(limit + 1)  # Uno de más para saber si hay otra página
     )
+    if cursor:
+        updated_at, conversation_id = _decode_cursor(cursor)
+        query = query.where(or_(
+            Conversation.updated_at < updated_at,
+            and_(Conversation.updated_at == updated_at, Conversation.id < conversation_id),
+        ))
+    elif skip:
+        query = query.offset(skip)
+    
+    result = await db.execute(query)
     conversations = result.scalars().all()
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(conversations[-1])
     
-    # Get message counts
-    response = []
-    for conv in conversations:
-        count_result = await db.execute(
-            select(func.count(Message.id)).where(Message.conversation_id == conv.id)
-        )
-        message_count = count_result.scalar() or 0
-        
-        response.append(ConversationResponse(
+    # message_count se mantiene en la conversación: sin un COUNT por fila
+    return [
+        ConversationResponse(
             id=conv.id,
             title=conv.title,
             category=conv.category,
             created_at=conv.created_at,
             updated_at=conv.updated_at,
-            message_count=message_count,
-        ))
-    
-    return response
+            message_count=conv.message_count,
+        )
+        for conv in conversations
+    ]
+
+
+async def _message_cursor(db: AsyncSession, conversation_id: UUID, message_id: UUID) -> Tuple[datetime, UUID]:
+    """Posición (created_at, id) del mensaje usado como cursor"""
+    result = await db.execute(
+        select(Message.created_at).where(
+            Message.id == message_id,
+            Message.conversation_id == conversation_id,
+        )
+    )
+    created_at = result.scalar_one_or_none()
+    if created_at is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor inválido",
+        )
+    return created_at, message_id
+
+
+def _message_sources(sources: Optional[list], include_sources: bool):
+    if not sources:
+        return None
+    if include_sources:
+        return [LegalSource(**s) for s in sources]
+    return [LegalSourceRef(**{k: v for k, v in s.items() if k != "text"}) for s in sources]
 
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationDetailResponse)
 async def get_conversation(
     conversation_id: UUID,
+    before: Optional[UUID] = None,
+    after: Optional[UUID] = None,
+    limit: Optional[int] = None,
+    include_sources: bool = True,
     current_user: dict = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Get a conversation with all messages"""
+    """
+    Get a conversation with its messages (en orden cronológico).
+    Sin parámetros devuelve todos. Con `limit` devuelve la página más reciente;
+    `before`/`after` (id de un mensaje) piden los anteriores/posteriores a él.
+    Con include_sources=false las fuentes van sin su texto (solo la referencia).
+    """
     user_id = UUID(current_user["user_id"])
+    if before and after:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use before o after, no ambos",
+        )
+    if limit is not None:
+        limit = max(1, min(limit, 200))
     
     result = await db.execute(
         select(Conversation).where(
@@ -242,13 +599,38 @@ async def get_conversation(
             detail="Conversación no encontrada"
         )
     
-    # Get messages
-    messages_result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conversation_id)
-        .order_by(Message.created_at)
-    )
+    # Keyset sobre (created_at, id), cubierto por ix_messages_conversation_id_created_at
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    has_older = has_newer = False
+    if after:
+        created_at, message_id = await _message_cursor(db, conversation_id, after)
+        query = query.where(or_(
+            Message.created_at > created_at,
+            and_(Message.created_at == created_at, Message.id > message_id),
+        )).order_by(Message.created_at, Message.id)
+        has_older = True
+    else:
+        if before:
+            created_at, message_id = await _message_cursor(db, conversation_id, before)
+            query = query.where(or_(
+                Message.created_at < created_at,
+                and_(Message.created_at == created_at, Message.id < message_id),
+            ))
+            has_newer = True
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+    if limit is not None:
+        query = query.limit(limit + 1)  # Uno de más para saber si hay otra página
+    
+    messages_result = await db.execute(query)
     messages = messages_result.scalars().all()
+    if limit is not None and len(messages) > limit:
+        messages = messages[:limit]
+        if after:
+            has_newer = True
+        else:
+            has_older = True
+    if not after:
+        messages = messages[::-1]
     
     return ConversationDetailResponse(
         id=conversation.id,
@@ -256,18 +638,21 @@ async def get_conversation(
         category=conversation.category,
         created_at=conversation.created_at,
         updated_at=conversation.updated_at,
-        message_count=len(messages),
+        message_count=conversation.message_count,
         messages=[
             MessageResponse(
                 id=msg.id,
                 conversation_id=msg.conversation_id,
                 role=msg.role.value,
                 content=msg.content,
-                sources=[LegalSource(**s) for s in msg.sources] if msg.sources else None,
+                sources=_message_sources(msg.sources, include_sources),
+                correction=msg.correction,
                 created_at=msg.created_at,
             )
             for msg in messages
         ],
+        has_older=has_older,
+        has_newer=has_newer,
     )
 
 
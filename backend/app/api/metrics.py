@@ -0,0 +1,66 @@
+"""
+Métricas internas de LegalBot (tokens, caches, reintentos, router)
+
+Solo disponible si METRICS_TOKEN está configurado; se pide en la cabecera
+X-Metrics-Token.
+"""
+
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+
+from app.core.config import settings
+from app.services import rag
+from app.services.job_queue import job_queue
+from app.services.llm_cache import llm_cache
+from app.services.llm_providers import LLMProvider, embedding_batcher, embedding_cache, get_global_llm
+from app.services.semantic_cache import semantic_cache
+from app.services.usage import usage_tracker
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+async def require_metrics_token(x_metrics_token: Optional[str] = Header(None)) -> None:
+    """Sin METRICS_TOKEN el endpoint no existe (404); con token incorrecto, 401"""
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not x_metrics_token or not secrets.compare_digest(x_metrics_token, settings.METRICS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de métricas inválido")
+
+
+def _provider_stats(provider: Optional[LLMProvider]) -> dict:
+    """Stats de cada capa de la cadena de proveedores (single-flight, reintentos, router, límites)"""
+    result = {}
+    while provider is not None:
+        if hasattr(provider, "stats"):
+            result[type(provider).__name__] = provider.stats()
+        if hasattr(provider, "providers"):  # Router: una cadena por proveedor
+            result["providers"] = {name: _provider_stats(p) for name, p in provider.providers.items()}
+        provider = getattr(provider, "provider", None)
+    return result
+
+
+@router.get("", dependencies=[Depends(require_metrics_token)])
+async def get_metrics():
+    return {
+        "usage": usage_tracker.stats(),
+        "llm": _provider_stats(get_global_llm()),
+        "caches": {
+            "llm": llm_cache.stats(),
+            "semantic": semantic_cache.stats(),
+            "embeddings": embedding_cache.stats(),
+        },
+        "embedding_batcher": embedding_batcher.stats(),
+        "single_flight": {
+            "embeddings": rag._embedding_flights.stats(),
+            "pinecone": rag._pinecone_flights.stats(),
+        },
+        "jobs": await job_queue.stats(),
+    }
+
+
+@router.get("/usage/{user_id}", dependencies=[Depends(require_metrics_token)])
+async def get_user_usage(user_id: str):
+    """Tokens consumidos por un usuario, por tarea (desde el arranque del proceso)"""
+    return {"user_id": user_id, "usage": usage_tracker.user_stats(user_id)}
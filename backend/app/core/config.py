@@ -25,8 +25,8 @@ class Settings(BaseSettings):
             return self.DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
         return self.DATABASE_URL
     
-    # Redis
-    REDIS_URL: str = "redis://localhost:6379"
+    # Redis (opcional, p. ej. "redis://localhost:6379"). Vacío = sin Redis
+    REDIS_URL: str = ""
     
     # Security
     SECRET_KEY: str = "your-secret-key-change-in-production"
@@ -38,22 +38,51 @@ class Settings(BaseSettings):
     # Opciones: "auto", "groq", "gemini", "ollama", "openai", "together"
     LLM_PROVIDER: str = "auto"  # auto detecta según API keys disponibles
     
+    # Tareas auxiliares que van al modelo pequeño de cada proveedor (*_SMALL_MODEL)
+    # La respuesta principal ("answer") y la verificación usan siempre el modelo grande
+    LLM_SMALL_MODEL_TASKS: list[str] = ["expansion", "title", "suggest", "extract", "summary"]
+    # Tareas que piden salida JSON al proveedor (JSON mode): Groq sin streaming, Gemini, Ollama y OpenAI
+    LLM_JSON_TASKS: list[str] = ["fused"]
+    
+    # Router multi-proveedor: lista separada por comas, p. ej. "groq,gemini,together"
+    # Con dos o más proveedores se usa el router (failover, circuit breakers, hedging)
+    LLM_ROUTER_PROVIDERS: str = ""
+    LLM_ROUTER_HEDGING: bool = False
+    LLM_HEDGE_DELAY: float = 3.0  # Segundos antes del hedge mientras no hay p95 medido
+    LLM_HEDGE_MIN_DELAY: float = 0.5
+    LLM_BREAKER_FAILURES: int = 3
+    LLM_BREAKER_RESET_SECONDS: float = 30.0
+    LLM_LATENCY_EWMA_ALPHA: float = 0.3
+    
     # OpenAI 
     OPENAI_API_KEY: str = ""
     OPENAI_MODEL: str = "gpt-4o-mini"
+    OPENAI_SMALL_MODEL: str = ""  # gpt-4o-mini ya es pequeño
+    OPENAI_RPM: int = 0  # Depende del tier de la cuenta; 0 = sin límite
+    OPENAI_TPM: int = 0
     
     # Groq 
     GROQ_API_KEY: str = ""
+    GROQ_SMALL_MODEL: str = "llama-3.1-8b-instant"
+    GROQ_RPM: int = 30  # Límites del plan gratuito (peticiones y tokens por minuto)
+    GROQ_TPM: int = 12000
     
     # Google Gemini 
     GOOGLE_API_KEY: str = ""
+    GEMINI_SMALL_MODEL: str = "gemini-1.5-flash-8b"
+    GEMINI_RPM: int = 15
+    GEMINI_TPM: int = 1000000
     
     # Together AI 
     TOGETHER_API_KEY: str = ""
+    TOGETHER_SMALL_MODEL: str = "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo"
+    TOGETHER_RPM: int = 60
+    TOGETHER_TPM: int = 0
     
     # Ollama (100% local y gratis)
     OLLAMA_URL: str = "http://localhost:11434"
     OLLAMA_MODEL: str = "llama3.1"
+    OLLAMA_SMALL_MODEL: str = ""  # p. ej. "llama3.2:3b"; vacío = mismo modelo
     
    
     # PINECONE (Vector Database) - O usar embeddings locales
@@ -62,9 +91,116 @@ class Settings(BaseSettings):
     PINECONE_ENVIRONMENT: str = "us-east-1"
     PINECONE_INDEX_NAME: str = "legalbot-laws"
     
+    # Backend de búsqueda vectorial: "pinecone" o "local"
+    # "local" usa el índice en memoria generado con: python -m scripts.build_local_index
+    VECTOR_BACKEND: str = "pinecone"
+    LOCAL_INDEX_DIR: str = "./data"
+    
+    # Búsqueda híbrida: BM25 (términos exactos) + vectorial, fusionadas con RRF
+    HYBRID_SEARCH_ENABLED: bool = True
+    LEGAL_DATA_FILE: str = "./data/legal_knowledge.json"
+    RRF_K: int = 60
+    # Score BM25 mínimo de un resultado léxico que no aparece en la búsqueda densa
+    # (la densa exige similitud > 0.7); evita que un solo término común cuente como fuente
+    HYBRID_MIN_BM25_SCORE: float = 4.0
+    
+    # Re-ranking con cross-encoder local (FastEmbed/ONNX): más candidatos, menos fuentes al prompt
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "jinaai/jina-reranker-v2-base-multilingual"
+    RERANK_CANDIDATES: int = 30
+    RERANK_TOP_K: int = 3
+    
+    # Verificación de respuestas (segunda llamada al LLM): off | always | low_confidence
+    # low_confidence: solo si el mejor score vectorial o el número de fuentes queda bajo el umbral
+    VERIFICATION_MODE: str = "always"
+    VERIFICATION_MIN_SCORE: float = 0.8
+    VERIFICATION_MIN_SOURCES: int = 2
+    # Responder sin esperar la verificación; la corrección se guarda luego en el mensaje
+    VERIFICATION_ASYNC: bool = False
+    
+    # Clientes HTTP de los proveedores LLM (pool keep-alive compartido)
+    HTTP2_ENABLED: bool = True  # Requiere httpx[http2]
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 10.0
+    
+    # Reintentos ante errores transitorios (429, 5xx, red): backoff exponencial con jitter
+    # Se respetan Retry-After / x-ratelimit-reset; el presupuesto es por petición HTTP
+    RETRY_MAX_ATTEMPTS: int = 3
+    RETRY_BASE_DELAY: float = 0.5
+    RETRY_MAX_DELAY: float = 10.0
+    RETRY_BUDGET_SECONDS: float = 20.0
+    
+    # Métricas internas (/api/metrics, cabecera X-Metrics-Token). Vacío = endpoint desactivado
+    METRICS_TOKEN: str = ""
+    
+    # Single-flight: peticiones idénticas concurrentes (LLM, embeddings, Pinecone) comparten una llamada
+    SINGLE_FLIGHT_ENABLED: bool = True
+    
     # Embeddings
     EMBEDDING_MODEL: str = "text-embedding-3-small"
-    
+    # Cache de embeddings locales (FastEmbed). Path vacío = solo memoria
+    EMBEDDING_CACHE_SIZE: int = 4096
+    EMBEDDING_CACHE_PATH: str = ""
+    # Micro-batching: esperar hasta N ms o hasta juntar N textos
+    EMBEDDING_BATCH_MAX_SIZE: int = 32
+    EMBEDDING_BATCH_WAIT_MS: float = 5.0
+
+    # PIPELINE RAG - Modo: "multi" (expansión, respuesta, verificación y sugerencia por separado)
+    # o "fused" (una sola llamada con salida JSON y expansión de consulta local)
+    PIPELINE_MODE: str = "multi"
+
+    # Presupuesto de tokens del prompt (sistema + consulta + fuentes + documento + historial)
+    # Cuotas por sección; lo que una no usa pasa a las demás. Se recorta lo menos relevante
+    PROMPT_TOKEN_BUDGET: int = 6000
+    PROMPT_BUDGET_SOURCES: int = 2500
+    PROMPT_BUDGET_DOCUMENT: int = 2000
+    PROMPT_BUDGET_HISTORY: int = 1000
+    # Los tokens se estiman localmente (cada proveedor tokeniza distinto): se deja este margen libre
+    PROMPT_BUDGET_SAFETY_MARGIN: float = 0.15
+
+    # Memoria de conversación: resumen incremental + últimos mensajes literales
+    CONVERSATION_HISTORY_MESSAGES: int = 2  # Último par usuario/asistente
+    CONVERSATION_SUMMARY_MAX_TOKENS: int = 300
+
+    # PIPELINE RAG - Timeout por etapa (segundos)
+    # Una etapa lenta no debe bloquear todo el turno de chat
+    RAG_EXPANSION_TIMEOUT: float = 4.0
+    RAG_RETRIEVAL_TIMEOUT: float = 10.0
+    RAG_ANSWER_TIMEOUT: float = 45.0
+    RAG_VERIFY_TIMEOUT: float = 8.0
+    RAG_SUGGEST_TIMEOUT: float = 6.0
+    RAG_TITLE_TIMEOUT: float = 5.0
+    RAG_SUMMARY_TIMEOUT: float = 15.0
+
+    # CACHE SEMÁNTICO DE RESPUESTAS
+    # Reutiliza respuestas de consultas casi idénticas (misma categoría y modo)
+    SEMANTIC_CACHE_ENABLED: bool = True
+    SEMANTIC_CACHE_THRESHOLD: float = 0.93  # Similitud coseno mínima
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 1000
+    SEMANTIC_CACHE_TTL_SECONDS: int = 86400
+
+    # CACHE DE LLAMADAS DETERMINISTAS (temperature=0)
+    # Expansión de consulta y sugerencia de documento. Path vacío = solo memoria
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_PATH: str = "./.cache/llm_cache.db"
+    LLM_CACHE_MAX_ENTRIES: int = 2048
+    LLM_CACHE_TTL_SECONDS: int = 604800  # 7 días
+
+    # COLA DE TRABAJOS EN SEGUNDO PLANO (título, verificación asíncrona, resumen)
+    # Persistencia: Redis si REDIS_URL está configurado; si no, SQLite en JOB_QUEUE_PATH
+    JOB_QUEUE_PATH: str = "./.cache/jobs.db"
+    JOB_WORKERS: int = 2
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_BASE_DELAY: float = 2.0  # Backoff exponencial: 2s, 4s, ...
+    JOB_TIMEOUT: float = 60.0  # Por trabajo; uno en ejecución más tiempo se da por interrumpido
+    JOB_POLL_INTERVAL: float = 1.0
+    JOB_SHUTDOWN_TIMEOUT: float = 5.0
+    # Los trabajos fallidos se conservan para revisarlos, con límite de antigüedad y de cantidad
+    JOB_FAILED_RETENTION: float = 7 * 24 * 3600.0
+    JOB_FAILED_MAX: int = 1000
+
     # Culqi (Payments)
     CULQI_PUBLIC_KEY: str = ""
     CULQI_PRIVATE_KEY: str = ""
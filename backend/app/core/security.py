@@ -77,6 +77,8 @@ async def get_current_user(
             detail="Token inválido",
         )
     
+    from app.services.usage import set_usage_user  # Import local: evita el import circular con app.services
+    set_usage_user(user_id)
     return {"user_id": user_id, "email": payload.get("email")}
 
 
@@ -90,6 +92,8 @@ async def get_current_user_optional(
         token = credentials.credentials
         payload = decode_access_token(token)
         user_id = payload.get("sub")
+        from app.services.usage import set_usage_user
+        set_usage_user(user_id)
         return {"user_id": user_id, "email": payload.get("email")} if user_id else None
     except Exception:
         return None
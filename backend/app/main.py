@@ -12,6 +12,11 @@ import time
 from app.core.config import settings
 from app.core.database import init_db
 from app.api import api_router
+from app.services.job_queue import job_queue
+from app.services.lexical_index import load_lexical_index
+from app.services.llm_providers import open_llm_clients, close_llm_clients
+from app.services.retry import start_retry_budget
+from app.services.usage import start_usage_context
 
 
 @asynccontextmanager
@@ -21,9 +26,16 @@ async def lifespan(app: FastAPI):
     print("[INFO] Starting LegalBot API...")
     await init_db()
     print("[OK] Database initialized")
+    await open_llm_clients()
+    print("[OK] LLM HTTP clients ready")
+    if settings.HYBRID_SEARCH_ENABLED:
+        await load_lexical_index()  # Se construye aquí y no en la primera consulta
+    await job_queue.start()  # Retoma los trabajos pendientes de la ejecución anterior
     yield
     # Shutdown
     print("[INFO] Shutting down LegalBot API...")
+    await job_queue.stop()
+    await close_llm_clients()
 
 
 # Create FastAPI app
@@ -57,6 +69,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Paginación por cursor de las conversaciones
 )
 
 
@@ -64,6 +77,8 @@ app.add_middleware(
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
+    start_retry_budget()  # Presupuesto de reintentos LLM de esta petición
+    start_usage_context(f"{request.method} {request.url.path}")  # Tokens por endpoint/usuario
     response = await call_next(request)
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(process_time)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Enum, Text, JSON, ForeignKey
+from sqlalchemy import Column, String, DateTime, Enum, Text, JSON, ForeignKey, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -25,11 +25,18 @@ class MessageRole(str, enum.Enum):
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Listado paginado por cursor: WHERE user_id ORDER BY updated_at DESC, id DESC
+        Index("ix_conversations_user_id_updated_at_id", "user_id", "updated_at", "id"),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     title = Column(String(500), nullable=True)
     category = Column(Enum(LegalCategory), default=LegalCategory.GENERAL)
+    summary = Column(Text, nullable=True)  # Resumen incremental de los turnos anteriores al último
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")  # Se mantiene al guardar cada turno
+    summarized_count = Column(Integer, nullable=False, default=0, server_default="0")  # Mensajes (desde el inicio) ya incorporados a summary
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -40,13 +47,18 @@ class Conversation(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Historial por conversación en orden cronológico (cubre también los filtros por conversation_id)
+        Index("ix_messages_conversation_id_created_at", "conversation_id", "created_at"),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"), nullable=False, index=True)
+    conversation_id = Column(UUID(as_uuid=True), ForeignKey("conversations.id"), nullable=False)
     role = Column(Enum(MessageRole), nullable=False)
     content = Column(Text, nullable=False)
     sources = Column(JSON, nullable=True)  # List of legal sources
     feedback = Column(String(20), nullable=True)  # "positive", "negative", null
+    correction = Column(Text, nullable=True)  # Corrección de la verificación en segundo plano
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
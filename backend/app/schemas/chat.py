@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Union
 from datetime import datetime
 from uuid import UUID
 from app.models.conversation import LegalCategory
@@ -10,6 +10,15 @@ class LegalSource(BaseModel):
     law: str
     article: str
     category: str
+    score: Optional[float] = None  # Similitud vectorial (None si viene de BM25 o del fallback)
+
+
+class LegalSourceRef(BaseModel):
+    """Referencia a una fuente sin su texto (historial con include_sources=false)"""
+    law: str
+    article: str
+    category: str
+    score: Optional[float] = None
 
 
 class MessageCreate(BaseModel):
@@ -24,7 +33,8 @@ class MessageResponse(BaseModel):
     conversation_id: UUID
     role: str
     content: str
-    sources: Optional[List[LegalSource]] = None
+    sources: Optional[List[Union[LegalSource, LegalSourceRef]]] = None
+    correction: Optional[str] = None  # Corrección de la verificación en segundo plano
     created_at: datetime
     
     class Config:
@@ -45,6 +55,10 @@ class ConversationResponse(BaseModel):
 
 class ConversationDetailResponse(ConversationResponse):
     messages: List[MessageResponse] = []
+    # Paginación: la página anterior se pide con before=<id del primer mensaje>
+    # y la siguiente con after=<id del último>
+    has_older: bool = False
+    has_newer: bool = False
 
 
 class ChatResponse(BaseModel):
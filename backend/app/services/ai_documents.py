@@ -2,6 +2,7 @@ import json
 import logging
 from typing import Dict, Any, List, Optional
 from app.services.llm_providers import get_global_llm
+from app.services.llm_cache import cached_chat
 from app.api.documents import TEMPLATES_CONFIG
 
 logger = logging.getLogger(__name__)
@@ -63,7 +64,8 @@ async def extract_fields_from_chat(
         response = await get_global_llm().chat(
             messages=[{"role": "user", "content": prompt}],
             temperature=0.1, # Muy baja temperatura para extracción precisa
-            max_tokens=500
+            max_tokens=500,
+            task="extract"
         )
 
         # 6. Limpiar y parsear JSON
@@ -106,10 +108,11 @@ HISTORIAL RECIENTE:
 RESPUESTA (ID o "none"):"""
 
     try:
-        response = await get_global_llm().chat(
+        response = await cached_chat(
             messages=[{"role": "user", "content": prompt}],
             temperature=0.0,
-            max_tokens=10
+            max_tokens=10,
+            task="suggest"
         )
         result = response.strip().lower()
         
@@ -0,0 +1,95 @@
+"""
+Micro-batching de embeddings locales
+
+Bajo carga, cada petición de chat llamaba a `embed([texto])` por separado y
+FastEmbed/ONNX nunca veía un lote mayor que uno. El batcher junta las
+peticiones concurrentes durante unos milisegundos (o hasta N textos), hace
+una sola llamada `embed` en el thread pool y resuelve el future de cada una.
+"""
+
+import asyncio
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """
+    Agrupa peticiones concurrentes de embedding en lotes.
+
+    Solo se ejecuta un lote a la vez (ONNX ya usa todos los núcleos); las
+    peticiones que llegan mientras tanto forman el siguiente lote.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[np.ndarray]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.texts = 0
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Encolar un texto y esperar su vector"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        self._schedule()
+        return await future
+
+    def _schedule(self) -> None:
+        if self._running:
+            return  # Se despacha al terminar el lote en curso
+        if len(self._pending) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._dispatch)
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running or not self._pending:
+            return
+        batch = self._pending[:self.max_batch_size]
+        del self._pending[:self.max_batch_size]
+        self._running = True
+        self._task = asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        # Textos repetidos dentro del lote se calculan una sola vez
+        texts = list(dict.fromkeys(text for text, future in batch if not future.done()))
+        try:
+            if texts:
+                loop = asyncio.get_running_loop()
+                vectors = await loop.run_in_executor(None, self.embed_fn, texts)
+                by_text = dict(zip(texts, vectors))
+                self.batches += 1
+                self.texts += len(texts)
+                for text, future in batch:
+                    if not future.done():
+                        future.set_result(by_text[text])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._running = False
+            if self._pending:
+                # Lo acumulado durante este lote ya esperó; se despacha de inmediato
+                self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "pending": len(self._pending),
+        }
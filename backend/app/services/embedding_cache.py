@@ -0,0 +1,130 @@
+"""
+Cache de embeddings locales (FastEmbed)
+
+El embedding de MiniLM es trabajo de CPU; la misma consulta expandida no
+debería calcularse dos veces. Los vectores se guardan como arrays float32
+(1.5 KB por vector en lugar de una lista de 384 floats de Python) en:
+- Memoria: LRU acotado
+- Disco (opcional): tabla SQLite con el vector en bytes
+"""
+
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+
+def normalize_text(text: str) -> str:
+    """Normalizar texto para la clave del cache (Unicode NFC y espacios)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class EmbeddingCache:
+    """LRU de vectores float32 con un nivel opcional en SQLite"""
+
+    def __init__(self, model_name: str, max_entries: int, path: str = ""):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.path = path
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_key(self, text: str) -> str:
+        # El modelo forma parte de la clave: cambiar de modelo invalida el disco
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _disk_get(self, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (self._disk_key(text),)
+            ).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+    def _disk_set(self, text: str, vector: np.ndarray) -> None:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                (self._disk_key(text), vector.tobytes(), time.time()),
+            )
+            conn.commit()
+
+    def _remember(self, text: str, vector: np.ndarray) -> None:
+        self._memory[text] = vector
+        self._memory.move_to_end(text)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, text: str) -> Optional[np.ndarray]:
+        """Buscar el vector de un texto ya normalizado"""
+        vector = self._memory.get(text)
+        if vector is not None:
+            self._memory.move_to_end(text)
+            self.memory_hits += 1
+            return vector
+
+        if self.path:
+            loop = asyncio.get_running_loop()
+            try:
+                vector = await loop.run_in_executor(None, self._disk_get, text)
+            except sqlite3.Error as e:
+                print(f"[WARN] Cache de embeddings en disco no disponible: {e}")
+            if vector is not None:
+                self._remember(text, vector)
+                self.disk_hits += 1
+                return vector
+
+        self.misses += 1
+        return None
+
+    async def set(self, text: str, vector: np.ndarray) -> None:
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(text, vector)
+        if self.path:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._disk_set, text, vector)
+            except sqlite3.Error as e:
+                print(f"[WARN] No se pudo guardar el embedding en disco: {e}")
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,176 @@
+"""
+Modo de pipeline "fused": una sola llamada al LLM por turno
+
+En el modo "multi" cada turno hace hasta cuatro llamadas (expansión de
+consulta, respuesta, verificación y sugerencia de documento). En el modo
+"fused" (PIPELINE_MODE) la respuesta se pide como JSON con tres campos:
+
+    {"answer": "...", "document": "<id o none>", "grounded": true}
+
+- answer: la respuesta en Markdown (se emite por streaming mientras llega)
+- document: plantilla de documento sugerida (sustituye a suggest_document_template)
+- grounded: autoverificación del modelo (sustituye a la llamada de verificación)
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.api.documents import TEMPLATES_CONFIG
+
+# Tokens extra sobre los 1500 de la respuesta: escapar el Markdown dentro del string
+# JSON (\n, \", \u00e1 si el modelo no emite UTF-8) encarece la respuesta un 20-30 %,
+# más las claves y los otros dos campos. Con poco margen el JSON se corta antes de "grounded"
+FUSED_EXTRA_TOKENS = 500
+
+FUSED_OUTPUT_PROMPT = """
+## FORMATO DE SALIDA (OBLIGATORIO)
+Responda ÚNICAMENTE con un objeto JSON válido, sin texto antes ni después, con estas claves en este orden:
+{{"answer": "<respuesta completa en Markdown con la estructura indicada arriba>", "document": "<ID del documento que el usuario necesita redactar, o none>", "grounded": <true si cada afirmación legal de la respuesta está respaldada por el contexto legal, false si no>}}
+
+DOCUMENTOS DISPONIBLES:
+{templates}"""
+
+
+@dataclass
+class FusedOutput:
+    answer: str
+    document: Optional[str]
+    # None si el modelo no devolvió JSON válido (se aplica la política de verificación normal)
+    grounded: Optional[bool]
+
+
+def fused_instructions() -> str:
+    """Formato JSON y lista de plantillas que se añaden al prompt del sistema"""
+    templates = "\n".join(f"- {t['id']}: {t['name']} ({t['description']})" for t in TEMPLATES_CONFIG)
+    return FUSED_OUTPUT_PROMPT.format(templates=templates)
+
+
+def with_fused_instructions(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Añadir al prompt del sistema el formato JSON y la lista de plantillas"""
+    instructions = fused_instructions()
+    if messages and messages[0]["role"] == "system":
+        return [{"role": "system", "content": messages[0]["content"] + instructions}] + messages[1:]
+    return [{"role": "system", "content": instructions.strip()}] + messages
+
+
+def _document_id(value) -> Optional[str]:
+    doc_id = str(value or "").strip().lower()
+    return doc_id if any(t["id"] == doc_id for t in TEMPLATES_CONFIG) else None
+
+
+def parse_fused_output(text: str, streamed_answer: Optional[str] = None) -> FusedOutput:
+    """
+    Interpretar la salida del modelo. Si no es JSON válido (p. ej. cortado por
+    max_tokens) se usa como respuesta lo ya emitido por streaming o, si no, el campo
+    "answer" recuperado con el mismo decodificador incremental; sin sugerencia ni
+    autoverificación. Solo un texto que no es JSON se devuelve tal cual.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    try:
+        data = json.loads(text[start:end + 1]) if start != -1 and end > start else None
+    except json.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get("answer"), str):
+        print("[WARN] Salida fused sin JSON válido; se recupera el campo answer")
+        answer = streamed_answer
+        if not answer:
+            stream = FusedAnswerStream()
+            stream.feed(text)
+            answer = stream.answer
+        return FusedOutput(answer=answer.strip() or text.strip(), document=None, grounded=None)
+
+    grounded = data.get("grounded")
+    return FusedOutput(
+        answer=data["answer"].strip(),
+        document=_document_id(data.get("document")),
+        grounded=grounded if isinstance(grounded, bool) else None,
+    )
+
+
+_ANSWER_START_RE = re.compile(r'"answer"\s*:\s*"')
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", '"': '"', "\\": "\\", "/": "/"}
+
+
+class FusedAnswerStream:
+    """
+    Extrae el campo "answer" del JSON a medida que llegan los fragmentos, para
+    seguir mostrando la respuesta token a token. Si el modelo no responde en
+    JSON, el texto se emite tal cual.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.answer = ""
+        self._plain: Optional[bool] = None
+        self._pos: Optional[int] = None  # Siguiente carácter por decodificar del valor de "answer"
+        self._closed = False
+
+    def feed(self, chunk: str) -> str:
+        """Añadir un fragmento y devolver el texto nuevo de la respuesta (puede ser "")"""
+        self.buffer += chunk
+        if self._plain is None:
+            stripped = self.buffer.lstrip()
+            if not stripped:
+                return ""
+            self._plain = stripped[0] not in "{`"  # JSON o bloque ```json
+            if self._plain:
+                return self._emit(self.buffer)
+        if self._plain:
+            return self._emit(chunk)
+        if self._closed:
+            return ""
+        if self._pos is None:
+            match = _ANSWER_START_RE.search(self.buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+        return self._emit(self._decode())
+
+    def _emit(self, text: str) -> str:
+        self.answer += text
+        return text
+
+    def _decode(self) -> str:
+        """Decodificar el string JSON desde _pos; un escape incompleto espera al siguiente fragmento"""
+        out = []
+        buf, i = self.buffer, self._pos
+        while i < len(buf):
+            char = buf[i]
+            if char == '"':
+                self._closed = True
+                break
+            if char != "\\":
+                out.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(buf):
+                break
+            escape = buf[i + 1]
+            if escape != "u":
+                out.append(_ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            try:
+                code = int(buf[i + 2:i + 6], 16)
+            except ValueError:  # \u mal formado: se omite
+                i += 2
+                continue
+            if 0xD800 <= code < 0xDC00:  # Par sustituto (emojis escapados como \\ud83d\\udccc)
+                if i + 12 > len(buf):
+                    break
+                try:
+                    low = int(buf[i + 8:i + 12], 16)
+                except ValueError:
+                    i += 6
+                    continue
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+                continue
+            out.append(chr(code))
+            i += 6
+        self._pos = i
+        return "".join(out)
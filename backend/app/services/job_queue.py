@@ -0,0 +1,447 @@
+"""
+Cola de trabajos en segundo plano
+
+El título de una conversación nueva, la verificación asíncrona y el resumen de
+la conversación no hacen falta para responder al usuario. Los endpoints los
+encolan aquí y responden enseguida; un pool acotado de workers (JOB_WORKERS)
+los ejecuta con reintentos y backoff exponencial, y cada handler escribe su
+resultado en la base de datos.
+
+Los trabajos (nombre + payload JSON) se persisten y sobreviven a un reinicio:
+- Redis si REDIS_URL está configurado (varias instancias comparten la cola)
+- SQLite en JOB_QUEUE_PATH en otro caso (path vacío = solo memoria)
+
+Un trabajo que quedó a medias (proceso caído) vuelve a la cola cuando lleva
+más de JOB_TIMEOUT segundos en ejecución. Los fallidos se conservan para
+revisarlos hasta JOB_FAILED_RETENTION segundos (como máximo JOB_FAILED_MAX).
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.core.config import settings
+
+JobHandler = Callable[[dict], Awaitable[None]]
+
+
+@dataclass
+class Job:
+    name: str
+    payload: dict
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+    run_at: float = field(default_factory=time.time)
+    error: Optional[str] = None
+    failed_at: Optional[float] = None
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> "Job":
+        return cls(**json.loads(data))
+
+
+class SQLiteJobBackend:
+    """Tabla SQLite local (se accede desde el thread pool)"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path or ":memory:", check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, name TEXT NOT NULL, payload TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL, run_at REAL NOT NULL, "
+                "status TEXT NOT NULL, error TEXT, started_at REAL, failed_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs (status, run_at)")
+            self._conn.commit()
+        return self._conn
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> list:
+        # Las filas se leen con el lock tomado: la conexión es compartida entre threads
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def _claim(self, now: float) -> Optional[Job]:
+        with self._lock:
+            conn = self._connect()
+            while True:
+                row = conn.execute(
+                    "SELECT id, name, payload, attempts, run_at, error FROM jobs "
+                    "WHERE status = 'pending' AND run_at <= ? ORDER BY run_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    return None
+                claimed = conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'pending'",
+                    (now, row[0]),
+                ).rowcount
+                conn.commit()
+                if claimed:
+                    break
+                # Otro proceso con el mismo archivo lo tomó antes: se prueba con el siguiente
+        return Job(id=row[0], name=row[1], payload=json.loads(row[2]), attempts=row[3], run_at=row[4], error=row[5])
+
+    async def start(self) -> None:
+        await self._run(self._connect)
+
+    async def close(self) -> None:
+        pass
+
+    async def push(self, job: Job) -> None:
+        await self._run(
+            self._execute,
+            "INSERT INTO jobs (id, name, payload, attempts, run_at, status) VALUES (?, ?, ?, ?, ?, 'pending')",
+            (job.id, job.name, json.dumps(job.payload, ensure_ascii=False), job.attempts, job.run_at),
+        )
+
+    async def claim(self) -> Optional[Job]:
+        return await self._run(self._claim, time.time())
+
+    async def complete(self, job: Job) -> None:
+        await self._run(self._execute, "DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    async def retry(self, job: Job) -> None:
+        await self._run(
+            self._execute,
+            "UPDATE jobs SET status = 'pending', attempts = ?, run_at = ?, error = ? WHERE id = ?",
+            (job.attempts, job.run_at, job.error, job.id),
+        )
+
+    def _fail(self, job: Job) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', attempts = ?, error = ?, failed_at = ? WHERE id = ?",
+                (job.attempts, job.error, job.failed_at, job.id),
+            )
+            # Retención de los fallidos: por antigüedad y por cantidad
+            conn.execute(
+                "DELETE FROM jobs WHERE status = 'failed' AND failed_at < ?",
+                (job.failed_at - settings.JOB_FAILED_RETENTION,),
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status = 'failed' "
+                "ORDER BY failed_at DESC LIMIT -1 OFFSET ?)",
+                (settings.JOB_FAILED_MAX,),
+            )
+            conn.commit()
+
+    async def fail(self, job: Job) -> None:
+        # Los fallidos se conservan para poder revisarlos
+        await self._run(self._fail, job)
+
+    async def recover(self, started_before: float) -> int:
+        cursor = await self._run(
+            self._execute,
+            "UPDATE jobs SET status = 'pending' WHERE status = 'running' AND started_at < ?",
+            (started_before,),
+        )
+        return cursor.rowcount
+
+    async def counts(self) -> Dict[str, int]:
+        return dict(await self._run(self._fetchall, "SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+
+# Tomar el primer trabajo pendiente en una sola operación atómica: ningún otro
+# worker (de cualquier instancia) puede verlo entre ZREM y HSET. Los ids sin datos
+# (huérfanos) se descartan y se sigue con el siguiente.
+# KEYS: pending, running, data - ARGV: ahora
+_CLAIM_SCRIPT = """
+while true do
+    local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+    if #ids == 0 then
+        return false
+    end
+    redis.call('ZREM', KEYS[1], ids[1])
+    local data = redis.call('HGET', KEYS[3], ids[1])
+    if data then
+        redis.call('HSET', KEYS[2], ids[1], ARGV[1])
+        return data
+    end
+end
+"""
+
+
+class RedisJobBackend:
+    """
+    Redis: los trabajos en un hash, los pendientes en un sorted set por run_at
+    y los que están en ejecución en un hash con la hora de inicio. Los fallidos
+    van a una lista acotada (JOB_FAILED_MAX) que expira tras JOB_FAILED_RETENTION
+    sin fallos nuevos.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "legalbot:jobs"):
+        self.url = url
+        self.prefix = prefix
+        self._redis = None
+        self._claim_script = None
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    async def start(self) -> None:
+        import redis.asyncio as aioredis
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+        await self._redis.ping()
+        self._claim_script = self._redis.register_script(_CLAIM_SCRIPT)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+
+    async def push(self, job: Job) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key("data"), job.id, job.to_json())
+            pipe.zadd(self._key("pending"), {job.id: job.run_at})
+            await pipe.execute()
+
+    async def claim(self) -> Optional[Job]:
+        data = await self._claim_script(
+            keys=[self._key("pending"), self._key("running"), self._key("data")],
+            args=[time.time()],
+        )
+        return Job.from_json(data) if data else None
+
+    async def complete(self, job: Job) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._key("data"), job.id)
+            pipe.hdel(self._key("running"), job.id)
+            await pipe.execute()
+
+    async def retry(self, job: Job) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key("data"), job.id, job.to_json())
+            pipe.hdel(self._key("running"), job.id)
+            pipe.zadd(self._key("pending"), {job.id: job.run_at})
+            await pipe.execute()
+
+    async def fail(self, job: Job) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._key("data"), job.id)
+            pipe.hdel(self._key("running"), job.id)
+            pipe.lpush(self._key("failed"), job.to_json())
+            pipe.ltrim(self._key("failed"), 0, settings.JOB_FAILED_MAX - 1)
+            pipe.expire(self._key("failed"), int(settings.JOB_FAILED_RETENTION))
+            await pipe.execute()
+
+    async def recover(self, started_before: float) -> int:
+        running = await self._redis.hgetall(self._key("running"))
+        stale = [job_id for job_id, started in running.items() if float(started) < started_before]
+        for job_id in stale:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.hdel(self._key("running"), job_id)
+                pipe.zadd(self._key("pending"), {job_id: time.time()})
+                await pipe.execute()
+        return len(stale)
+
+    async def counts(self) -> Dict[str, int]:
+        return {
+            "pending": await self._redis.zcard(self._key("pending")),
+            "running": await self._redis.hlen(self._key("running")),
+            "failed": await self._redis.llen(self._key("failed")),
+        }
+
+
+class JobQueue:
+    """Cola con handlers registrados por nombre y un pool fijo de workers"""
+
+    def __init__(self):
+        self._handlers: Dict[str, JobHandler] = {}
+        self.backend = None
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self._last_recovery = 0.0
+        self.enqueued = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def handler(self, name: str) -> Callable[[JobHandler], JobHandler]:
+        """Registrar el handler de un tipo de trabajo: @job_queue.handler("nombre")"""
+        def register(fn: JobHandler) -> JobHandler:
+            self._handlers[name] = fn
+            return fn
+        return register
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def _open_backend(self):
+        if settings.REDIS_URL:
+            backend = RedisJobBackend(settings.REDIS_URL)
+            try:
+                await backend.start()
+                return backend
+            except Exception as e:  # Paquete redis no instalado o servidor no disponible
+                print(f"[WARN] Cola de trabajos: Redis no disponible ({type(e).__name__}: {e}); se usa SQLite")
+        backend = SQLiteJobBackend(settings.JOB_QUEUE_PATH)
+        await backend.start()
+        return backend
+
+    async def start(self) -> None:
+        """Abrir el backend, recuperar los trabajos interrumpidos y lanzar los workers"""
+        if self._workers:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._workers:
+                return
+            self.backend = await self._open_backend()
+            self._wakeup = asyncio.Event()
+            self._stopping = False
+            await self._recover()
+            self._workers = [
+                asyncio.create_task(self._worker()) for _ in range(max(1, settings.JOB_WORKERS))
+            ]
+            print(f"[OK] Cola de trabajos lista ({self.backend.name}, {len(self._workers)} workers)")
+
+    async def stop(self) -> None:
+        """Esperar a los trabajos en curso (hasta JOB_SHUTDOWN_TIMEOUT); los pendientes quedan persistidos"""
+        if not self._workers:
+            return
+        workers, self._workers = self._workers, []
+        self._stopping = True
+        self._wakeup.set()
+        _, unfinished = await asyncio.wait(workers, timeout=settings.JOB_SHUTDOWN_TIMEOUT)
+        for worker in unfinished:
+            worker.cancel()
+        if unfinished:
+            await asyncio.wait(unfinished)
+        await self.backend.close()
+
+    async def enqueue(self, name: str, payload: dict, delay: float = 0.0) -> Optional[str]:
+        """Encolar un trabajo. Nunca falla: un error de la cola no debe romper la petición"""
+        if name not in self._handlers:
+            print(f"[WARN] Cola de trabajos: no hay handler para '{name}'")
+            return None
+        try:
+            await self.start()
+            job = Job(name=name, payload=payload, run_at=time.time() + delay)
+            await self.backend.push(job)
+        except Exception as e:
+            print(f"[WARN] No se pudo encolar el trabajo '{name}': {e}")
+            return None
+        self.enqueued += 1
+        self._wakeup.set()
+        return job.id
+
+    async def _recover(self) -> None:
+        self._last_recovery = time.time()
+        recovered = await self.backend.recover(self._last_recovery - settings.JOB_TIMEOUT)
+        if recovered:
+            print(f"🔁 [Jobs] {recovered} trabajos interrumpidos vuelven a la cola")
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                if time.time() - self._last_recovery > settings.JOB_TIMEOUT:
+                    await self._recover()
+                job = await self.backend.claim()
+            except Exception as e:
+                print(f"[WARN] Cola de trabajos no disponible: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: Job) -> None:
+        # Contextos propios: el trabajo no gasta el presupuesto de reintentos de ninguna petición
+        from app.services.retry import start_retry_budget
+        from app.services.usage import start_usage_context
+        start_retry_budget()
+        start_usage_context(f"job:{job.name}")
+
+        handler = self._handlers.get(job.name)
+        try:
+            if handler is None:
+                raise LookupError(f"sin handler para '{job.name}'")
+            await asyncio.wait_for(handler(job.payload), timeout=settings.JOB_TIMEOUT)
+        except asyncio.CancelledError:
+            # Apagado: el trabajo vuelve a la cola sin contar como intento
+            try:
+                job.run_at = time.time()
+                await self.backend.retry(job)
+            except Exception:
+                pass  # Se recupera igualmente al pasar JOB_TIMEOUT
+            raise
+        except Exception as e:
+            job.attempts += 1
+            job.error = f"{type(e).__name__}: {e}"
+            try:
+                if job.attempts < settings.JOB_MAX_ATTEMPTS:
+                    job.run_at = time.time() + settings.JOB_RETRY_BASE_DELAY * 2 ** (job.attempts - 1)
+                    await self.backend.retry(job)
+                    self.retried += 1
+                    print(f"[WARN] Trabajo '{job.name}' falló (intento {job.attempts}), se reintenta: {job.error}")
+                else:
+                    job.failed_at = time.time()
+                    await self.backend.fail(job)
+                    self.failed += 1
+                    print(f"[WARN] Trabajo '{job.name}' descartado tras {job.attempts} intentos: {job.error}")
+            except Exception as backend_error:
+                print(f"[WARN] No se pudo reprogramar el trabajo '{job.name}': {backend_error}")
+            return
+        try:
+            await self.backend.complete(job)
+        except Exception as e:
+            print(f"[WARN] No se pudo marcar como terminado el trabajo '{job.name}': {e}")
+        self.completed += 1
+
+    async def stats(self) -> dict:
+        result = {
+            "backend": self.backend.name if self.backend else None,
+            "workers": len(self._workers),
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+        if self.backend is not None and self._workers:
+            try:
+                result["queued"] = await self.backend.counts()
+            except Exception as e:
+                result["queued"] = {"error": str(e)}
+        return result
+
+
+job_queue = JobQueue()
@@ -0,0 +1,180 @@
+"""
+Índice léxico BM25 para búsqueda híbrida
+
+La búsqueda densa (MiniLM) no distingue bien términos exactos como
+"D.S. 003-97-TR" o "CTS". Este índice invertido en memoria, construido del
+mismo corpus que se sube a Pinecone (data/legal_knowledge.json), puntúa con
+BM25 sobre tokens en minúsculas y sin tildes. Los pesos BM25 de cada término
+se precalculan al construir el índice: una consulta solo suma arrays.
+"""
+
+import re
+import json
+import asyncio
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+# Palabras vacías frecuentes en consultas y textos legales
+STOPWORDS = {
+    "a", "al", "ante", "con", "como", "cual", "de", "del", "el", "en", "es", "esta", "este",
+    "la", "las", "le", "lo", "los", "me", "mi", "mis", "no", "o", "para", "por", "que",
+    "se", "si", "sin", "su", "sus", "un", "una", "uno", "y", "ya",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# Identificadores compuestos: "003-97-tr", "d.s.", "d.leg."
+_COMPOUND_RE = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)+\.?|(?:[a-z]\.){2,}")
+
+
+def fold_accents(text: str) -> str:
+    """Minúsculas y sin tildes (NFKD sin marcas combinantes)"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens para BM25. Los identificadores compuestos se indexan también enteros."""
+    folded = fold_accents(text)
+    tokens = [t for t in _TOKEN_RE.findall(folded) if t not in STOPWORDS]
+    for compound in _COMPOUND_RE.findall(folded):
+        tokens.append(re.sub(r"\.", "", compound))
+    return tokens
+
+
+def document_id(article: dict) -> str:
+    """Mismo id ASCII con el que el artículo se sube a Pinecone (para fusionar resultados)"""
+    raw = unicodedata.normalize("NFKD", article.get("id", ""))
+    return raw.encode("ascii", "ignore").decode("ascii").strip()
+
+
+def document_text(article: dict) -> str:
+    """Campos del artículo que participan en la búsqueda léxica"""
+    return " ".join(
+        str(article.get(field, ""))
+        for field in ("ley", "numero_ley", "articulo", "titulo", "texto", "libro")
+    )
+
+
+class BM25Index:
+    """Índice invertido con pesos BM25 precalculados por (término, documento)"""
+
+    def __init__(self, articles: List[dict], k1: float = 1.5, b: float = 0.75):
+        self.articles = articles
+        self.categories = np.asarray([a.get("categoria", "general") for a in articles])
+        doc_tokens = [tokenize(document_text(a)) for a in articles]
+        n_docs = len(doc_tokens)
+        lengths = np.asarray([len(tokens) for tokens in doc_tokens], dtype=np.float32)
+        avg_length = float(lengths.mean()) if n_docs else 0.0
+        norms = k1 * (1 - b + b * lengths / avg_length) if avg_length else np.full(n_docs, k1)
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, tokens in enumerate(doc_tokens):
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        # term -> (ids de documento, peso BM25 del término en cada documento)
+        self._weights: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for term, entries in postings.items():
+            ids = np.asarray([doc_id for doc_id, _ in entries], dtype=np.int64)
+            tf = np.asarray([tf for _, tf in entries], dtype=np.float32)
+            df = len(entries)
+            idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            self._weights[term] = (ids, (idf * tf * (k1 + 1) / (tf + norms[ids])).astype(np.float32))
+
+    @classmethod
+    def from_file(cls, path: str) -> "BM25Index":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def __len__(self) -> int:
+        return len(self.articles)
+
+    def search(self, query: str, top_k: int = 5, category: Optional[str] = None) -> List[dict]:
+        """Mismo formato de salida que search_pinecone (score = puntaje BM25)"""
+        terms = [t for t in set(tokenize(query)) if t in self._weights]
+        if not terms:
+            return []
+
+        scores = np.zeros(len(self.articles), dtype=np.float32)
+        for term in terms:
+            ids, weights = self._weights[term]
+            scores[ids] += weights  # ids únicos por término
+        if category and category != "general":
+            scores[self.categories != category] = 0.0
+
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        k = min(top_k, len(candidates))
+        best = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        best = best[np.argsort(-scores[best])]
+
+        results = []
+        for doc_id in best:
+            article = self.articles[int(doc_id)]
+            results.append({
+                "id": document_id(article),
+                "text": article.get("texto", ""),
+                "law": article.get("ley", "Documento"),
+                "article": article.get("articulo", ""),
+                "score": float(scores[doc_id]),
+                "jurisdiction": article.get("jurisdiction", "Peru"),
+            })
+        return results
+
+
+def reciprocal_rank_fusion(result_lists: List[List[dict]], top_k: int, k: int = 60) -> List[dict]:
+    """
+    Fusionar listas de resultados por Reciprocal Rank Fusion.
+    Cada documento suma 1 / (k + rank) por cada lista en la que aparece.
+    """
+    fused: Dict[str, dict] = {}
+    totals: Dict[str, float] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = doc.get("id") or f"{doc['law']}|{doc['article']}"
+            fused.setdefault(key, doc)
+            totals[key] = totals.get(key, 0.0) + 1.0 / (k + rank)
+
+    ranked = sorted(totals, key=totals.get, reverse=True)[:top_k]
+    return [{**fused[key], "rrf_score": totals[key]} for key in ranked]
+
+
+_lexical_index = None
+_lexical_index_loaded = False
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index() -> Optional[BM25Index]:
+    """
+    Construir el índice BM25 una sola vez (Lazy Load). None si no hay corpus.
+    Es trabajo de CPU: desde código async usar load_lexical_index.
+    """
+    global _lexical_index, _lexical_index_loaded
+    if _lexical_index_loaded:
+        return _lexical_index
+    with _lexical_index_lock:  # Llamadas concurrentes esperan a la primera construcción
+        if _lexical_index_loaded:
+            return _lexical_index
+        try:
+            _lexical_index = BM25Index.from_file(settings.LEGAL_DATA_FILE)
+            print(f"[OK] Índice léxico BM25 construido ({len(_lexical_index)} documentos)")
+        except FileNotFoundError:
+            print(f"[WARN] Corpus no encontrado en {settings.LEGAL_DATA_FILE}; búsqueda léxica desactivada")
+        except Exception as e:
+            print(f"[WARN] Índice léxico no disponible: {e}")
+        _lexical_index_loaded = True
+    return _lexical_index
+
+
+async def load_lexical_index() -> Optional[BM25Index]:
+    """get_lexical_index en el thread pool: la construcción no bloquea el event loop"""
+    if _lexical_index_loaded:
+        return _lexical_index
+    return await asyncio.get_running_loop().run_in_executor(None, get_lexical_index)
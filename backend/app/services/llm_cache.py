@@ -0,0 +1,185 @@
+"""
+Cache persistente para llamadas deterministas al LLM (temperature=0)
+
+La expansión de consultas y la sugerencia de documentos se repiten con las
+mismas entradas en cada petición. La respuesta se guarda por contenido
+(proveedor, modelo, mensajes y parámetros) en dos niveles:
+- Memoria: LRU acotado
+- Disco: tabla SQLite que sobrevive a reinicios (LRU + TTL al escribir)
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+from app.services.llm_providers import get_global_llm
+
+
+class LLMResponseCache:
+    """Cache de dos niveles (LRU en memoria + SQLite) indexado por hash de contenido"""
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(provider: str, model: str, messages: List[Dict[str, str]], params: dict) -> str:
+        payload = json.dumps(
+            {"provider": provider, "model": model, "messages": messages, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # ── Nivel en disco (SQLite, se ejecuta en el thread pool) ──────────
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL)"
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(llm_cache)")}
+            if "accessed_at" not in columns:  # Cache creado antes del LRU en disco
+                self._conn.execute("ALTER TABLE llm_cache ADD COLUMN accessed_at REAL")
+                self._conn.execute("UPDATE llm_cache SET accessed_at = created_at")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+            return row
+
+    def _disk_set(self, key: str, response: str, created_at: float) -> None:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, response, created_at, created_at),
+            )
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            # Como en memoria: como máximo max_entries, se descartan las menos usadas
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+
+    # ── API ─────────────────────────────────────────────────────────────
+
+    def _remember(self, key: str, response: str, created_at: float) -> None:
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry and now - entry[1] < self.ttl_seconds:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry[0]
+
+        loop = asyncio.get_running_loop()
+        try:
+            row = await loop.run_in_executor(None, self._disk_get, key)
+        except sqlite3.Error as e:
+            print(f"[WARN] Cache LLM en disco no disponible: {e}")
+            row = None
+        if row and now - row[1] < self.ttl_seconds:
+            self._remember(key, row[0], row[1])
+            self.disk_hits += 1
+            return row[0]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, response: str) -> None:
+        created_at = time.time()
+        self._remember(key, response, created_at)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._disk_set, key, response, created_at)
+        except sqlite3.Error as e:
+            print(f"[WARN] No se pudo guardar en cache LLM: {e}")
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+        }
+
+
+llm_cache = LLMResponseCache(
+    path=settings.LLM_CACHE_PATH,
+    max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+)
+
+
+async def cached_chat(
+    messages: List[Dict[str, str]],
+    temperature: float = 0.0,
+    max_tokens: int = 1500,
+    task: str = "answer"
+) -> str:
+    """
+    chat() del LLM global con cache por contenido.
+    Solo se cachean llamadas deterministas (temperature=0).
+    """
+    llm = get_global_llm()
+    if not settings.LLM_CACHE_ENABLED or temperature != 0.0:
+        return await llm.chat(messages=messages, temperature=temperature, max_tokens=max_tokens, task=task)
+
+    # Proveedor y modelo reales (no el nombre de las capas que lo envuelven):
+    # cambiar de LLM_PROVIDER o de modelo no reutiliza respuestas del anterior
+    key = llm_cache.make_key(
+        llm.name,
+        llm.model_for(task),
+        messages,
+        {"temperature": temperature, "max_tokens": max_tokens},
+    )
+    cached = await llm_cache.get(key)
+    if cached is not None:
+        return cached
+
+    response = await llm.chat(messages=messages, temperature=temperature, max_tokens=max_tokens, task=task)
+    await llm_cache.set(key, response)
+    return response
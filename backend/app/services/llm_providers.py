@@ -4,29 +4,152 @@ Soporta: Groq (gratis), Google Gemini (gratis), Ollama (local), OpenAI
 """
 
 import os
+import json
+import asyncio
 import httpx
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional
+from typing import AsyncIterator, Callable, List, Dict, Optional
 from app.core.config import settings
+from app.services.usage import record_usage, usage_tokens
+
+
+def _http2_available() -> bool:
+    """HTTP/2 en httpx requiere el paquete opcional h2 (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+HTTP2_AVAILABLE = _http2_available()
+
+
+def create_http_client(http2: bool = True) -> httpx.AsyncClient:
+    """Cliente HTTP con pool de conexiones keep-alive (y HTTP/2 si está disponible)"""
+    return httpx.AsyncClient(
+        http2=http2 and settings.HTTP2_ENABLED and HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(60.0, connect=settings.HTTP_CONNECT_TIMEOUT),
+    )
 
 
 class LLMProvider(ABC):
     """Clase base para proveedores de LLM"""
     
+    # Cliente HTTP compartido por todas las llamadas del proveedor
+    http2: bool = True
+    _http: Optional[httpx.AsyncClient] = None
+    
+    name: str = ""
+    model: str = ""
+    # Modelo pequeño y rápido para tareas auxiliares (LLM_SMALL_MODEL_TASKS)
+    small_model: str = ""
+    
+    def model_for(self, task: str) -> str:
+        """Modelo que atiende una tarea: el pequeño para las auxiliares, si está configurado"""
+        if self.small_model and task in settings.LLM_SMALL_MODEL_TASKS:
+            return self.small_model
+        return self.model
+    
+    def json_output(self, task: str) -> bool:
+        """Si la tarea espera un objeto JSON (se pide JSON mode a la API)"""
+        return task in settings.LLM_JSON_TASKS
+    
+    def _record_usage(self, task: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """Registrar los tokens que reporta el proveedor para una llamada"""
+        record_usage(f"{self.name}:{self.model_for(task)}", task, prompt_tokens, completion_tokens)
+    
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """
+        Cliente con pool de conexiones: evita un handshake TCP+TLS por llamada.
+        Se abre en el lifespan de la app (o al primer uso, p. ej. en scripts).
+        """
+        if self._http is None or self._http.is_closed:
+            self._http = create_http_client(self.http2)
+        return self._http
+    
+    async def open(self) -> None:
+        """Crear el cliente HTTP del proveedor"""
+        self.http  # La propiedad lo crea si no existe
+    
+    async def aclose(self) -> None:
+        """Cerrar el cliente HTTP y sus conexiones"""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
     @abstractmethod
     async def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.4,
-        max_tokens: int = 1500
+        max_tokens: int = 1500,
+        task: str = "answer"
     ) -> str:
-        """Enviar mensaje y obtener respuesta"""
+        """
+        Enviar mensaje y obtener respuesta.
+        `task` identifica la llamada (answer, expansion, verify, title...) para
+        priorizarla en el rate limiter.
+        """
         pass
     
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        """
+        Enviar mensaje y recibir la respuesta por fragmentos (tokens).
+        Por defecto emite la respuesta completa como un único fragmento.
+        """
+        yield await self.chat(messages, temperature=temperature, max_tokens=max_tokens, task=task)
+    
     @abstractmethod
     async def embed(self, text: str) -> List[float]:
         """Generar embedding de texto"""
         pass
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generar embeddings de varios textos (mismo orden que `texts`).
+        Por defecto llama a embed() en paralelo; los proveedores con API por
+        lotes lo hacen en una sola petición.
+        """
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+
+async def _iter_openai_sse(
+    response: httpx.Response,
+    on_usage: Optional[Callable[[dict], None]] = None
+) -> AsyncIterator[str]:
+    """
+    Leer un stream SSE con formato OpenAI (Groq, Together) y emitir el texto de cada delta.
+    El último chunk trae el `usage` (Groq lo anida en `x_groq`).
+    """
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            break
+        chunk = json.loads(payload)
+        usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+        if usage and on_usage is not None:
+            on_usage(usage)
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
 
 
 
@@ -39,43 +162,104 @@ class GroqProvider(LLMProvider):
     Límites gratis: 30 requests/min, 14,400/día
     """
     
+    name = "groq"
+    
     def __init__(self):
         self.api_key = settings.GROQ_API_KEY or ""
         self.base_url = "https://api.groq.com/openai/v1"
         self.model = "llama-3.3-70b-versatile"  
+        self.small_model = settings.GROQ_SMALL_MODEL
         
     async def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.4,
-        max_tokens: int = 1500
+        max_tokens: int = 1500,
+        task: str = "answer"
     ) -> str:
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.model,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens
-                    },
-                    timeout=60.0
-                )
-                response.raise_for_status()
-                data = response.json()
-                return data["choices"][0]["message"]["content"]
-            except httpx.HTTPStatusError as e:
-                print(f"❌ Groq API Error: {e.response.text}")
-                raise e
+        payload = {
+            "model": self.model_for(task),
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if self.json_output(task):
+            payload["response_format"] = {"type": "json_object"}
+        try:
+            response = await self.http.post(
+                f"{self.base_url}/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json=payload,
+                timeout=60.0
+            )
+            response.raise_for_status()
+            data = response.json()
+            self._record_usage(task, *usage_tokens(data.get("usage")))
+            return data["choices"][0]["message"]["content"]
+        except httpx.HTTPStatusError as e:
+            # En JSON mode Groq responde 400 si la salida no valida (p. ej. cortada por
+            # max_tokens) pero devuelve el texto generado: se usa y lo interpreta quien llama
+            failed = self._failed_generation(e.response)
+            if failed is not None:
+                print("[WARN] Groq: salida JSON inválida, se usa el texto generado")
+                return failed
+            print(f"❌ Groq API Error: {e.response.text}")
+            raise e
+    
+    @staticmethod
+    def _failed_generation(response: httpx.Response) -> Optional[str]:
+        if response.status_code != 400:
+            return None
+        try:
+            error = response.json().get("error") or {}
+        except ValueError:
+            return None
+        if error.get("code") != "json_validate_failed":
+            return None
+        return error.get("failed_generation")
+    
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        # Groq no admite JSON mode con streaming: FusedAnswerStream tolera la salida libre
+        async with self.http.stream(
+            "POST",
+            f"{self.base_url}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": self.model_for(task),
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True
+            },
+            timeout=60.0
+        ) as response:
+            if response.is_error:
+                await response.aread()
+                print(f"❌ Groq API Error: {response.text}")
+            response.raise_for_status()
+            async for delta in _iter_openai_sse(
+                response, lambda usage: self._record_usage(task, *usage_tokens(usage))
+            ):
+                yield delta
     
     async def embed(self, text: str) -> List[float]:
         # Groq no tiene embeddings, usar alternativa local
         return await get_local_embeddings(text)
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return await get_local_embeddings_batch(texts)
 
 
 
@@ -88,18 +272,75 @@ class GeminiProvider(LLMProvider):
     Límites gratis: 15 requests/min, 1,500/día, 1M tokens/día
     """
     
+    name = "gemini"
+    
     def __init__(self):
         self.api_key = settings.GOOGLE_API_KEY or ""
         self.base_url = "https://generativelanguage.googleapis.com/v1beta"
         self.model = "gemini-1.5-flash"  # Gratis y rápido
+        self.small_model = settings.GEMINI_SMALL_MODEL
         
     async def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.4,
-        max_tokens: int = 1500
+        max_tokens: int = 1500,
+        task: str = "answer"
     ) -> str:
-        # Convertir formato OpenAI a Gemini
+        response = await self.http.post(
+            f"{self.base_url}/models/{self.model_for(task)}:generateContent",
+            params={"key": self.api_key},
+            headers={"Content-Type": "application/json"},
+            json=self._build_payload(messages, temperature, max_tokens, self.json_output(task)),
+            timeout=60.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        self._record_usage(task, *self._usage_tokens(data))
+        return data["candidates"][0]["content"]["parts"][0]["text"]
+    
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        async with self.http.stream(
+            "POST",
+            f"{self.base_url}/models/{self.model_for(task)}:streamGenerateContent",
+            params={"key": self.api_key, "alt": "sse"},
+            headers={"Content-Type": "application/json"},
+            json=self._build_payload(messages, temperature, max_tokens, self.json_output(task)),
+            timeout=60.0
+        ) as response:
+            response.raise_for_status()
+            usage = (0, 0)
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                chunk = json.loads(line[len("data:"):].strip())
+                # usageMetadata es acumulado: vale el del último chunk
+                usage = self._usage_tokens(chunk) if chunk.get("usageMetadata") else usage
+                for candidate in chunk.get("candidates", []):
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            yield part["text"]
+            self._record_usage(task, *usage)
+    
+    @staticmethod
+    def _usage_tokens(data: dict) -> tuple:
+        metadata = data.get("usageMetadata") or {}
+        return metadata.get("promptTokenCount", 0), metadata.get("candidatesTokenCount", 0)
+    
+    def _build_payload(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        max_tokens: int,
+        json_output: bool = False
+    ) -> dict:
+        """Convertir formato OpenAI a Gemini"""
         gemini_messages = []
         system_instruction = None
         
@@ -113,39 +354,54 @@ class GeminiProvider(LLMProvider):
                     "parts": [{"text": msg["content"]}]
                 })
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/models/{self.model}:generateContent",
-                params={"key": self.api_key},
-                headers={"Content-Type": "application/json"},
-                json={
-                    "contents": gemini_messages,
-                    "systemInstruction": {"parts": [{"text": system_instruction}]} if system_instruction else None,
-                    "generationConfig": {
-                        "temperature": temperature,
-                        "maxOutputTokens": max_tokens
-                    }
-                },
-                timeout=60.0
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data["candidates"][0]["content"]["parts"][0]["text"]
+        generation_config = {
+            "temperature": temperature,
+            "maxOutputTokens": max_tokens
+        }
+        if json_output:
+            generation_config["responseMimeType"] = "application/json"
+        
+        return {
+            "contents": gemini_messages,
+            "systemInstruction": {"parts": [{"text": system_instruction}]} if system_instruction else None,
+            "generationConfig": generation_config
+        }
     
     async def embed(self, text: str) -> List[float]:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/models/text-embedding-004:embedContent",
+        response = await self.http.post(
+            f"{self.base_url}/models/text-embedding-004:embedContent",
+            params={"key": self.api_key},
+            json={
+                "model": "models/text-embedding-004",
+                "content": {"parts": [{"text": text}]}
+            },
+            timeout=30.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data["embedding"]["values"]
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        # batchEmbedContents acepta hasta 100 textos por petición
+        for start in range(0, len(texts), 100):
+            response = await self.http.post(
+                f"{self.base_url}/models/text-embedding-004:batchEmbedContents",
                 params={"key": self.api_key},
                 json={
-                    "model": "models/text-embedding-004",
-                    "content": {"parts": [{"text": text}]}
+                    "requests": [
+                        {
+                            "model": "models/text-embedding-004",
+                            "content": {"parts": [{"text": text}]}
+                        }
+                        for text in texts[start:start + 100]
+                    ]
                 },
-                timeout=30.0
+                timeout=60.0
             )
             response.raise_for_status()
-            data = response.json()
-            return data["embedding"]["values"]
+            vectors.extend(item["values"] for item in response.json()["embeddings"])
+        return vectors
 
 
 
@@ -161,78 +417,184 @@ class OllamaProvider(LLMProvider):
     Requiere: 8GB RAM mínimo, 16GB recomendado
     """
     
+    name = "ollama"
+    http2 = False  # Servidor local en HTTP/1.1
+    
     def __init__(self):
         self.base_url = settings.OLLAMA_URL or "http://localhost:11434"
         self.model = settings.OLLAMA_MODEL or "llama3.1"
+        self.small_model = settings.OLLAMA_SMALL_MODEL
         self.embed_model = "nomic-embed-text"
         
     async def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.4,
-        max_tokens: int = 1500
+        max_tokens: int = 1500,
+        task: str = "answer"
     ) -> str:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/api/chat",
-                json={
-                    "model": self.model,
-                    "messages": messages,
-                    "stream": False,
-                    "options": {
-                        "temperature": temperature,
-                        "num_predict": max_tokens
-                    }
-                },
-                timeout=120.0  # Modelos locales pueden ser lentos
-            )
+        response = await self.http.post(
+            f"{self.base_url}/api/chat",
+            json={
+                "model": self.model_for(task),
+                "messages": messages,
+                "stream": False,
+                **({"format": "json"} if self.json_output(task) else {}),
+                "options": {
+                    "temperature": temperature,
+                    "num_predict": max_tokens
+                }
+            },
+            timeout=120.0  # Modelos locales pueden ser lentos
+        )
+        response.raise_for_status()
+        data = response.json()
+        self._record_usage(task, data.get("prompt_eval_count", 0), data.get("eval_count", 0))
+        return data["message"]["content"]
+    
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        async with self.http.stream(
+            "POST",
+            f"{self.base_url}/api/chat",
+            json={
+                "model": self.model_for(task),
+                "messages": messages,
+                "stream": True,
+                **({"format": "json"} if self.json_output(task) else {}),
+                "options": {
+                    "temperature": temperature,
+                    "num_predict": max_tokens
+                }
+            },
+            timeout=120.0
+        ) as response:
             response.raise_for_status()
-            data = response.json()
-            return data["message"]["content"]
+            # Ollama responde con una línea JSON por fragmento
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                content = chunk.get("message", {}).get("content")
+                if content:
+                    yield content
+                if chunk.get("done"):
+                    self._record_usage(task, chunk.get("prompt_eval_count", 0), chunk.get("eval_count", 0))
+                    break
     
     async def embed(self, text: str) -> List[float]:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/api/embeddings",
-                json={
-                    "model": self.embed_model,
-                    "prompt": text
-                },
-                timeout=30.0
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data["embedding"]
+        response = await self.http.post(
+            f"{self.base_url}/api/embeddings",
+            json={
+                "model": self.embed_model,
+                "prompt": text
+            },
+            timeout=30.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data["embedding"]
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        # /api/embed acepta una lista de textos en "input"
+        response = await self.http.post(
+            f"{self.base_url}/api/embed",
+            json={
+                "model": self.embed_model,
+                "input": texts
+            },
+            timeout=60.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data["embeddings"]
 
 
 class OpenAIProvider(LLMProvider):
     """OpenAI - GPT-4o, de pago"""
     
+    name = "openai"
+    
     def __init__(self):
-        from openai import AsyncOpenAI
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        self._client = None
+        self._client_http: Optional[httpx.AsyncClient] = None
         self.model = settings.OPENAI_MODEL
+        self.small_model = settings.OPENAI_SMALL_MODEL
+    
+    @property
+    def client(self):
+        """
+        Cliente del SDK sobre el cliente HTTP con pool del proveedor. Se rehace
+        si aclose() cerró ese cliente (p. ej. tras un reinicio del lifespan).
+        """
+        http = self.http
+        if self._client is None or self._client_http is not http:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, http_client=http)
+            self._client_http = http
+        return self._client
         
     async def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.4,
-        max_tokens: int = 1500
+        max_tokens: int = 1500,
+        task: str = "answer"
     ) -> str:
         response = await self.client.chat.completions.create(
-            model=self.model,
+            model=self.model_for(task),
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            **self._response_format(task)
         )
+        self._record_usage(task, *usage_tokens(response.usage))
         return response.choices[0].message.content
     
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model_for(task),
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            **self._response_format(task),
+            # Último chunk con el usage (stream_options no existe aún como parámetro en este SDK)
+            extra_body={"stream_options": {"include_usage": True}}
+        )
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                self._record_usage(task, *usage_tokens(chunk.usage))
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    def _response_format(self, task: str) -> dict:
+        return {"response_format": {"type": "json_object"}} if self.json_output(task) else {}
+    
     async def embed(self, text: str) -> List[float]:
         response = await self.client.embeddings.create(
             model="text-embedding-3-small",
             input=text
         )
         return response.data[0].embedding
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        response = await self.client.embeddings.create(
+            model="text-embedding-3-small",
+            input=texts
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
 
 
@@ -245,50 +607,144 @@ class TogetherProvider(LLMProvider):
     Modelos: Llama, Mistral, Qwen, etc.
     """
     
+    name = "together"
+    
     def __init__(self):
         self.api_key = settings.TOGETHER_API_KEY or ""
         self.base_url = "https://api.together.xyz/v1"
         self.model = "meta-llama/Llama-3.2-11B-Vision-Instruct-Turbo"
+        self.small_model = settings.TOGETHER_SMALL_MODEL
         
     async def chat(
         self,
         messages: List[Dict[str, str]],
         temperature: float = 0.4,
-        max_tokens: int = 1500
+        max_tokens: int = 1500,
+        task: str = "answer"
     ) -> str:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": self.model,
-                    "messages": messages,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens
-                },
-                timeout=60.0
-            )
+        response = await self.http.post(
+            f"{self.base_url}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": self.model_for(task),
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            },
+            timeout=60.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        self._record_usage(task, *usage_tokens(data.get("usage")))
+        return data["choices"][0]["message"]["content"]
+    
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        async with self.http.stream(
+            "POST",
+            f"{self.base_url}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": self.model_for(task),
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True
+            },
+            timeout=60.0
+        ) as response:
             response.raise_for_status()
-            data = response.json()
-            return data["choices"][0]["message"]["content"]
+            async for delta in _iter_openai_sse(
+                response, lambda usage: self._record_usage(task, *usage_tokens(usage))
+            ):
+                yield delta
     
     async def embed(self, text: str) -> List[float]:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/embeddings",
-                headers={"Authorization": f"Bearer {self.api_key}"},
-                json={
-                    "model": "togethercomputer/m2-bert-80M-8k-retrieval",
-                    "input": text
-                },
-                timeout=30.0
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data["data"][0]["embedding"]
+        response = await self.http.post(
+            f"{self.base_url}/embeddings",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json={
+                "model": "togethercomputer/m2-bert-80M-8k-retrieval",
+                "input": text
+            },
+            timeout=30.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        return data["data"][0]["embedding"]
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        response = await self.http.post(
+            f"{self.base_url}/embeddings",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            json={
+                "model": "togethercomputer/m2-bert-80M-8k-retrieval",
+                "input": texts
+            },
+            timeout=60.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        return [item["embedding"] for item in sorted(data["data"], key=lambda item: item["index"])]
+
+
+class ProviderWrapper(LLMProvider):
+    """
+    Base para las capas que envuelven a otro proveedor (rate limiting,
+    reintentos, single-flight). Por defecto delega todo en `provider`.
+    """
+    
+    def __init__(self, provider: LLMProvider):
+        self.provider = provider
+        self.name = getattr(provider, "name", "")
+        self.model = getattr(provider, "model", "")
+    
+    def model_for(self, task: str) -> str:
+        return self.provider.model_for(task)
+    
+    async def open(self) -> None:
+        await self.provider.open()
+    
+    async def aclose(self) -> None:
+        await self.provider.aclose()
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> str:
+        return await self.provider.chat(messages, temperature=temperature, max_tokens=max_tokens, task=task)
+    
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        async for delta in self.provider.chat_stream(
+            messages, temperature=temperature, max_tokens=max_tokens, task=task
+        ):
+            yield delta
+    
+    async def embed(self, text: str) -> List[float]:
+        return await self.provider.embed(text)
+    
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return await self.provider.embed_batch(texts)
 
 
 
@@ -296,42 +752,111 @@ class TogetherProvider(LLMProvider):
 # Global cache for embedding model
 _embedding_model = None
 
-import asyncio
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+import numpy as np
+from app.services.embedding_cache import EmbeddingCache, normalize_text
+from app.services.embedding_batcher import EmbeddingBatcher
+
+embedding_cache = EmbeddingCache(
+    model_name=LOCAL_EMBEDDING_MODEL,
+    max_entries=settings.EMBEDDING_CACHE_SIZE,
+    path=settings.EMBEDDING_CACHE_PATH,
+)
+
+
+def _get_embedding_model():
+    """Cargar el modelo FastEmbed una sola vez (importación lazy)"""
+    global _embedding_model
+    if _embedding_model is None:
+        from fastembed import TextEmbedding
+        _embedding_model = TextEmbedding(model_name=LOCAL_EMBEDDING_MODEL)
+    return _embedding_model
+
+
+def _embed_batch_sync(texts: List[str]) -> List[np.ndarray]:
+    """Un solo llamado a FastEmbed para todo el lote (se ejecuta en el thread pool)"""
+    model = _get_embedding_model()
+    return [np.asarray(vector, dtype=np.float32) for vector in model.embed(texts, batch_size=len(texts))]
+
+
+# Junta las peticiones concurrentes en lotes para FastEmbed/ONNX
+embedding_batcher = EmbeddingBatcher(
+    _embed_batch_sync,
+    max_batch_size=settings.EMBEDDING_BATCH_MAX_SIZE,
+    max_wait_ms=settings.EMBEDDING_BATCH_WAIT_MS,
+)
+
 
 async def get_local_embeddings(text: str) -> List[float]:
     """
     Embeddings locales usando FastEmbed, ejecutado en ThreadPool 
     para no bloquear el Event Loop de FastAPI.
+    Los textos ya calculados se sirven desde el cache de embeddings y las
+    peticiones concurrentes se agrupan en lotes (micro-batching).
     """
-    global _embedding_model
-    
-    # Definir la función sincrónica que hace el trabajo pesado
-    def _generate_sync(text_input: str):
-        global _embedding_model
-        if _embedding_model is None:
-            # Importación lazy y setup
-            from fastembed import TextEmbedding
-            _embedding_model = TextEmbedding(model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-            
-        return list(_embedding_model.embed([text_input]))[0].tolist()
+    key = normalize_text(text)
+    cached = await embedding_cache.get(key)
+    if cached is not None:
+        return cached.tolist()
 
     try:
-        # Ejecutar en thread pool
-        loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, _generate_sync, text)
+        vector = await embedding_batcher.embed(key)
+        await embedding_cache.set(key, vector)
+        return vector.tolist()
         
     except Exception as e:
         print(f"❌ Error en FastEmbed: {e}")
-        # Fallback básico si falla el modelo
-        import hashlib
-        vector = []
-        for i in range(384):
-            hash_input = f"{text}_{i}".encode()
-            hash_val = int(hashlib.md5(hash_input).hexdigest(), 16)
-            vector.append((hash_val % 1000) / 1000 - 0.5)
-        return vector
+        # Fallback básico si falla el modelo (no se guarda en cache)
+        return _hash_embedding(text)
+
+
+async def get_local_embeddings_batch(texts: List[str]) -> List[List[float]]:
+    """
+    Embeddings locales de varios textos: los que no están en cache se calculan
+    en una sola llamada a FastEmbed (thread pool).
+    """
+    keys = [normalize_text(text) for text in texts]
+    vectors = {}
+    for key in dict.fromkeys(keys):
+        cached = await embedding_cache.get(key)
+        if cached is not None:
+            vectors[key] = cached
+    missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+
+    if missing:
+        try:
+            loop = asyncio.get_running_loop()
+            computed = await loop.run_in_executor(None, _embed_batch_sync, missing)
+            for key, vector in zip(missing, computed):
+                await embedding_cache.set(key, vector)
+                vectors[key] = vector
+        except Exception as e:
+            print(f"❌ Error en FastEmbed (lote): {e}")
+            return [vectors[key].tolist() if key in vectors else _hash_embedding(text) for key, text in zip(keys, texts)]
+
+    return [vectors[key].tolist() for key in keys]
 
 
+def _hash_embedding(text: str) -> List[float]:
+    """Vector determinista por hash (último recurso si FastEmbed no está disponible)"""
+    import hashlib
+    vector = []
+    for i in range(384):
+        hash_input = f"{text}_{i}".encode()
+        hash_val = int(hashlib.md5(hash_input).hexdigest(), 16)
+        vector.append((hash_val % 1000) / 1000 - 0.5)
+    return vector
+
+
+
+
+PROVIDER_RATE_LIMITS = {
+    "groq": (settings.GROQ_RPM, settings.GROQ_TPM),
+    "gemini": (settings.GEMINI_RPM, settings.GEMINI_TPM),
+    "together": (settings.TOGETHER_RPM, settings.TOGETHER_TPM),
+    "openai": (settings.OPENAI_RPM, settings.OPENAI_TPM),
+}
 
 
 def get_llm_provider(provider_name: Optional[str] = None) -> LLMProvider:
@@ -339,10 +864,18 @@ def get_llm_provider(provider_name: Optional[str] = None) -> LLMProvider:
     Obtener el proveedor de LLM configurado
     
     Prioridad:
-    1. Variable de entorno LLM_PROVIDER
-    2. Parámetro provider_name
-    3. Detectar automáticamente según API keys disponibles
+    1. Parámetro provider_name
+    2. LLM_ROUTER_PROVIDERS con dos o más proveedores (router)
+    3. Variable de entorno LLM_PROVIDER
+    4. Detectar automáticamente según API keys disponibles
     """
+    # Router multi-proveedor (failover y hedging) si hay varios configurados
+    router_names = [n.strip().lower() for n in settings.LLM_ROUTER_PROVIDERS.split(",") if n.strip()]
+    if provider_name is None and len(router_names) > 1:
+        from app.services.llm_router import RouterProvider
+        print(f"[LLM] Router con proveedores: {', '.join(n.upper() for n in router_names)}")
+        return RouterProvider({name: get_llm_provider(name) for name in router_names})
+    
     # Usar settings en lugar de os.getenv para leer del .env correctamente
     provider = provider_name or settings.LLM_PROVIDER or "auto"
     
@@ -371,7 +904,14 @@ def get_llm_provider(provider_name: Optional[str] = None) -> LLMProvider:
         raise ValueError(f"Proveedor '{provider}' no soportado. Usa: {list(providers.keys())}")
     
     print(f"[LLM] Usando proveedor: {provider.upper()}")
-    return providers[provider]()
+    instance = providers[provider]()
+    
+    # Límites del plan (peticiones y tokens por minuto, por modelo); 0 = sin límite
+    rpm, tpm = PROVIDER_RATE_LIMITS.get(provider, (0, 0))
+    if rpm or tpm:
+        from app.services.rate_limiter import RateLimitedProvider
+        return RateLimitedProvider(instance, rpm=rpm, tpm=tpm)
+    return instance
 
 
 _llm_instance = None
@@ -379,5 +919,20 @@ _llm_instance = None
 def get_global_llm() -> LLMProvider:
     global _llm_instance
     if _llm_instance is None:
-        _llm_instance = get_llm_provider()
-    return _llm_instance
\ No newline at end of file
+        # Reintentos ante errores transitorios y, por encima, las llamadas
+        # idénticas concurrentes comparten una sola petición
+        from app.services.retry import RetryingProvider
+        from app.services.single_flight import SingleFlightProvider
+        _llm_instance = SingleFlightProvider(RetryingProvider(get_llm_provider()))
+    return _llm_instance
+
+
+async def open_llm_clients() -> None:
+    """Abrir los clientes HTTP del proveedor global (lifespan de la app)"""
+    await get_global_llm().open()
+
+
+async def close_llm_clients() -> None:
+    """Cerrar los clientes HTTP del proveedor global (lifespan de la app)"""
+    if _llm_instance is not None:
+        await _llm_instance.aclose()
\ No newline at end of file
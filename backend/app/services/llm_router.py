@@ -0,0 +1,305 @@
+"""
+Router de proveedores LLM con failover, hedging y circuit breakers
+
+Envuelve varios proveedores configurados (LLM_ROUTER_PROVIDERS) detrás de la
+misma interfaz LLMProvider:
+- Cada proveedor tiene un circuit breaker: tras N fallos seguidos (429, 5xx,
+  errores de red) se deja de usar durante un tiempo y luego se prueba de nuevo.
+- Se elige primero el proveedor con menor latencia media (EWMA).
+- Un 429/5xx hace failover al siguiente proveedor sano.
+- Con hedging, si el primero no respondió tras su p95 de latencia se lanza la
+  misma petición a un segundo proveedor y gana la primera respuesta.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from app.core.config import settings
+from app.services.llm_providers import LLMProvider
+from app.services.retry import is_retryable
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """El proveedor no admite llamadas ahora (circuito abierto o prueba half_open en curso)"""
+
+
+class CircuitBreaker:
+    """
+    closed -> open tras `failure_threshold` fallos seguidos -> half_open tras `reset_timeout`
+    En half_open pasa una sola llamada de prueba; su resultado cierra o reabre el circuito.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.probing)
+
+    def acquire(self) -> bool:
+        """Reservar una llamada; en half_open solo la primera (la prueba)"""
+        if not self.allow():
+            return False
+        if self.state == "half_open":
+            self.probing = True
+        return True
+
+    def release(self) -> None:
+        """Fin de la llamada (también si se canceló o falló sin decidir el estado)"""
+        self.probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        # En half_open un solo fallo vuelve a abrir el circuito
+        if self.failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class LatencyStats:
+    """EWMA de latencia y ventana de muestras recientes para el p95"""
+
+    def __init__(self, alpha: float = 0.3, window: int = 100):
+        self.alpha = alpha
+        self.ewma: Optional[float] = None
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.ewma = seconds if self.ewma is None else self.alpha * seconds + (1 - self.alpha) * self.ewma
+
+    def p95(self, min_samples: int = 10) -> Optional[float]:
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class RouterProvider(LLMProvider):
+    """LLMProvider que reparte las llamadas entre varios proveedores"""
+
+    def __init__(self, providers: Dict[str, LLMProvider]):
+        if not providers:
+            raise ValueError("El router necesita al menos un proveedor")
+        self.providers = providers
+        self.order = list(providers)
+        self.breakers = {
+            name: CircuitBreaker(settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET_SECONDS)
+            for name in self.order
+        }
+        self.latency = {name: LatencyStats(settings.LLM_LATENCY_EWMA_ALPHA) for name in self.order}
+        self.calls = {name: 0 for name in self.order}
+        self.errors = {name: 0 for name in self.order}
+        self.failovers = 0
+        self.hedges = 0
+        # Clave del cache de respuestas (llm_cache)
+        self.name = "router"
+        self.model = ",".join(f"{name}:{getattr(p, 'model', '')}" for name, p in providers.items())
+
+    def model_for(self, task: str) -> str:
+        return ",".join(f"{name}:{p.model_for(task)}" for name, p in self.providers.items())
+
+    async def open(self) -> None:
+        for provider in self.providers.values():
+            await provider.open()
+
+    async def aclose(self) -> None:
+        for provider in self.providers.values():
+            await provider.aclose()
+
+    def candidates(self) -> List[str]:
+        """Proveedores con el circuito cerrado, del más rápido al más lento (EWMA)"""
+        healthy = [name for name in self.order if self.breakers[name].allow()]
+        # Sin muestras se respeta el orden configurado, detrás de los ya medidos
+        return sorted(
+            healthy,
+            key=lambda name: (self.latency[name].ewma is None, self.latency[name].ewma or 0.0, self.order.index(name)),
+        )
+
+    def hedge_delay(self, name: str) -> float:
+        p95 = self.latency[name].p95()
+        return max(settings.LLM_HEDGE_MIN_DELAY, p95) if p95 is not None else settings.LLM_HEDGE_DELAY
+
+    async def _call(self, name: str, call: Callable[[LLMProvider], Awaitable[T]]) -> T:
+        """Una llamada a un proveedor, registrando latencia y estado del breaker"""
+        breaker = self.breakers[name]
+        if not breaker.acquire():
+            raise CircuitOpenError(name)
+        self.calls[name] += 1
+        t0 = time.monotonic()
+        try:
+            result = await call(self.providers[name])
+        except Exception as e:
+            self.errors[name] += 1
+            if is_retryable(e):
+                breaker.record_failure()
+            raise
+        finally:
+            # Un perdedor de hedge cancelado no registra latencia: su muestra parcial bajaría EWMA y p95
+            breaker.release()
+        self.latency[name].record(time.monotonic() - t0)
+        breaker.record_success()
+        return result
+
+    async def _failover(
+        self,
+        names: List[str],
+        call: Callable[[LLMProvider], Awaitable[T]],
+        last_error: Optional[BaseException] = None,
+    ) -> T:
+        """Probar los proveedores en orden hasta que uno responda"""
+        for name in names:
+            if last_error is not None:
+                self.failovers += 1
+                print(f"[LLM Router] Failover a {name.upper()} ({type(last_error).__name__}: {last_error})")
+            try:
+                return await self._call(name, call)
+            except CircuitOpenError:
+                continue  # Otra llamada está probando este proveedor (half_open)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                last_error = e
+        if last_error is None:
+            raise RuntimeError("Ningún proveedor LLM disponible (circuitos abiertos)")
+        raise last_error
+
+    async def _hedged(self, names: List[str], call: Callable[[LLMProvider], Awaitable[T]]) -> T:
+        """Si el primero tarda más que su p95, lanzar la misma petición al segundo"""
+        primary = asyncio.ensure_future(self._call(names[0], call))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay(names[0]))
+            if done:
+                error = primary.exception()
+                if error is None:
+                    return primary.result()
+                if isinstance(error, CircuitOpenError):
+                    return await self._failover(names[1:], call)
+                if not is_retryable(error):
+                    raise error
+                return await self._failover(names[1:], call, error)
+
+            self.hedges += 1
+            print(f"[LLM Router] Hedging: {names[0].upper()} lento, lanzando {names[1].upper()}")
+            tasks.append(asyncio.ensure_future(self._call(names[1], call)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    if isinstance(task.exception(), CircuitOpenError):
+                        continue
+                    error = task.exception()
+                    if not is_retryable(error):
+                        raise error
+            return await self._failover(names[2:], call, error)
+        finally:
+            # El perdedor (o todo, si cancelan la llamada) no sigue consumiendo cuota
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _route(self, call: Callable[[LLMProvider], Awaitable[T]]) -> T:
+        names = self.candidates()
+        if settings.LLM_ROUTER_HEDGING and len(names) > 1:
+            return await self._hedged(names, call)
+        return await self._failover(names, call)
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> str:
+        return await self._route(
+            lambda provider: provider.chat(messages, temperature=temperature, max_tokens=max_tokens, task=task)
+        )
+
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        """
+        Failover solo antes del primer fragmento: una respuesta ya mostrada al
+        usuario no se puede continuar con otro proveedor. Sin hedging.
+        """
+        last_error: Optional[BaseException] = None
+        for name in self.candidates():
+            breaker = self.breakers[name]
+            if not breaker.acquire():
+                continue  # Otra llamada está probando este proveedor (half_open)
+            if last_error is not None:
+                self.failovers += 1
+                print(f"[LLM Router] Failover (stream) a {name.upper()} ({type(last_error).__name__})")
+            self.calls[name] += 1
+            started = False
+            try:
+                async for delta in self.providers[name].chat_stream(
+                    messages, temperature=temperature, max_tokens=max_tokens, task=task
+                ):
+                    started = True
+                    yield delta
+            except Exception as e:
+                self.errors[name] += 1
+                if is_retryable(e):
+                    breaker.record_failure()
+                if started or not is_retryable(e):
+                    raise
+                last_error = e
+                continue
+            finally:
+                breaker.release()
+            breaker.record_success()
+            return
+        if last_error is None:
+            raise RuntimeError("Ningún proveedor LLM disponible (circuitos abiertos)")
+        raise last_error
+
+    async def embed(self, text: str) -> List[float]:
+        # Sin failover: cada proveedor tiene su propio espacio vectorial
+        return await self.providers[self.order[0]].embed(text)
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return await self.providers[self.order[0]].embed_batch(texts)
+
+    def stats(self) -> dict:
+        return {
+            "failovers": self.failovers,
+            "hedges": self.hedges,
+            "providers": {
+                name: {
+                    "state": self.breakers[name].state,
+                    "ewma_latency": round(self.latency[name].ewma, 3) if self.latency[name].ewma is not None else None,
+                    "p95_latency": self.latency[name].p95(),
+                    "calls": self.calls[name],
+                    "errors": self.errors[name],
+                }
+                for name in self.order
+            },
+        }
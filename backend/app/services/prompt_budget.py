@@ -0,0 +1,226 @@
+"""
+Presupuesto de tokens del prompt
+
+El prompt de cada turno junta el prompt del sistema, todas las fuentes
+recuperadas, hasta 10.000 caracteres del documento del usuario y los últimos
+mensajes del historial, sin ningún límite. Aquí se estiman los tokens y se
+reparte un presupuesto fijo (PROMPT_TOKEN_BUDGET) entre fuentes, documento e
+historial. Lo que no cabe se recorta empezando por lo menos relevante:
+- fuentes: las de peor ranking (ya vienen ordenadas por RRF / re-ranking)
+- documento: los fragmentos con menos términos de la consulta (BM25 simplificado)
+- historial: los mensajes más antiguos
+El prompt del sistema y la consulta no se recortan.
+
+El conteo es una ESTIMACIÓN local (palabras en trozos de ~4 caracteres): cada
+proveedor usa su propio tokenizador (Llama, Gemini, GPT) y no hay uno exacto
+para todos. Por eso solo se usa PROMPT_TOKEN_BUDGET menos un margen de
+seguridad (PROMPT_BUDGET_SAFETY_MARGIN).
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.schemas.chat import LegalSource
+from app.services.lexical_index import tokenize
+
+# Orden en que se reparte el presupuesto sobrante de otras secciones
+SECTION_PRIORITY = ("sources", "document", "history")
+
+# Tokens de formato por fuente y por mensaje (encabezados, comillas, rol)
+SOURCE_OVERHEAD = 12
+MESSAGE_OVERHEAD = 4
+
+# Tamaño aproximado de los fragmentos en que se divide el documento del usuario
+DOCUMENT_CHUNK_CHARS = 600
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def _piece_tokens(piece: str) -> int:
+    # Los tokenizadores BPE parten las palabras largas en trozos de ~4 caracteres
+    return math.ceil(len(piece) / 4)
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Tokens estimados de un texto"""
+    if not text:
+        return 0
+    return sum(_piece_tokens(piece) for piece in _PIECE_RE.findall(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Recortar un texto a `max_tokens` (por el final, o por el inicio con keep_end)"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    pieces = list(_PIECE_RE.finditer(text))
+    used = 0
+    cut = len(text) if keep_end else 0
+    for match in (reversed(pieces) if keep_end else pieces):
+        used += _piece_tokens(match.group())
+        if used > max_tokens:
+            break
+        cut = match.start() if keep_end else match.end()
+    kept = text[cut:] if keep_end else text[:cut]
+    return f"…{kept}" if keep_end else f"{kept}…"
+
+
+def source_tokens(source: LegalSource) -> int:
+    return count_tokens(f"{source.law} {source.article} {source.text}") + SOURCE_OVERHEAD
+
+
+def message_tokens(message: dict) -> int:
+    return count_tokens(message.get("content")) + MESSAGE_OVERHEAD
+
+
+def allocate(needs: Dict[str, int], shares: Dict[str, int], available: int) -> Dict[str, int]:
+    """
+    Repartir `available` tokens entre secciones: cada una recibe hasta su cuota
+    (escaladas si no caben) y lo que una no usa pasa a las demás por SECTION_PRIORITY.
+    """
+    available = max(0, available)
+    total_share = sum(shares.values())
+    if total_share > available:
+        shares = {name: share * available // total_share for name, share in shares.items()}
+    allocation = {name: min(needs[name], shares[name]) for name in needs}
+    spare = available - sum(allocation.values())
+    for name in SECTION_PRIORITY:
+        extra = max(0, min(spare, needs[name] - allocation[name]))
+        allocation[name] += extra
+        spare -= extra
+    return allocation
+
+
+def fit_sources(sources: List[LegalSource], budget: int) -> List[LegalSource]:
+    """Quedarse con las fuentes mejor rankeadas que caben; la primera se recorta si hace falta"""
+    kept, used = [], 0
+    for source in sources:
+        cost = source_tokens(source)
+        if used + cost <= budget:
+            kept.append(source)
+            used += cost
+        elif not kept:
+            room = budget - (cost - count_tokens(source.text))
+            if room > 0:
+                kept.append(source.model_copy(update={"text": truncate_tokens(source.text, room)}))
+                used = budget
+    return kept
+
+
+def fit_history(history: List[dict], budget: int) -> List[dict]:
+    """Mensajes más recientes que caben (el más reciente se recorta si no cabe entero)"""
+    kept, used = [], 0
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if used + cost > budget:
+            if not kept and budget > MESSAGE_OVERHEAD:
+                kept.append({**message, "content": truncate_tokens(message["content"], budget - MESSAGE_OVERHEAD)})
+            break
+        kept.append(message)
+        used += cost
+    return list(reversed(kept))
+
+
+def _document_chunks(text: str) -> List[str]:
+    """Dividir el documento en fragmentos de ~DOCUMENT_CHUNK_CHARS respetando frases"""
+    chunks, current = [], ""
+    for sentence in re.split(r"(?<=[.;:])\s+|\n\s*\n", text):
+        if current and len(current) + len(sentence) > DOCUMENT_CHUNK_CHARS:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip() if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def fit_document(text: str, query: str, budget: int) -> str:
+    """
+    Fragmentos del documento más relevantes para la consulta que caben en el
+    presupuesto, en su orden original. Sin coincidencias se conserva el inicio.
+    """
+    if count_tokens(text) <= budget:
+        return text
+    chunks = _document_chunks(text)
+    chunk_terms = [Counter(tokenize(chunk)) for chunk in chunks]
+    query_terms = set(tokenize(query))
+    # idf de cada término de la consulta entre los fragmentos del documento
+    idf = {
+        term: math.log(1 + len(chunks) / (1 + sum(1 for terms in chunk_terms if term in terms)))
+        for term in query_terms
+    }
+    scores = [sum(idf[term] * (1 + math.log(terms[term])) for term in query_terms if term in terms) for terms in chunk_terms]
+    ranked = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+
+    selected, used = [], 0
+    for i in ranked:
+        cost = count_tokens(chunks[i])
+        if used + cost <= budget:
+            selected.append(i)
+            used += cost
+    if not selected:
+        return truncate_tokens(chunks[ranked[0]], budget)
+
+    parts, previous = [], -1
+    for i in sorted(selected):
+        if i != previous + 1:
+            parts.append("[...]")
+        parts.append(chunks[i])
+        previous = i
+    if previous != len(chunks) - 1:
+        parts.append("[...]")
+    return "\n".join(parts)
+
+
+def prompt_budget() -> int:
+    """Presupuesto efectivo: PROMPT_TOKEN_BUDGET menos el margen por error de estimación"""
+    return int(settings.PROMPT_TOKEN_BUDGET * (1 - settings.PROMPT_BUDGET_SAFETY_MARGIN))
+
+
+def fit_prompt(
+    query: str,
+    fixed_text: str,
+    sources: List[LegalSource],
+    history: List[dict],
+    user_context: Optional[str],
+) -> Tuple[List[LegalSource], List[dict], Optional[str]]:
+    """
+    Ajustar fuentes, historial y documento del usuario al presupuesto (prompt_budget).
+    `fixed_text` es lo que no se recorta: el mensaje de sistema final sin las
+    secciones variables y la consulta.
+    """
+    available = prompt_budget()
+    needs = {
+        "sources": sum(source_tokens(source) for source in sources),
+        "document": count_tokens(user_context),
+        "history": sum(message_tokens(message) for message in history),
+    }
+    fixed = count_tokens(fixed_text)
+    if fixed + sum(needs.values()) <= available:
+        return sources, history, user_context
+
+    budget = allocate(
+        needs,
+        {
+            "sources": settings.PROMPT_BUDGET_SOURCES,
+            "document": settings.PROMPT_BUDGET_DOCUMENT,
+            "history": settings.PROMPT_BUDGET_HISTORY,
+        },
+        available - fixed,
+    )
+    fitted_sources = fit_sources(sources, budget["sources"]) if needs["sources"] > budget["sources"] else sources
+    fitted_history = fit_history(history, budget["history"]) if needs["history"] > budget["history"] else history
+    fitted_context = user_context
+    if user_context and needs["document"] > budget["document"]:
+        fitted_context = fit_document(user_context, query, budget["document"]) or None
+
+    print(
+        f"✂️ [Budget] Prompt de {fixed + sum(needs.values())} tokens ajustado a {available}: "
+        f"fuentes {len(fitted_sources)}/{len(sources)}, historial {len(fitted_history)}/{len(history)}, "
+        f"documento {count_tokens(fitted_context)}/{needs['document']} tokens"
+    )
+    return fitted_sources, fitted_history, fitted_context
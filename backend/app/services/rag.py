@@ -11,12 +11,31 @@ Soporta múltiples proveedores:
 """
 
 import os
-from typing import List, Optional, Tuple
+import re
+import time
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, List, Optional, Tuple
+from uuid import UUID
 from app.core.config import settings
 from app.schemas.chat import LegalSource
 from app.models.conversation import LegalCategory
 from app.services.llm_providers import get_global_llm, get_local_embeddings
 from app.services.ai_documents import suggest_document_template, extract_fields_from_chat
+from app.services.semantic_cache import semantic_cache
+from app.services.job_queue import job_queue
+from app.services.llm_cache import cached_chat
+from app.services.vector_index import get_local_index
+from app.services.lexical_index import fold_accents, load_lexical_index, reciprocal_rank_fusion
+from app.services.fused_response import (
+    FUSED_EXTRA_TOKENS,
+    FusedAnswerStream,
+    fused_instructions,
+    parse_fused_output,
+    with_fused_instructions,
+)
+from app.services.reranker import rerank
+from app.services.prompt_budget import fit_prompt, truncate_tokens
+from app.services.single_flight import SingleFlight
 
 # ═══════════════════════════════════════════════════════════════
 # CONFIGURACIÓN
@@ -108,6 +127,15 @@ Su objetivo es actuar como la autoridad en una SIMULACIÓN DE AUDIENCIA. Debe ev
 {user_context_block}
 """
 
+SUMMARY_PROMPT = """Actualice el resumen de una conversación entre un usuario y un asistente legal especializado en leyes peruanas.
+Incorpore el nuevo intercambio al resumen anterior. Conserve los hechos del caso, fechas, montos, partes involucradas, normas citadas y lo que el usuario quiere lograr. Omita saludos y formato Markdown. Máximo 150 palabras, en español. Responda solo con el resumen.
+
+RESUMEN ANTERIOR:
+{summary}
+
+NUEVO INTERCAMBIO:
+{exchange}"""
+
 # ═══════════════════════════════════════════════════════════════
 # FUNCIONES AUXILIARES
 # ═══════════════════════════════════════════════════════════════
@@ -175,8 +203,17 @@ def is_help_query(query: str) -> bool:
     query_lower = query.lower()
     return any(p in query_lower for p in help_patterns)
 
+# Embeddings y consultas a Pinecone idénticas en curso se comparten
+_embedding_flights = SingleFlight(enabled=settings.SINGLE_FLIGHT_ENABLED)
+_pinecone_flights = SingleFlight(enabled=settings.SINGLE_FLIGHT_ENABLED)
+
+
 async def generate_embedding(text: str) -> List[float]:
     """Generar embedding con el proveedor configurado"""
+    return await _embedding_flights.do(text, lambda: _generate_embedding(text))
+
+
+async def _generate_embedding(text: str) -> List[float]:
     try:
         # Usa provider local (Groq no tiene embeddings, usa fastembed)
         return await get_global_llm().embed(text)
@@ -184,6 +221,22 @@ async def generate_embedding(text: str) -> List[float]:
         print(f"Error generando embedding, usando local: {e}")
         return await get_local_embeddings(text)
 
+async def _run_stage(name: str, coro: Awaitable[Any], timeout: float, default: Any = None) -> Any:
+    """
+    Ejecutar una etapa del pipeline con su propio timeout.
+    Si la etapa falla o excede el tiempo, se devuelve `default` y el turno continúa.
+    """
+    t0 = time.time()
+    try:
+        result = await asyncio.wait_for(coro, timeout=timeout)
+        print(f"⏱️ [RAG] {name}: {time.time() - t0:.2f}s")
+        return result
+    except asyncio.TimeoutError:
+        print(f"[WARN] Etapa '{name}' excedió {timeout:.1f}s")
+    except Exception as e:
+        print(f"[WARN] Error en etapa '{name}': {e}")
+    return default
+
 # ═══════════════════════════════════════════════════════════════
 # CONOCIMIENTO LOCAL (Fallback)
 # ═══════════════════════════════════════════════════════════════
@@ -255,6 +308,12 @@ async def classify_query(query: str) -> LegalCategory:
 
 async def search_pinecone(query: str, category: str, top_k: int = 3) -> List[dict]:
     """Buscar en Pinecone por similitud semántica"""
+    return await _pinecone_flights.do(
+        (query, category, top_k), lambda: _search_pinecone(query, category, top_k)
+    )
+
+
+async def _search_pinecone(query: str, category: str, top_k: int) -> List[dict]:
     index = get_pinecone_index()
     if not index:
         return []
@@ -281,6 +340,7 @@ async def search_pinecone(query: str, category: str, top_k: int = 3) -> List[dic
         
         return [
             {
+                "id": match.id,
                 "text": match.metadata.get("texto", ""),
                 "law": match.metadata.get("ley", "Documento"),
                 "article": match.metadata.get("articulo", ""),
@@ -295,6 +355,106 @@ async def search_pinecone(query: str, category: str, top_k: int = 3) -> List[dic
         return []
 
 
+async def search_local_index(query: str, category: str, top_k: int = 3) -> List[dict]:
+    """Buscar en el índice vectorial local (mismas entradas y salidas que search_pinecone)"""
+    index = get_local_index()
+    if not index:
+        return []
+    
+    try:
+        # El índice local se construyó con MiniLM: la consulta debe usar el mismo modelo
+        query_embedding = await get_local_embeddings(query)
+        return index.search(query_embedding, top_k=top_k, category=category)
+    except Exception as e:
+        print(f"Error buscando en índice local: {e}")
+        return []
+
+
+def vector_backend_available() -> bool:
+    """¿Está disponible el backend vectorial configurado (VECTOR_BACKEND)?"""
+    if settings.VECTOR_BACKEND == "local":
+        return get_local_index() is not None
+    return get_pinecone_index() is not None
+
+
+async def search_vectors(query: str, category: str, top_k: int = 3) -> List[dict]:
+    """Búsqueda semántica en el backend vectorial configurado"""
+    if settings.VECTOR_BACKEND == "local":
+        return await search_local_index(query, category, top_k)
+    return await search_pinecone(query, category, top_k)
+
+
+def local_fallback_sources(category_key: str, top_k: int = 5) -> List[LegalSource]:
+    """Fuentes de la base local (Fallback cuando Pinecone no responde)"""
+    local_docs = LOCAL_KNOWLEDGE.get(category_key, [])
+    # Also search in 'general' or other cats if specific cat yielded nothing
+    if not local_docs and category_key != "general":
+         local_docs = LOCAL_KNOWLEDGE.get("general", [])
+
+    return [
+        LegalSource(
+            text=doc["text"],
+            law=doc["law"],
+            article=doc["article"],
+            category=category_key,
+        )
+        for doc in local_docs[:top_k]
+    ]
+
+
+async def expand_query(query: str) -> str:
+    """Convertir la duda del usuario en una búsqueda técnica legal"""
+    expansion_prompt = f"Como experto legal, transforme esta consulta de usuario en una frase de búsqueda técnica para una base de datos de leyes peruanas. Responda solo con la frase técnica: '{query}'"
+    return await cached_chat(
+        messages=[{"role": "user", "content": expansion_prompt}],
+        temperature=0.0,
+        max_tokens=60,
+        task="expansion"
+    )
+
+
+# Expansión local (modo fused): términos coloquiales o siglas -> términos de la norma
+LEGAL_SYNONYMS = {
+    "cts": "compensación por tiempo de servicios",
+    "grati": "gratificaciones legales",
+    "gratificacion": "gratificaciones legales julio diciembre",
+    "botaron": "despido arbitrario indemnización",
+    "despido": "despido arbitrario indemnización",
+    "despidieron": "despido arbitrario indemnización",
+    "liquidacion": "beneficios sociales",
+    "horas extras": "trabajo en sobretiempo",
+    "vacaciones": "descanso vacacional",
+    "renuncia": "extinción del contrato de trabajo",
+    "sunafil": "inspección del trabajo",
+    "alimentos": "obligación alimentaria",
+    "tenencia": "custodia de menores",
+    "divorcio": "disolución del vínculo matrimonial separación de cuerpos",
+    "indecopi": "protección al consumidor",
+    "garantia": "idoneidad del producto",
+    "alquiler": "arrendamiento",
+    "inquilino": "arrendatario arrendamiento",
+    "brevete": "licencia de conducir",
+    "papeleta": "infracción de tránsito multa",
+    "sac": "sociedad anónima cerrada",
+    "eirl": "empresa individual de responsabilidad limitada",
+}
+_SYNONYM_PATTERNS = [
+    (re.compile(rf"\b{re.escape(term)}\b"), expansion) for term, expansion in LEGAL_SYNONYMS.items()
+]
+
+
+def expand_query_locally(query: str) -> str:
+    """Expansión de consulta sin LLM: añade los términos legales de LEGAL_SYNONYMS"""
+    folded = fold_accents(query.lower())
+    extra = [expansion for pattern, expansion in _SYNONYM_PATTERNS if pattern.search(folded)]
+    return " ".join([query] + list(dict.fromkeys(extra)))
+
+
+def fused_pipeline() -> bool:
+    """PIPELINE_MODE=fused: respuesta, sugerencia y autoverificación en una sola llamada"""
+    return settings.PIPELINE_MODE == "fused"
+
+
 async def retrieve_legal_context(
     query: str,
     category: LegalCategory,
@@ -305,44 +465,54 @@ async def retrieve_legal_context(
     category_key = category.value if category != LegalCategory.GENERAL else "general"
     
     # 🚀 MEJORA: Expansión de Consulta (Query Expansion)
-    # Convertimos la duda del usuario en una búsqueda técnica legal
-    search_query = query
-    try:
-        expansion_prompt = f"Como experto legal, transforme esta consulta de usuario en una frase de búsqueda técnica para una base de datos de leyes peruanas. Responda solo con la frase técnica: '{query}'"
-        search_query = await get_global_llm().chat(
-            messages=[{"role": "user", "content": expansion_prompt}],
-            temperature=0.0,
-            max_tokens=60
+    # Si la expansión tarda demasiado, se busca con la consulta original.
+    # En modo fused se expande localmente (sin llamada al LLM)
+    if fused_pipeline():
+        search_query = expand_query_locally(query)
+    else:
+        search_query = await _run_stage(
+            "Expansión de consulta", expand_query(query), settings.RAG_EXPANSION_TIMEOUT, default=query
         )
+    if search_query != query:
         print(f"🔍 [RAG] Query Expandida: {search_query}")
-    except Exception as e:
-        print(f"[WARN] Error expandiendo query: {e}")
 
-    # Intentar primero con Pinecone
-    if get_pinecone_index():
-        pinecone_results = await search_pinecone(search_query, category_key, top_k)
-        for doc in pinecone_results:
+    # Con re-ranking se piden más candidatos y el cross-encoder elige los mejores
+    fetch_k = max(top_k, settings.RERANK_CANDIDATES) if settings.RERANK_ENABLED else top_k
+
+    # Intentar primero con el índice vectorial (Pinecone o local)
+    vector_results = []
+    if vector_backend_available():
+        vector_results = await search_vectors(search_query, category_key, fetch_k)
+    # Similitud coseno de cada documento (se usa para decidir si verificar la respuesta)
+    dense_scores = {doc.get("id"): doc["score"] for doc in vector_results}
+    
+    # 🚀 MEJORA: Búsqueda híbrida (BM25 + vectorial con Reciprocal Rank Fusion)
+    # La consulta original conserva términos exactos ("CTS", "D.S. 003-97-TR")
+    lexical_index = await load_lexical_index() if settings.HYBRID_SEARCH_ENABLED else None
+    if lexical_index:
+        lexical_results = [
+            doc for doc in lexical_index.search(f"{query} {search_query}", top_k=fetch_k, category=category_key)
+            if doc["id"] in dense_scores or doc["score"] >= settings.HYBRID_MIN_BM25_SCORE
+        ]
+        vector_results = reciprocal_rank_fusion([vector_results, lexical_results], top_k=fetch_k, k=settings.RRF_K)
+    
+    # 🚀 MEJORA: Re-ranking con cross-encoder (menos fuentes, mejor ordenadas)
+    if settings.RERANK_ENABLED and vector_results:
+        vector_results = await rerank(query, vector_results, min(top_k, settings.RERANK_TOP_K))
+    
+    if vector_results:
+        for doc in vector_results:
             sources.append(LegalSource(
                 text=doc["text"],
                 law=doc["law"],
                 article=doc["article"],
                 category=category_key,
+                score=dense_scores.get(doc.get("id")),
             ))
     
-    # Si no hay resultados de Pinecone, usar base local (Fallback)
+    # Si no hay resultados del índice, usar base local (Fallback)
     if not sources:
-        local_docs = LOCAL_KNOWLEDGE.get(category_key, [])
-        # Also search in 'general' or other cats if specific cat yielded nothing
-        if not local_docs and category_key != "general":
-             local_docs = LOCAL_KNOWLEDGE.get("general", [])
-             
-        for doc in local_docs[:top_k]:
-            sources.append(LegalSource(
-                text=doc["text"],
-                law=doc["law"],
-                article=doc["article"],
-                category=category_key,
-            ))
+        sources = local_fallback_sources(category_key, top_k)
     
     return sources
 
@@ -372,122 +542,519 @@ async def detect_complexity(query: str) -> Tuple[bool, float]:
     return False, 0.85
 
 
-async def generate_legal_response(
-    query: str,
-    conversation_history: Optional[List[dict]] = None,
-    user_context: Optional[str] = None,
-    mode: str = "advisor"
-) -> Tuple[str, List[LegalSource], LegalCategory, bool, float]:
-    """
-    Generar respuesta legal usando RAG
-    """
-    import time
-    start_total = time.time()
-    print(f"⏱️ [RAG] Inicio query: '{query[:50]}...'")
-
+def quick_reply(query: str, conversation_history: Optional[List[dict]] = None) -> Optional[str]:
+    """Respuestas rápidas (saludos y agradecimientos) que no requieren LLM"""
     lang = detect_language(query)
     
     # Quick responses for greetings
     if is_greeting(query) and not conversation_history:
         if lang == "es":
-            return "¡Hola! Soy tu asistente legal con IA. ¿En qué puedo ayudarte hoy?", [], LegalCategory.GENERAL, False, 1.0
+            return "¡Hola! Soy tu asistente legal con IA. ¿En qué puedo ayudarte hoy?"
         else:
-            return "Hello! I am your AI legal assistant. How can I help you today?", [], LegalCategory.GENERAL, False, 1.0
+            return "Hello! I am your AI legal assistant. How can I help you today?"
             
     if is_thanks(query):
         if lang == "es":
-            return "¡De nada! Recuerda que esto no es consejo legal oficial.", [], LegalCategory.GENERAL, False, 1.0
+            return "¡De nada! Recuerda que esto no es consejo legal oficial."
         else:
-            return "You're welcome! Remember this is not official legal advice.", [], LegalCategory.GENERAL, False, 1.0
+            return "You're welcome! Remember this is not official legal advice."
+    
+    return None
 
-    # Classify query
-    category = await classify_query(query)
-    print(f"🏷️ [RAG] Categoría detectada: {category.value}")
+
+async def retrieve_for_query(query: str, category: LegalCategory) -> List[LegalSource]:
+    """Recuperar las fuentes de la consulta, con timeout y fallback local"""
+    category_key = category.value if category != LegalCategory.GENERAL else "general"
 
     # Retrieve context
-    t0 = time.time()
-    sources = await retrieve_legal_context(query, category)
-    print(f"⏱️ [RAG] Retrieve context ({len(sources)} docs): {time.time() - t0:.2f}s")
-    
-    # Check for clarification
-    clarification = await needs_clarification(query, sources)
-    if clarification:
-        return clarification, [], LegalCategory.GENERAL, False, 1.0
+    sources = await _run_stage(
+        "Retrieve context",
+        retrieve_legal_context(query, category),
+        settings.RAG_RETRIEVAL_TIMEOUT,
+        default=None,
+    )
+    if sources is None:
+        sources = local_fallback_sources(category_key)
+    print(f"📚 [RAG] Fuentes recuperadas: {len(sources)} docs")
+    return sources
+
+
+async def cache_embedding(
+    query: str,
+    conversation_history: Optional[List[dict]],
+    user_context: Optional[str],
+    conversation_summary: Optional[str] = None,
+) -> Optional[List[float]]:
+    """
+    Embedding de la consulta para el cache semántico, o None si el turno no es cacheable.
+    Las respuestas que dependen de un documento del usuario o del historial no se reutilizan.
+    """
+    if not settings.SEMANTIC_CACHE_ENABLED or user_context or conversation_history or conversation_summary:
+        return None
+    return await get_local_embeddings(query)
+
+
+def build_prompt_messages(
+    query: str,
+    sources: List[LegalSource],
+    conversation_history: Optional[List[dict]] = None,
+    user_context: Optional[str] = None,
+    mode: str = "advisor",
+    conversation_summary: Optional[str] = None,
+    fused: bool = False,
+) -> Tuple[List[dict], str]:
+    """
+    Construir los mensajes para el LLM. Devuelve (mensajes, contexto usado)
+    El historial llega como resumen de la conversación + últimos mensajes literales.
+    Fuentes, documento e historial se ajustan al presupuesto de tokens (prompt_budget).
+    Con `fused` el prompt del sistema incluye el formato JSON (with_fused_instructions).
+    """
+    history = conversation_history[-settings.CONVERSATION_HISTORY_MESSAGES:] if conversation_history else []
+    summary_block = f"\n\n## RESUMEN DE LA CONVERSACIÓN PREVIA:\n{conversation_summary}" if conversation_summary else ""
+    # Lo fijo es el mensaje de sistema final sin las secciones variables (fuentes y documento)
+    fixed_prompt = _system_prompt(mode, "", None) + summary_block + (fused_instructions() if fused else "") + query
+    sources, history, user_context = fit_prompt(query, fixed_prompt, sources, history, user_context)
 
-    # Build prompt
     context = format_context(sources)
-    jurisdiction = "Peru"
+    if mode != "hearing" and user_context:
+        # En modo asesor, incluimos el documento del usuario como parte del contexto para análisis
+        context += f"\n\n### Documento del Usuario Analizado:\n{user_context}"
+
+    messages = [{"role": "system", "content": _system_prompt(mode, context, user_context) + summary_block}]
     
-    # 🚀 MEJORA: Selección de Prompt según Modo (Asesor vs Audiencia)
+    for msg in history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    
+    messages.append({"role": "user", "content": query})
+    if fused:
+        messages = with_fused_instructions(messages)
+    return messages, context
+
+
+def _system_prompt(mode: str, context: str, user_context: Optional[str]) -> str:
+    """🚀 MEJORA: Selección de Prompt según Modo (Asesor vs Audiencia)"""
     if mode == "hearing":
         user_context_block = f"## DOCUMENTO DEL USUARIO (PRUEBA):\n{user_context}" if user_context else ""
-        formatted_system_prompt = HEARING_PROMPT.format(
+        return HEARING_PROMPT.format(
             context=context,
             user_context_block=user_context_block
         )
-    else:
-        # En modo asesor, incluimos el documento del usuario como parte del contexto para análisis
-        if user_context:
-            context += f"\n\n### Documento del Usuario Analizado:\n{user_context}"
-            
-        formatted_system_prompt = SYSTEM_PROMPT.format(
-            context=context,
-            jurisdiction=jurisdiction
+    return SYSTEM_PROMPT.format(
+        context=context,
+        jurisdiction="Peru"
+    )
+
+
+class VerificationError(Exception):
+    """La verificación no llegó a hacerse (timeout, error o respuesta vacía del LLM)"""
+
+
+# Resultado de _run_stage cuando la etapa de verificación falla
+_VERIFY_FAILED = object()
+
+
+async def verify_answer(context: str, answer: str) -> Optional[str]:
+    """
+    🚀 MEJORA: Paso de Verificación (Self-Correction)
+    Devuelve la corrección si la respuesta contradice el contexto, o None si es correcta.
+    Lanza VerificationError si no se pudo verificar: un fallo no equivale a "OK".
+    """
+    verify_prompt = f"Analice la respuesta generada y confirme si contradice los hechos del contexto legal proporcionado. Si es correcta, responda 'OK'. Si detecta una alucinación o error, corríjala brevemente.\n\nCONTEXTO:\n{context}\n\nRESPUESTA A VERIFICAR:\n{answer}"
+    verification = await _run_stage(
+        "Verificación",
+        get_global_llm().chat(
+            messages=[{"role": "user", "content": verify_prompt}],
+            temperature=0.0,
+            max_tokens=200,
+            task="verify"
+        ),
+        settings.RAG_VERIFY_TIMEOUT,
+        default=_VERIFY_FAILED,
+    )
+    if verification is _VERIFY_FAILED or not verification:
+        raise VerificationError("sin resultado de verificación")
+    if "OK" not in verification:
+        print(f"⚖️ [RAG] Autocorrección aplicada")
+        return verification
+    return None
+
+
+async def _verify_inline(context: str, answer: str) -> Tuple[Optional[str], bool]:
+    """
+    Verificación síncrona dentro del turno: devuelve (corrección, verificada).
+    Si falla, la respuesta se entrega sin corrección pero no se cachea.
+    """
+    try:
+        return await verify_answer(context, answer), True
+    except VerificationError:
+        return None, False
+
+
+def should_verify(sources: List[LegalSource], grounded: Optional[bool] = None) -> bool:
+    """
+    Política de verificación (VERIFICATION_MODE): off | always | low_confidence
+    En modo fused la autoverificación del modelo (`grounded`) sustituye a la
+    llamada de verificación, salvo que marque la respuesta como no fundamentada.
+    """
+    mode = settings.VERIFICATION_MODE
+    if mode == "off":
+        return False
+    if grounded is not None:
+        return not grounded
+    if mode == "low_confidence":
+        top_score = max((s.score for s in sources if s.score is not None), default=0.0)
+        return len(sources) < settings.VERIFICATION_MIN_SOURCES or top_score < settings.VERIFICATION_MIN_SCORE
+    return True
+
+
+def _cache_entry(
+    query_embedding: Optional[List[float]],
+    category: LegalCategory,
+    mode: str,
+    sources: List[LegalSource],
+    needs_lawyer: bool,
+    confidence: float,
+) -> Optional[dict]:
+    """Datos para guardar la respuesta en el cache semántico (serializables para la cola)"""
+    if query_embedding is None:
+        return None
+    return {
+        "embedding": list(query_embedding),
+        "category": category.value,
+        "mode": mode,
+        "sources": [source.model_dump() for source in sources],
+        "needs_lawyer": needs_lawyer,
+        "confidence": confidence,
+    }
+
+
+def _store_in_cache(answer: str, entry: Optional[dict]) -> None:
+    if entry:
+        semantic_cache.store(
+            entry["embedding"], entry["category"], entry["mode"], answer,
+            [LegalSource(**source) for source in entry["sources"]],
+            entry["needs_lawyer"], entry["confidence"],
         )
 
-    messages = [{"role": "system", "content": formatted_system_prompt}]
+
+@job_queue.handler("verify_answer")
+async def _verify_answer_job(payload: dict) -> None:
+    """
+    Verificación asíncrona (VERIFICATION_ASYNC): el usuario ya tiene la respuesta.
+    La corrección se encola para guardarla en el mensaje; una respuesta que pasa
+    la verificación se guarda en el cache semántico. Si la verificación falla,
+    VerificationError llega a la cola y el trabajo se reintenta.
+    """
+    correction = await verify_answer(payload["context"], payload["answer"])
+    if correction is None:
+        _store_in_cache(payload["answer"], payload.get("cache"))
+    elif payload.get("message_id"):
+        await job_queue.enqueue("message_correction", {
+            "message_id": payload["message_id"],
+            "correction": correction,
+        })
+
+
+async def _enqueue_verification(
+    context: str,
+    answer: str,
+    message_id: Optional[UUID],
+    cache: Optional[dict],
+) -> None:
+    await job_queue.enqueue("verify_answer", {
+        "context": context,
+        "answer": answer,
+        "message_id": str(message_id) if message_id else None,
+        "cache": cache,
+    })
+
+
+def format_document_suggestion(doc_id: Optional[str]) -> str:
+    """Texto de sugerencia de documento que se añade al final de la respuesta"""
+    if not doc_id:
+        return ""
+    from app.api.documents import TEMPLATES_CONFIG
+    template = next((t for t in TEMPLATES_CONFIG if t["id"] == doc_id), None)
+    if not template:
+        return ""
+    return f"\n\n---\n💡 **Sugerencia**: He detectado que podría necesitar una **{template['name']}**. Si desea, puedo ayudarle a redactarla ahora mismo."
+
+
+def _start_suggestion(query: str, conversation_history: Optional[List[dict]]) -> Optional["asyncio.Task"]:
+    """
+    🚀 MEJORA: Sugerencia de Documentos con IA (en paralelo con el resto del turno)
+    En modo fused la sugerencia llega en la misma respuesta del LLM (None).
+    """
+    if fused_pipeline():
+        return None
+    return asyncio.create_task(_run_stage(
+        "Sugerencia de documento",
+        suggest_document_template(query, conversation_history or []),
+        settings.RAG_SUGGEST_TIMEOUT,
+    ))
+
+
+def _cancel_pending(task: Optional["asyncio.Task"]) -> None:
+    """
+    Cancelar la sugerencia si el turno termina sin usarla: aclaración, error o
+    cliente desconectado (GeneratorExit / CancelledError en mitad del stream).
+    """
+    if task and not task.done():
+        task.cancel()
+
+
+def _error_message(lang: str, error: Exception) -> str:
+    if isinstance(error, asyncio.TimeoutError):
+        error = f"timeout tras {settings.RAG_ANSWER_TIMEOUT:.0f}s"
+    msg = "Error processing request. Please try again." if lang == "en" else "Error procesando la solicitud. Intenta de nuevo."
+    return f"{msg} ({str(error)})"
+
+
+async def generate_legal_response(
+    query: str,
+    conversation_history: Optional[List[dict]] = None,
+    user_context: Optional[str] = None,
+    mode: str = "advisor",
+    message_id: Optional[UUID] = None,
+    conversation_summary: Optional[str] = None,
+) -> Tuple[str, List[LegalSource], LegalCategory, bool, float]:
+    """
+    Generar respuesta legal usando RAG
+
+    Las etapas independientes se solapan: la sugerencia de documento corre en
+    paralelo con la recuperación y la generación. Cada etapa tiene su propio timeout.
+    Con VERIFICATION_ASYNC la verificación se encola y la corrección, si la
+    hay, se guarda después en el mensaje `message_id`.
+    Con PIPELINE_MODE=fused la respuesta, la sugerencia y la autoverificación
+    salen de una sola llamada al LLM (ver fused_response).
+    `conversation_summary` es el resumen de los turnos anteriores a `conversation_history`.
+    """
+    start_total = time.time()
+    print(f"⏱️ [RAG] Inicio query: '{query[:50]}...'")
+
+    lang = detect_language(query)
+    
+    reply = quick_reply(query, conversation_history)
+    if reply:
+        return reply, [], LegalCategory.GENERAL, False, 1.0
+
+    # Classify query
+    category = await classify_query(query)
+    print(f"🏷️ [RAG] Categoría detectada: {category.value}")
+
+    # 🚀 MEJORA: Cache semántico (evita todas las llamadas al LLM)
+    query_embedding = await cache_embedding(query, conversation_history, user_context, conversation_summary)
+    if query_embedding is not None:
+        cached = semantic_cache.lookup(query_embedding, category.value, mode)
+        if cached:
+            return cached.answer, cached.sources, LegalCategory.GENERAL, cached.needs_lawyer, cached.confidence
+
+    # Solo depende de la consulta y el historial, no de la respuesta
+    suggestion_task = _start_suggestion(query, conversation_history)
+    try:
+        sources = await retrieve_for_query(query, category)
     
-    if conversation_history:
-        for msg in conversation_history[-4:]: # Keep history shorter
-            messages.append({"role": msg["role"], "content": msg["content"]})
+        # Check for clarification
+        clarification = await needs_clarification(query, sources)
+        if clarification:
+            return clarification, [], LegalCategory.GENERAL, False, 1.0
+
+        # Build prompt
+        fused = fused_pipeline()
+        messages, context = build_prompt_messages(
+            query, sources, conversation_history, user_context, mode, conversation_summary, fused
+        )
     
-    messages.append({"role": "user", "content": query})
+        try:
+            t1 = time.time()
+            answer = await asyncio.wait_for(
+                get_global_llm().chat(
+                    messages=messages,
+                    temperature=0.3, # Lower temp for more factual answers
+                    max_tokens=1500 + (FUSED_EXTRA_TOKENS if fused else 0),
+                    task="fused" if fused else "answer",
+                ),
+                timeout=settings.RAG_ANSWER_TIMEOUT,
+            )
+            print(f"⏱️ [RAG] LLM generation: {time.time() - t1:.2f}s")
+
+            grounded = None
+            if fused:
+                output = parse_fused_output(answer)
+                answer, grounded = output.answer, output.grounded
+
+            # Verificamos si la respuesta es coherente con el contexto
+            verify = should_verify(sources, grounded)
+            verified = not verify
+            if verify and not settings.VERIFICATION_ASYNC:
+                correction, verified = await _verify_inline(context, answer)
+                if correction:
+                    answer = correction
+
+        except Exception as e:
+            return _error_message(lang, e), [], LegalCategory.GENERAL, True, 0.0
+
+        needs_lawyer = True if not sources else False
+        confidence = 0.5 if not sources else 0.9
     
+        # La sugerencia ya se calculó en paralelo (o vino en la respuesta fused)
+        answer += format_document_suggestion(output.document if fused else await suggestion_task)
+
+        cache = _cache_entry(query_embedding, category, mode, sources, needs_lawyer, confidence)
+        # Solo se cachea una respuesta que pasó la verificación (o que no la necesita)
+        if verify and settings.VERIFICATION_ASYNC:
+            await _enqueue_verification(context, answer, message_id, cache)
+        elif verified:
+            _store_in_cache(answer, cache)
+
+        print(f"⏱️ [RAG] Total Time: {time.time() - start_total:.2f}s")
+        return answer, sources, LegalCategory.GENERAL, needs_lawyer, confidence
+    finally:
+        _cancel_pending(suggestion_task)
+
+
+async def stream_legal_response(
+    query: str,
+    conversation_history: Optional[List[dict]] = None,
+    user_context: Optional[str] = None,
+    mode: str = "advisor",
+    message_id: Optional[UUID] = None,
+    conversation_summary: Optional[str] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Variante por streaming de generate_legal_response.
+
+    Emite eventos (nombre, datos):
+    - "sources": fuentes recuperadas, antes de empezar a generar
+    - "token": cada fragmento de la respuesta
+    - "correction": corrección de la verificación, si la hubo (con VERIFICATION_ASYNC
+      se encola y se guarda después en el mensaje `message_id`)
+    - "done": respuesta final completa y metadatos
+    - "error": si la generación falla
+    """
+    start_total = time.time()
+    print(f"⏱️ [RAG] Inicio query (stream): '{query[:50]}...'")
+
+    lang = detect_language(query)
+
+    reply = quick_reply(query, conversation_history)
+    if reply:
+        yield "sources", {"sources": [], "category": LegalCategory.GENERAL.value}
+        yield "token", {"text": reply}
+        yield "done", {"content": reply, "category": LegalCategory.GENERAL.value, "needs_lawyer": False, "confidence": 1.0}
+        return
+
+    category = await classify_query(query)
+    print(f"🏷️ [RAG] Categoría detectada: {category.value}")
+
+    query_embedding = await cache_embedding(query, conversation_history, user_context, conversation_summary)
+    if query_embedding is not None:
+        cached = semantic_cache.lookup(query_embedding, category.value, mode)
+        if cached:
+            yield "sources", {
+                "sources": [source.model_dump() for source in cached.sources],
+                "category": LegalCategory.GENERAL.value,
+            }
+            yield "token", {"text": cached.answer}
+            yield "done", {
+                "content": cached.answer,
+                "category": LegalCategory.GENERAL.value,
+                "needs_lawyer": cached.needs_lawyer,
+                "confidence": cached.confidence,
+            }
+            return
+
+    suggestion_task = _start_suggestion(query, conversation_history)
     try:
-        t1 = time.time()
-        answer = await get_global_llm().chat(
-            messages=messages,
-            temperature=0.3, # Lower temp for more factual answers
-            max_tokens=1500,
+        sources = await retrieve_for_query(query, category)
+
+        clarification = await needs_clarification(query, sources)
+        if clarification:
+            yield "sources", {"sources": [], "category": LegalCategory.GENERAL.value}
+            yield "token", {"text": clarification}
+            yield "done", {"content": clarification, "category": LegalCategory.GENERAL.value, "needs_lawyer": False, "confidence": 1.0}
+            return
+
+        # Las fuentes se emiten antes de que empiece la generación
+        yield "sources", {
+            "sources": [source.model_dump() for source in sources],
+            "category": LegalCategory.GENERAL.value,
+        }
+
+        # En modo fused se emite solo el campo "answer" del JSON a medida que llega
+        fused_stream = FusedAnswerStream() if fused_pipeline() else None
+        messages, context = build_prompt_messages(
+            query, sources, conversation_history, user_context, mode, conversation_summary, fused_stream is not None
         )
-        print(f"⏱️ [RAG] LLM generation: {time.time() - t1:.2f}s")
 
-        # 🚀 MEJORA: Paso de Verificación (Self-Correction)
-        # Verificamos si la respuesta es coherente con el contexto
+        parts = []
         try:
-            verify_prompt = f"Analice la respuesta generada y confirme si contradice los hechos del contexto legal proporcionado. Si es correcta, responda 'OK'. Si detecta una alucinación o error, corríjala brevemente.\n\nCONTEXTO:\n{context}\n\nRESPUESTA A VERIFICAR:\n{answer}"
-            verification = await get_global_llm().chat(
-                messages=[{"role": "user", "content": verify_prompt}],
-                temperature=0.0,
-                max_tokens=200
+            t1 = time.time()
+            stream = get_global_llm().chat_stream(
+                messages=messages,
+                temperature=0.3,
+                max_tokens=1500 + (FUSED_EXTRA_TOKENS if fused_stream else 0),
+                task="fused" if fused_stream else "answer",
             )
-            if "OK" not in verification:
-                print(f"⚖️ [RAG] Autocorrección aplicada")
-                answer = verification
-        except:
-             pass
+            # El timeout aplica entre fragmentos: un proveedor colgado no bloquea el stream
+            while True:
+                try:
+                    delta = await asyncio.wait_for(stream.__anext__(), timeout=settings.RAG_ANSWER_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                if fused_stream:
+                    delta = fused_stream.feed(delta)
+                    if not delta:
+                        continue
+                if not parts:
+                    print(f"⏱️ [RAG] Primer token: {time.time() - t1:.2f}s")
+                parts.append(delta)
+                yield "token", {"text": delta}
+            print(f"⏱️ [RAG] LLM generation (stream): {time.time() - t1:.2f}s")
+        except Exception as e:
+            yield "error", {"detail": _error_message(lang, e)}
+            return
 
-        print(f"⏱️ [RAG] Total Time: {time.time() - start_total:.2f}s")
-    except Exception as e:
-        msg = "Error processing request. Please try again." if lang == "en" else "Error procesando la solicitud. Intenta de nuevo."
-        return f"{msg} ({str(e)})", [], LegalCategory.GENERAL, True, 0.0
+        answer = "".join(parts)
+        document, grounded = None, None
+        if fused_stream:
+            output = parse_fused_output(fused_stream.buffer, streamed_answer=answer)
+            document, grounded = output.document, output.grounded
+            if not answer:  # JSON sin "answer" al inicio: se envía completa al final
+                answer = output.answer
+                yield "token", {"text": answer}
 
-    needs_lawyer = True if not sources else False
-    confidence = 0.5 if not sources else 0.9
-    
-    # 🚀 MEJORA: Sugerencia de Documentos con IA
-    try:
-        doc_id = await suggest_document_template(query, conversation_history or [])
-        if doc_id:
-            from app.api.documents import TEMPLATES_CONFIG
-            template = next((t for t in TEMPLATES_CONFIG if t["id"] == doc_id), None)
-            if template:
-                suggestion_msg = f"\n\n---\n💡 **Sugerencia**: He detectado que podría necesitar una **{template['name']}**. Si desea, puedo ayudarle a redactarla ahora mismo."
-                answer += suggestion_msg
-    except Exception as e:
-        print(f"[WARN] Error en sugerencia de doc: {e}")
+        # La respuesta ya fue mostrada; si la verificación la corrige se envía aparte
+        verify = should_verify(sources, grounded)
+        verified = not verify
+        if verify and not settings.VERIFICATION_ASYNC:
+            correction, verified = await _verify_inline(context, answer)
+            if correction:
+                answer = correction
+                yield "correction", {"text": correction}
 
-    return answer, sources, LegalCategory.GENERAL, needs_lawyer, confidence
+        suggestion = format_document_suggestion(document if fused_stream else await suggestion_task)
+        if suggestion:
+            answer += suggestion
+            yield "token", {"text": suggestion}
+
+        needs_lawyer = not sources
+        confidence = 0.5 if not sources else 0.9
+        cache = _cache_entry(query_embedding, category, mode, sources, needs_lawyer, confidence)
+        if verify and settings.VERIFICATION_ASYNC:
+            await _enqueue_verification(context, answer, message_id, cache)
+        elif verified:
+            _store_in_cache(answer, cache)
+
+        print(f"⏱️ [RAG] Total Time (stream): {time.time() - start_total:.2f}s")
+        yield "done", {
+            "content": answer,
+            "category": LegalCategory.GENERAL.value,
+            "needs_lawyer": needs_lawyer,
+            "confidence": confidence,
+        }
+    finally:
+        _cancel_pending(suggestion_task)
 
 
 async def generate_conversation_title(first_message: str) -> str:
@@ -495,10 +1062,15 @@ async def generate_conversation_title(first_message: str) -> str:
     return first_message[:30] + "..."
 
 
+def default_conversation_title(first_message: str) -> str:
+    """Título provisional mientras se genera el definitivo (y de respaldo si falla)"""
+    return first_message[:40] + "..." if len(first_message) > 40 else first_message
+
+
 async def generate_conversation_title(first_message: str) -> str:
     """Generar título para la conversación"""
     try:
-        response = await get_global_llm().chat(
+        chat_call = get_global_llm().chat(
             messages=[
                 {
                     "role": "user",
@@ -507,9 +1079,33 @@ async def generate_conversation_title(first_message: str) -> str:
             ],
             temperature=0.5,
             max_tokens=30,
+            task="title",
         )
+        response = await asyncio.wait_for(chat_call, timeout=settings.RAG_TITLE_TIMEOUT)
         
         title = response.strip().strip('"\'')
         return title[:40]
     except Exception:
-        return first_message[:40] + "..." if len(first_message) > 40 else first_message
+        return default_conversation_title(first_message)
+
+
+async def update_conversation_summary(summary: Optional[str], messages: List[dict]) -> Optional[str]:
+    """
+    Incorporar al resumen de la conversación los mensajes que salen de la
+    ventana literal. Devuelve None si falla (el trabajo que lo llama se reintenta).
+    """
+    exchange = "\n\n".join(
+        f"{'Usuario' if msg['role'] == 'user' else 'Asistente'}: {truncate_tokens(msg['content'], 800)}"
+        for msg in messages
+    )
+    result = await _run_stage(
+        "Resumen de conversación",
+        get_global_llm().chat(
+            messages=[{"role": "user", "content": SUMMARY_PROMPT.format(summary=summary or "Ninguno", exchange=exchange)}],
+            temperature=0.0,
+            max_tokens=settings.CONVERSATION_SUMMARY_MAX_TOKENS,
+            task="summary",
+        ),
+        settings.RAG_SUMMARY_TIMEOUT,
+    )
+    return result.strip() if result else None
@@ -0,0 +1,178 @@
+"""
+Rate limiting del lado del cliente para los proveedores LLM
+
+Los planes gratuitos limitan peticiones y tokens por minuto (Groq: 30 req/min).
+Cada turno de chat hace varias llamadas y las ráfagas terminaban en 429. Cada
+proveedor tiene ahora dos token buckets (peticiones/min y tokens/min); una
+llamada que excede el límite espera en una cola con prioridad en vez de
+fallar, y la respuesta al usuario pasa antes que las llamadas auxiliares.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+from app.services.llm_providers import LLMProvider, ProviderWrapper
+
+# Menor número = mayor prioridad
+TASK_PRIORITIES = {
+    "answer": 0,
+    "fused": 0,
+    "expansion": 1,
+    "verify": 1,
+    "extract": 1,
+    "title": 2,
+    "suggest": 2,
+    "summary": 2,
+}
+
+
+def task_priority(task: str) -> int:
+    return TASK_PRIORITIES.get(task, 1)
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    """Tokens que consumirá la llamada: prompt (~4 caracteres por token) + máximo de salida"""
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return chars // 4 + max_tokens
+
+
+class TokenBucket:
+    """Bucket que se rellena de forma continua hasta `per_minute` unidades"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta poder consumir `amount` (0 si ya se puede)"""
+        self._refill()
+        amount = min(amount, self.capacity)  # Una llamada más grande que el bucket no espera para siempre
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """Límite de peticiones/min y tokens/min con cola por prioridad"""
+
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        # heap de (prioridad, orden de llegada, tokens, future)
+        self._queue: List[tuple] = []
+        self._counter = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.queued = 0
+        self.total_wait = 0.0
+
+    def _wait_time(self, cost: int) -> float:
+        return max(
+            self.requests.wait_time(1) if self.requests else 0.0,
+            self.tokens.wait_time(cost) if self.tokens else 0.0,
+        )
+
+    def _take(self, cost: int) -> None:
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(cost)
+
+    async def acquire(self, cost: int, priority: int = 0) -> None:
+        """Esperar turno para una llamada de `cost` tokens"""
+        # Sin cola y con capacidad: pasa directo
+        if not self._queue and self._wait_time(cost) <= 0:
+            self._take(cost)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), cost, future))
+        self.queued += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        t0 = time.monotonic()
+        await future
+        self.total_wait += time.monotonic() - t0
+
+    async def _dispatch(self) -> None:
+        """Despachar la cola en orden de prioridad a medida que los buckets se rellenan"""
+        while self._queue:
+            _, _, cost, future = self._queue[0]
+            if future.done():  # El llamador se canceló (timeout de su etapa)
+                heapq.heappop(self._queue)
+                continue
+            wait = self._wait_time(cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self._queue)
+            self._take(cost)
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "queued_total": self.queued,
+            "waiting": sum(1 for *_, future in self._queue if not future.done()),
+            "avg_wait": round(self.total_wait / self.queued, 3) if self.queued else 0.0,
+        }
+
+
+class RateLimitedProvider(ProviderWrapper):
+    """
+    Proveedor con rate limiting: las llamadas esperan turno según su tarea.
+    Groq y Together aplican los límites por modelo: el modelo grande y el
+    pequeño (*_SMALL_MODEL) tienen cada uno sus buckets.
+    """
+
+    def __init__(self, provider: LLMProvider, rpm: int = 0, tpm: int = 0):
+        super().__init__(provider)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limiters: Dict[str, RateLimiter] = {}
+
+    def limiter_for(self, task: str) -> RateLimiter:
+        model = self.provider.model_for(task)
+        if model not in self.limiters:
+            self.limiters[model] = RateLimiter(rpm=self.rpm, tpm=self.tpm)
+        return self.limiters[model]
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> str:
+        await self.limiter_for(task).acquire(estimate_tokens(messages, max_tokens), task_priority(task))
+        return await self.provider.chat(messages, temperature=temperature, max_tokens=max_tokens, task=task)
+
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        await self.limiter_for(task).acquire(estimate_tokens(messages, max_tokens), task_priority(task))
+        async for delta in self.provider.chat_stream(
+            messages, temperature=temperature, max_tokens=max_tokens, task=task
+        ):
+            yield delta
+
+    # embed/embed_batch sin límite: los embeddings tienen cuota propia (o son locales, como en Groq)
+
+    def stats(self) -> dict:
+        return {model: limiter.stats() for model, limiter in self.limiters.items()}
@@ -0,0 +1,68 @@
+"""
+Re-ranking de fuentes con un cross-encoder local (FastEmbed / ONNX)
+
+La búsqueda vectorial y BM25 ordenan por similitud aproximada. Con
+RERANK_ENABLED se pide un conjunto mayor de candidatos (RERANK_CANDIDATES) y
+un cross-encoder puntúa todos los pares (consulta, pasaje) en una sola
+llamada por lotes en el thread pool; al prompt solo llegan los mejores k.
+"""
+
+import asyncio
+from typing import List, Optional
+
+from app.core.config import settings
+
+# El cross-encoder lee como máximo ~512 tokens; no tiene sentido enviar más texto
+MAX_PASSAGE_CHARS = 2000
+
+_reranker = None
+_reranker_failed = False
+
+
+def _get_reranker():
+    """Cargar el cross-encoder una sola vez (importación lazy). None si no está disponible."""
+    global _reranker, _reranker_failed
+    if _reranker is None and not _reranker_failed:
+        try:
+            from fastembed.rerank.cross_encoder import TextCrossEncoder
+            _reranker = TextCrossEncoder(model_name=settings.RERANK_MODEL)
+            print(f"[OK] Cross-encoder cargado: {settings.RERANK_MODEL}")
+        except Exception as e:
+            _reranker_failed = True
+            print(f"[WARN] Re-ranking desactivado, no se pudo cargar {settings.RERANK_MODEL}: {e}")
+    return _reranker
+
+
+def passage_text(doc: dict) -> str:
+    """Texto del candidato que ve el cross-encoder"""
+    header = " ".join(part for part in (doc.get("law", ""), doc.get("article", "")) if part)
+    return f"{header}\n{doc.get('text', '')}"[:MAX_PASSAGE_CHARS]
+
+
+def _score_sync(query: str, passages: List[str]) -> Optional[List[float]]:
+    """Puntuar todos los pares en un solo lote (se ejecuta en el thread pool)"""
+    model = _get_reranker()
+    if model is None:
+        return None
+    return [float(score) for score in model.rerank(query, passages, batch_size=len(passages))]
+
+
+async def rerank(query: str, docs: List[dict], top_k: int) -> List[dict]:
+    """
+    Reordenar candidatos por relevancia (consulta, pasaje) y quedarse con top_k.
+    Si el modelo no está disponible se devuelven los primeros top_k sin cambios.
+    """
+    if len(docs) <= 1:
+        return docs[:top_k]
+
+    loop = asyncio.get_running_loop()
+    try:
+        scores = await loop.run_in_executor(None, _score_sync, query, [passage_text(doc) for doc in docs])
+    except Exception as e:
+        print(f"[WARN] Error en re-ranking: {e}")
+        scores = None
+    if scores is None:
+        return docs[:top_k]
+
+    ranked = sorted(zip(scores, range(len(docs))), reverse=True)[:top_k]
+    return [{**docs[i], "rerank_score": score} for score, i in ranked]
@@ -0,0 +1,258 @@
+"""
+Reintentos de llamadas LLM ante errores transitorios
+
+Un 429 o 503 momentáneo terminaba en "Error procesando la solicitud" y el
+usuario reenviaba la pregunta (repitiendo todo el pipeline). Las llamadas se
+reintentan ahora con backoff exponencial y jitter, respetando las cabeceras
+`Retry-After` y `x-ratelimit-reset*` del proveedor. El tiempo total de espera
+está acotado por petición HTTP (RETRY_BUDGET_SECONDS).
+"""
+
+import asyncio
+import random
+import re
+import time
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+
+from app.core.config import settings
+from app.services.llm_providers import LLMProvider, ProviderWrapper
+
+T = TypeVar("T")
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """Código HTTP del error (httpx o SDK de OpenAI), si lo tiene"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """¿Error transitorio? (429, 5xx, timeouts y errores de red)"""
+    status = error_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, ConnectionError))
+
+
+_DURATION_RE = re.compile(r"^(?:(?P<h>\d+(?:\.\d+)?)h)?(?:(?P<m>\d+(?:\.\d+)?)m(?!s))?(?:(?P<s>\d+(?:\.\d+)?)s)?(?:(?P<ms>\d+(?:\.\d+)?)ms)?$")
+
+
+def _parse_seconds(value: str) -> Optional[float]:
+    """'7', '7.5', '2m59.56s', '120ms', fecha HTTP o epoch Unix -> segundos desde ahora"""
+    value = value.strip()
+    try:
+        seconds = float(value)
+        # x-ratelimit-reset a veces es un epoch Unix
+        return seconds - time.time() if seconds > 1e9 else seconds
+    except ValueError:
+        pass
+    match = _DURATION_RE.match(value)
+    if match and any(match.groupdict().values()):
+        parts = {k: float(v) for k, v in match.groupdict().items() if v}
+        return parts.get("h", 0) * 3600 + parts.get("m", 0) * 60 + parts.get("s", 0) + parts.get("ms", 0) / 1000
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def _header_seconds(headers, name: str) -> Optional[float]:
+    value = headers.get(name)
+    seconds = _parse_seconds(value) if value else None
+    return max(0.0, seconds) if seconds is not None else None
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    Espera que pide el proveedor, si la indica:
+    1. Retry-After
+    2. x-ratelimit-reset-<límite> del límite agotado (x-ratelimit-remaining-<límite> = 0)
+    3. el menor de los x-ratelimit-reset*
+    En Groq x-ratelimit-reset-requests sigue la ventana diaria (minutos u horas);
+    un 429 por tokens/min no debe esperar a ese reset.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    retry_after = _header_seconds(headers, "retry-after")
+    if retry_after is not None:
+        return retry_after
+
+    resets = {}
+    for limit in ("", "-requests", "-tokens"):
+        seconds = _header_seconds(headers, f"x-ratelimit-reset{limit}")
+        if seconds is not None:
+            resets[limit] = seconds
+    exhausted = [
+        resets[limit] for limit in resets
+        if limit and (headers.get(f"x-ratelimit-remaining{limit}") or "").strip() == "0"
+    ]
+    if exhausted:
+        return max(exhausted)  # Hay que esperar a que se rellenen todos los límites agotados
+    return min(resets.values()) if resets else None
+
+
+class RetryBudget:
+    """Segundos de espera en reintentos que quedan para la petición HTTP actual"""
+
+    def __init__(self, seconds: float):
+        self.remaining = seconds
+
+
+# Compartido por todas las llamadas LLM de una misma petición (también las tareas hijas)
+_request_budget: ContextVar[Optional[RetryBudget]] = ContextVar("retry_budget", default=None)
+
+
+def start_retry_budget() -> None:
+    """Abrir un presupuesto de reintentos nuevo (al inicio de cada petición HTTP)"""
+    _request_budget.set(RetryBudget(settings.RETRY_BUDGET_SECONDS))
+
+
+class RetryMetrics:
+    """Contadores de reintentos (para el endpoint de métricas)"""
+
+    def __init__(self):
+        self.retries = 0
+        self.recovered = 0
+        self.gave_up = 0
+        self.wait_seconds = 0.0
+        self.by_status: Dict[str, int] = {}
+
+    def record_retry(self, error: BaseException, delay: float) -> None:
+        self.retries += 1
+        self.wait_seconds += delay
+        key = str(error_status(error) or type(error).__name__)
+        self.by_status[key] = self.by_status.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "retries": self.retries,
+            "recovered": self.recovered,
+            "gave_up": self.gave_up,
+            "wait_seconds": round(self.wait_seconds, 2),
+            "by_status": dict(self.by_status),
+        }
+
+
+retry_metrics = RetryMetrics()
+
+
+class RetryPolicy:
+    """Backoff exponencial con full jitter, acotado por intentos y presupuesto de tiempo"""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 10.0,
+        budget_seconds: float = 20.0,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_seconds = budget_seconds
+
+    def backoff(self, attempt: int, error: BaseException) -> float:
+        hinted = retry_after_seconds(error)
+        if hinted is not None:
+            return hinted
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def wait_before_retry(self, attempt: int, error: BaseException, budget: RetryBudget) -> bool:
+        """Esperar antes del siguiente intento. False si ya no conviene reintentar."""
+        if not is_retryable(error) or attempt + 1 >= self.max_attempts:
+            return False
+        delay = self.backoff(attempt, error)
+        if delay > budget.remaining:
+            print(f"[Retry] Sin presupuesto: se pedían {delay:.1f}s y quedan {budget.remaining:.1f}s")
+            return False
+        budget.remaining -= delay
+        retry_metrics.record_retry(error, delay)
+        print(f"[Retry] Intento {attempt + 2}/{self.max_attempts} en {delay:.2f}s ({type(error).__name__}: {error_status(error) or error})")
+        await asyncio.sleep(delay)
+        return True
+
+    def budget(self) -> RetryBudget:
+        # Fuera de una petición HTTP (scripts, tareas) el presupuesto es por llamada
+        return _request_budget.get() or RetryBudget(self.budget_seconds)
+
+    async def run(self, fn: Callable[[], Awaitable[T]]) -> T:
+        budget = self.budget()
+        attempt = 0
+        while True:
+            try:
+                result = await fn()
+            except Exception as e:
+                if await self.wait_before_retry(attempt, e, budget):
+                    attempt += 1
+                    continue
+                if attempt and is_retryable(e):
+                    retry_metrics.gave_up += 1
+                raise
+            if attempt:
+                retry_metrics.recovered += 1
+            return result
+
+
+class RetryingProvider(ProviderWrapper):
+    """Proveedor que reintenta los errores transitorios según RetryPolicy"""
+
+    def __init__(self, provider: LLMProvider, policy: Optional[RetryPolicy] = None):
+        super().__init__(provider)
+        self.policy = policy or RetryPolicy(
+            max_attempts=settings.RETRY_MAX_ATTEMPTS,
+            base_delay=settings.RETRY_BASE_DELAY,
+            max_delay=settings.RETRY_MAX_DELAY,
+            budget_seconds=settings.RETRY_BUDGET_SECONDS,
+        )
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> str:
+        return await self.policy.run(
+            lambda: self.provider.chat(messages, temperature=temperature, max_tokens=max_tokens, task=task)
+        )
+
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> AsyncIterator[str]:
+        """Solo se reintenta antes del primer fragmento (lo ya emitido no se repite)"""
+        budget = self.policy.budget()
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async for delta in self.provider.chat_stream(
+                    messages, temperature=temperature, max_tokens=max_tokens, task=task
+                ):
+                    started = True
+                    yield delta
+                if attempt:
+                    retry_metrics.recovered += 1
+                return
+            except Exception as e:
+                if started or not await self.policy.wait_before_retry(attempt, e, budget):
+                    raise
+                attempt += 1
+
+    async def embed(self, text: str) -> List[float]:
+        return await self.policy.run(lambda: self.provider.embed(text))
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return await self.policy.run(lambda: self.provider.embed_batch(texts))
+
+    def stats(self) -> dict:
+        return retry_metrics.stats()
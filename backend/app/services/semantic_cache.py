@@ -0,0 +1,149 @@
+"""
+Cache semántico de respuestas legales
+
+Muchas consultas son casi idénticas ("¿cuánto me corresponde de CTS?" en
+decenas de formas). Si el embedding de una consulta nueva es suficientemente
+parecido (similitud coseno) al de una ya respondida, dentro de la misma
+categoría y modo, se devuelve la respuesta guardada sin llamar al LLM.
+"""
+
+import time
+import itertools
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.schemas.chat import LegalSource
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    sources: List[LegalSource]
+    needs_lawyer: bool
+    confidence: float
+    vector: np.ndarray
+    bucket: Tuple[str, str]
+    created_at: float
+
+
+class SemanticCache:
+    """
+    Cache LRU + TTL indexado por embedding.
+
+    Las entradas se agrupan por (categoría, modo); la búsqueda solo compara
+    contra la matriz de vectores del grupo correspondiente.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, str], List[int]] = {}
+        self._matrices: Dict[Tuple[str, str], np.ndarray] = {}
+        self._ids = itertools.count()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._buckets[entry.bucket].remove(entry_id)
+        self._matrices.pop(entry.bucket, None)
+
+    def _matrix(self, bucket: Tuple[str, str]) -> np.ndarray:
+        # La matriz de cada grupo se reconstruye solo cuando el grupo cambia
+        if bucket not in self._matrices:
+            self._matrices[bucket] = np.stack([self._entries[i].vector for i in self._buckets[bucket]])
+        return self._matrices[bucket]
+
+    def _expire(self, bucket: Tuple[str, str]) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        for entry_id in [i for i in self._buckets.get(bucket, []) if self._entries[i].created_at < cutoff]:
+            self._remove(entry_id)
+            self.evictions += 1
+
+    def lookup(self, embedding: List[float], category: str, mode: str) -> Optional[CachedAnswer]:
+        """Buscar una respuesta para una consulta parecida. None si no hay coincidencia."""
+        bucket = (category, mode)
+        self._expire(bucket)
+        ids = self._buckets.get(bucket)
+        if not ids:
+            self.misses += 1
+            return None
+
+        scores = self._matrix(bucket) @ self._normalize(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        entry_id = ids[best]
+        self._entries.move_to_end(entry_id)
+        self.hits += 1
+        print(f"💾 [CACHE] Respuesta semántica reutilizada (similitud {scores[best]:.3f})")
+        return self._entries[entry_id]
+
+    def store(
+        self,
+        embedding: List[float],
+        category: str,
+        mode: str,
+        answer: str,
+        sources: List[LegalSource],
+        needs_lawyer: bool,
+        confidence: float,
+    ) -> None:
+        """Guardar una respuesta generada"""
+        if self.max_entries <= 0:
+            return
+        bucket = (category, mode)
+        entry_id = next(self._ids)
+        self._entries[entry_id] = CachedAnswer(
+            answer=answer,
+            sources=list(sources),
+            needs_lawyer=needs_lawyer,
+            confidence=confidence,
+            vector=self._normalize(embedding),
+            bucket=bucket,
+            created_at=time.time(),
+        )
+        self._buckets.setdefault(bucket, []).append(entry_id)
+        self._matrices.pop(bucket, None)
+
+        # Expulsar las menos usadas recientemente
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._buckets.clear()
+        self._matrices.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+semantic_cache = SemanticCache(
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.SEMANTIC_CACHE_TTL_SECONDS,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+)
@@ -0,0 +1,87 @@
+"""
+Single-flight: peticiones idénticas concurrentes comparten una sola llamada
+
+Cuando muchos usuarios hacen la misma pregunta a la vez (p. ej. tras un enlace
+en redes sociales), cada petición lanzaba su propia expansión, embedding,
+consulta a Pinecone y generación. Con single-flight la primera petición hace
+la llamada y las idénticas que llegan mientras está en curso esperan el mismo
+resultado. No es un cache: al terminar la llamada la clave se libera.
+"""
+
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, Hashable, List, TypeVar
+
+from app.core.config import settings
+from app.services.llm_providers import LLMProvider, ProviderWrapper
+
+T = TypeVar("T")
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave en un único future"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        if not self.enabled:
+            return await fn()
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.shared += 1
+
+        flight.waiters += 1
+        try:
+            # shield: si un llamador se cancela (timeout) los demás siguen esperando
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()  # Nadie espera ya el resultado
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._inflight)}
+
+
+class SingleFlightProvider(ProviderWrapper):
+    """Proveedor que comparte las llamadas chat() idénticas en curso (los streams no se comparten)"""
+
+    def __init__(self, provider: LLMProvider):
+        super().__init__(provider)
+        self.flights = SingleFlight(enabled=settings.SINGLE_FLIGHT_ENABLED)
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.4,
+        max_tokens: int = 1500,
+        task: str = "answer"
+    ) -> str:
+        key = json.dumps([messages, temperature, max_tokens, task], sort_keys=True, ensure_ascii=False)
+        return await self.flights.do(
+            key,
+            lambda: self.provider.chat(messages, temperature=temperature, max_tokens=max_tokens, task=task),
+        )
+
+    def stats(self) -> dict:
+        return self.flights.stats()
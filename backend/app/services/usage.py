@@ -0,0 +1,141 @@
+"""
+Contabilidad de tokens de las llamadas LLM
+
+Groq, OpenAI y Together devuelven en `usage` los tokens de prompt y de
+respuesta (Gemini en `usageMetadata`, Ollama en `prompt_eval_count` y
+`eval_count`). Cada proveedor los registra aquí por llamada, etiquetados por
+tarea (answer, expansion, verify, title...), y se agregan por modelo, por
+endpoint y por usuario para ver a dónde van realmente los tokens.
+"""
+
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+
+class UsageContext:
+    """Endpoint y usuario de la petición HTTP actual (lo abre el middleware)"""
+
+    def __init__(self, endpoint: str = "", user_id: Optional[str] = None):
+        self.endpoint = endpoint
+        self.user_id = user_id
+
+
+# Objeto mutable: las tareas hijas (verificación en segundo plano, títulos)
+# comparten el mismo contexto y ven el usuario aunque se fije después
+_usage_context: ContextVar[Optional[UsageContext]] = ContextVar("usage_context", default=None)
+
+
+def start_usage_context(endpoint: str) -> UsageContext:
+    """Abrir el contexto de uso de una petición HTTP"""
+    context = UsageContext(endpoint)
+    _usage_context.set(context)
+    return context
+
+
+def set_usage_user(user_id: Optional[str]) -> None:
+    """Asociar el usuario autenticado a la petición actual"""
+    context = _usage_context.get()
+    if context is not None and user_id:
+        context.user_id = str(user_id)
+
+
+def usage_tokens(usage: Any) -> Tuple[int, int]:
+    """(prompt, respuesta) de un bloque `usage` estilo OpenAI (dict u objeto del SDK)"""
+    if not usage:
+        return 0, 0
+    if isinstance(usage, dict):
+        return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+    return int(getattr(usage, "prompt_tokens", 0) or 0), int(getattr(usage, "completion_tokens", 0) or 0)
+
+
+class TokenCounter:
+    """Llamadas y tokens acumulados"""
+
+    __slots__ = ("calls", "prompt_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add(self, prompt_tokens: int, completion_tokens: int) -> None:
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.calls, 1) if self.calls else 0.0,
+            "avg_completion_tokens": round(self.completion_tokens / self.calls, 1) if self.calls else 0.0,
+        }
+
+
+class UsageTracker:
+    """Agregados en memoria por tarea, modelo, endpoint y usuario (los usuarios con LRU)"""
+
+    def __init__(self, max_users: int = 10000):
+        self.max_users = max_users
+        self.total = TokenCounter()
+        self.by_task: Dict[str, TokenCounter] = {}
+        self.by_model: Dict[str, TokenCounter] = {}
+        self.by_endpoint: Dict[str, Dict[str, TokenCounter]] = {}
+        self.by_user: "OrderedDict[str, Dict[str, TokenCounter]]" = OrderedDict()
+
+    @staticmethod
+    def _add(groups: Dict[str, TokenCounter], key: str, prompt_tokens: int, completion_tokens: int) -> None:
+        groups.setdefault(key, TokenCounter()).add(prompt_tokens, completion_tokens)
+
+    def record(self, model: str, task: str, prompt_tokens: int, completion_tokens: int) -> None:
+        self.total.add(prompt_tokens, completion_tokens)
+        self._add(self.by_task, task, prompt_tokens, completion_tokens)
+        self._add(self.by_model, model, prompt_tokens, completion_tokens)
+
+        context = _usage_context.get()
+        endpoint = context.endpoint if context and context.endpoint else "(sin petición)"
+        self._add(self.by_endpoint.setdefault(endpoint, {}), task, prompt_tokens, completion_tokens)
+
+        if context and context.user_id:
+            user = self.by_user.get(context.user_id)
+            if user is None:
+                user = self.by_user[context.user_id] = {}
+                while len(self.by_user) > self.max_users:
+                    self.by_user.popitem(last=False)
+            else:
+                self.by_user.move_to_end(context.user_id)
+            self._add(user, task, prompt_tokens, completion_tokens)
+
+    @staticmethod
+    def _group(groups: Dict[str, TokenCounter]) -> dict:
+        return {key: counter.to_dict() for key, counter in groups.items()}
+
+    def user_stats(self, user_id: str) -> dict:
+        return self._group(self.by_user.get(str(user_id), {}))
+
+    def stats(self, top_users: int = 20) -> dict:
+        users = sorted(
+            self.by_user.items(),
+            key=lambda item: sum(c.prompt_tokens + c.completion_tokens for c in item[1].values()),
+            reverse=True,
+        )
+        return {
+            "total": self.total.to_dict(),
+            "by_task": self._group(self.by_task),
+            "by_model": self._group(self.by_model),
+            "by_endpoint": {endpoint: self._group(tasks) for endpoint, tasks in self.by_endpoint.items()},
+            "users_tracked": len(self.by_user),
+            "top_users": {user_id: self._group(tasks) for user_id, tasks in users[:top_users]},
+        }
+
+
+usage_tracker = UsageTracker()
+
+
+def record_usage(model: str, task: str, prompt_tokens: int, completion_tokens: int) -> None:
+    """Registrar los tokens de una llamada (sin usage en la respuesta no se registra nada)"""
+    if prompt_tokens or completion_tokens:
+        usage_tracker.record(model, task, prompt_tokens, completion_tokens)
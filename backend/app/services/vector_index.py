@@ -0,0 +1,109 @@
+"""
+Índice vectorial local (alternativa en proceso a Pinecone)
+
+El corpus legal cabe en memoria: los vectores se guardan normalizados en una
+matriz float32 contigua (`legal_index.npy`, generada con
+`python -m scripts.build_local_index`) que se abre con memory-map. La
+búsqueda es un producto matriz-vector con NumPy, sin ida y vuelta por red.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+VECTORS_FILE = "legal_index.npy"
+METADATA_FILE = "legal_index_meta.json"
+
+
+class LocalVectorIndex:
+    """Búsqueda por similitud coseno sobre una matriz float32 memory-mapped"""
+
+    def __init__(self, vectors: np.ndarray, metadata: List[dict]):
+        if len(vectors) != len(metadata):
+            raise ValueError(f"Índice inconsistente: {len(vectors)} vectores y {len(metadata)} metadatos")
+        self.vectors = vectors
+        self.metadata = metadata
+        # Filas por categoría, para aplicar el filtro sin recorrer los metadatos
+        categories: Dict[str, List[int]] = {}
+        for row, meta in enumerate(metadata):
+            categories.setdefault(meta.get("categoria", "general"), []).append(row)
+        self._category_rows = {cat: np.asarray(rows, dtype=np.int64) for cat, rows in categories.items()}
+
+    @classmethod
+    def load(cls, index_dir: str) -> "LocalVectorIndex":
+        directory = Path(index_dir)
+        vectors = np.load(directory / VECTORS_FILE, mmap_mode="r")
+        with open(directory / METADATA_FILE, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+        return cls(vectors, metadata)
+
+    def __len__(self) -> int:
+        return len(self.metadata)
+
+    def search(
+        self,
+        query_vector: List[float],
+        top_k: int = 3,
+        category: Optional[str] = None,
+        min_score: float = 0.7,
+    ) -> List[dict]:
+        """Mismo formato de salida que search_pinecone"""
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm or not len(self):
+            return []
+        query /= norm
+
+        if category and category != "general":
+            rows = self._category_rows.get(category)
+            if rows is None:
+                return []
+            scores = self.vectors[rows] @ query
+        else:
+            rows = None
+            scores = self.vectors @ query
+
+        k = min(top_k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+
+        results = []
+        for position in best:
+            score = float(scores[position])
+            if score <= min_score:  # Solo resultados relevantes
+                continue
+            meta = self.metadata[int(rows[position]) if rows is not None else int(position)]
+            results.append({
+                "id": meta.get("id", ""),
+                "text": meta.get("texto", ""),
+                "law": meta.get("ley", "Documento"),
+                "article": meta.get("articulo", ""),
+                "score": score,
+                "jurisdiction": meta.get("jurisdiction", "Peru"),
+            })
+        return results
+
+
+_local_index = None
+_local_index_loaded = False
+
+
+def get_local_index() -> Optional[LocalVectorIndex]:
+    """Cargar el índice local una sola vez (Lazy Load). None si no fue generado."""
+    global _local_index, _local_index_loaded
+    if _local_index_loaded:
+        return _local_index
+    _local_index_loaded = True
+
+    try:
+        _local_index = LocalVectorIndex.load(settings.LOCAL_INDEX_DIR)
+        print(f"[OK] Índice vectorial local cargado ({len(_local_index)} vectores)")
+    except FileNotFoundError:
+        print(f"[WARN] Índice local no encontrado en {settings.LOCAL_INDEX_DIR}. Ejecuta: python -m scripts.build_local_index")
+    except Exception as e:
+        print(f"[WARN] Índice local no disponible: {e}")
+    return _local_index
@@ -0,0 +1,183 @@
+"""
+Benchmark del pipeline RAG: modo "multi" (varias llamadas) vs "fused" (una llamada)
+
+Para cada consulta y modo mide el tiempo al primer token, el tiempo total,
+las llamadas al LLM y los tokens consumidos. Como aproximación de calidad
+cuenta las respuestas que citan alguna de las fuentes recuperadas, compara la
+plantilla sugerida en ambos modos y, con --judge, pide al LLM que elija la
+mejor respuesta de cada par.
+
+Uso:
+    python -m scripts.benchmark_pipeline
+    python -m scripts.benchmark_pipeline --judge --queries consultas.txt
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from dotenv import load_dotenv
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Load env vars
+load_dotenv()
+
+DEFAULT_QUERIES = [
+    "Me despidieron sin causa después de 3 años, ¿cuánto me deben de indemnización?",
+    "Mi empleador no me depositó la CTS de mayo, ¿qué puedo hacer?",
+    "¿Cuántos días de vacaciones me corresponden al año?",
+    "El padre de mi hijo no paga la pensión de alimentos, ¿cómo lo demando?",
+    "Compré una refrigeradora que vino fallada y la tienda no quiere cambiarla",
+    "Mi inquilino no me paga el alquiler hace 4 meses, ¿puedo desalojarlo?",
+    "¿Qué necesito para constituir una SAC?",
+    "Me pusieron una papeleta injusta, ¿cómo la impugno?",
+]
+
+JUDGE_PROMPT = """Usted evalúa respuestas de un asistente legal peruano.
+Dadas las fuentes legales y dos respuestas (A y B) a la misma consulta, elija la que sea
+más correcta, mejor fundamentada en las fuentes y más útil para el usuario.
+Responda SOLO con "A", "B" o "EMPATE".
+
+CONSULTA: {query}
+
+FUENTES:
+{context}
+
+RESPUESTA A:
+{answer_a}
+
+RESPUESTA B:
+{answer_b}"""
+
+
+async def run_turn(query: str) -> dict:
+    """Un turno completo por streaming (como el frontend)"""
+    from app.services.rag import stream_legal_response
+    from app.services.usage import usage_tracker
+
+    calls, tokens = usage_tracker.total.calls, usage_tracker.total.prompt_tokens + usage_tracker.total.completion_tokens
+    t0 = time.perf_counter()
+    first_token = None
+    result = {"sources": [], "answer": "", "correction": False}
+    async for event, data in stream_legal_response(query):
+        if event == "sources":
+            result["sources"] = data["sources"]
+        elif event == "token" and first_token is None:
+            first_token = time.perf_counter() - t0
+        elif event == "correction":
+            result["correction"] = True
+        elif event == "done":
+            result["answer"] = data["content"]
+        elif event == "error":
+            result["answer"] = f"ERROR: {data['detail']}"
+
+    result["ttft"] = first_token or 0.0
+    result["total"] = time.perf_counter() - t0
+    result["llm_calls"] = usage_tracker.total.calls - calls
+    result["tokens"] = usage_tracker.total.prompt_tokens + usage_tracker.total.completion_tokens - tokens
+    result["suggestion"] = "💡 **Sugerencia**" in result["answer"]
+    result["cites_source"] = any(
+        source["law"] and source["law"].lower() in result["answer"].lower() for source in result["sources"]
+    )
+    return result
+
+
+async def run_mode(mode: str, queries: list) -> list:
+    from app.core.config import settings
+    settings.PIPELINE_MODE = mode
+    results = []
+    for query in queries:
+        result = await run_turn(query)
+        print(f"   [{mode}] {result['total']:.2f}s ({result['llm_calls']} llamadas, {result['tokens']} tokens) - {query[:50]}")
+        results.append(result)
+    return results
+
+
+async def judge(queries: list, multi: list, fused: list) -> dict:
+    """Comparación por pares con el LLM (el orden A/B se alterna para evitar sesgo de posición)"""
+    from app.services.llm_providers import get_global_llm
+    from app.services.rag import format_context
+    from app.schemas.chat import LegalSource
+
+    wins = {"multi": 0, "fused": 0, "empate": 0}
+    for i, (query, a, b) in enumerate(zip(queries, multi, fused)):
+        swap = i % 2 == 1
+        first, second = (b, a) if swap else (a, b)
+        context = format_context([LegalSource(**source) for source in a["sources"]])
+        verdict = await get_global_llm().chat(
+            messages=[{"role": "user", "content": JUDGE_PROMPT.format(
+                query=query, context=context, answer_a=first["answer"], answer_b=second["answer"]
+            )}],
+            temperature=0.0,
+            max_tokens=5,
+            task="verify",
+        )
+        verdict = verdict.strip().upper()
+        if verdict.startswith("A"):
+            wins["fused" if swap else "multi"] += 1
+        elif verdict.startswith("B"):
+            wins["multi" if swap else "fused"] += 1
+        else:
+            wins["empate"] += 1
+    return wins
+
+
+def summarize(mode: str, results: list) -> None:
+    def p95(values):
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    totals = [r["total"] for r in results]
+    ttfts = [r["ttft"] for r in results]
+    print(f"\n{mode.upper()}")
+    print(f"   Primer token: media {statistics.mean(ttfts):.2f}s | p95 {p95(ttfts):.2f}s")
+    print(f"   Total:        media {statistics.mean(totals):.2f}s | p95 {p95(totals):.2f}s")
+    print(f"   Llamadas LLM por turno: {statistics.mean(r['llm_calls'] for r in results):.1f}")
+    print(f"   Tokens por turno:       {statistics.mean(r['tokens'] for r in results):.0f}")
+    print(f"   Citan una fuente:       {sum(r['cites_source'] for r in results)}/{len(results)}")
+    print(f"   Con sugerencia:         {sum(r['suggestion'] for r in results)}/{len(results)}")
+    print(f"   Corregidas:             {sum(r['correction'] for r in results)}/{len(results)}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi vs fused")
+    parser.add_argument("--queries", help="Archivo con una consulta por línea")
+    parser.add_argument("--judge", action="store_true", help="Comparar la calidad con el LLM")
+    args = parser.parse_args()
+
+    from app.core.config import settings
+    # Sin caches: se mide el pipeline completo en cada turno
+    settings.SEMANTIC_CACHE_ENABLED = False
+    settings.LLM_CACHE_ENABLED = False
+    settings.VERIFICATION_ASYNC = False
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    print("=" * 60)
+    print(f"BENCHMARK PIPELINE RAG ({len(queries)} consultas)")
+    print("=" * 60 + "\n")
+
+    multi = await run_mode("multi", queries)
+    fused = await run_mode("fused", queries)
+
+    summarize("multi", multi)
+    summarize("fused", fused)
+    same = sum(a["suggestion"] == b["suggestion"] for a, b in zip(multi, fused))
+    print(f"\nMisma decisión de sugerencia en ambos modos: {same}/{len(queries)}")
+
+    if args.judge:
+        wins = await judge(queries, multi, fused)
+        print(f"Juez LLM: multi {wins['multi']} | fused {wins['fused']} | empate {wins['empate']}")
+
+
+if __name__ == "__main__":
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
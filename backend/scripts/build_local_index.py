@@ -0,0 +1,84 @@
+"""
+Script para construir el índice vectorial local (alternativa a Pinecone)
+Ejecutar: python -m scripts.build_local_index
+
+Genera en data/:
+- legal_index.npy: matriz float32 (N x 384) con los vectores normalizados
+- legal_index_meta.json: metadatos de cada fila (mismo formato que Pinecone)
+
+Activar en el backend con VECTOR_BACKEND=local
+"""
+
+import json
+import time
+
+import numpy as np
+
+from scripts.legal_corpus import (
+    DATA_DIR,
+    DATA_FILE,
+    EMBEDDING_MODEL,
+    article_metadata,
+    load_legal_data,
+    prepare_text_for_embedding,
+    sanitize_id,
+)
+
+VECTORS_FILE = DATA_DIR / "legal_index.npy"
+METADATA_FILE = DATA_DIR / "legal_index_meta.json"
+BATCH_SIZE = 64
+
+
+def build_local_index():
+    """Embeber todo el corpus y guardar la matriz y sus metadatos"""
+    print("\n" + "="*60)
+    print("🚀 CONSTRUIR ÍNDICE VECTORIAL LOCAL")
+    print("="*60 + "\n")
+
+    if not DATA_FILE.exists():
+        print(f"❌ No se encontró el archivo de datos: {DATA_FILE}")
+        print("   Ejecuta primero: python -m scripts.prepare_legal_data")
+        return
+
+    try:
+        from fastembed import TextEmbedding
+    except ImportError as e:
+        print(f"❌ Error: {e}")
+        print("   pip install fastembed")
+        return
+
+    legal_data = load_legal_data()
+    print(f"📚 Cargados {len(legal_data)} fragmentos de texto")
+
+    print(f"   Cargando modelo {EMBEDDING_MODEL}...")
+    model = TextEmbedding(model_name=EMBEDDING_MODEL)
+
+    t0 = time.time()
+    texts = [prepare_text_for_embedding(article) for article in legal_data]
+    vectors = np.asarray(list(model.embed(texts, batch_size=BATCH_SIZE)), dtype=np.float32)
+
+    # Normalizar: la similitud coseno queda como un producto punto
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = np.ascontiguousarray(vectors / norms)
+
+    metadata = [
+        {"id": sanitize_id(article["id"]), **article_metadata(article)}
+        for article in legal_data
+    ]
+
+    np.save(VECTORS_FILE, vectors)
+    with open(METADATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False)
+
+    print("\n" + "="*60)
+    print("✅ PROCESO COMPLETADO")
+    print("="*60)
+    print(f"   📊 Vectores: {vectors.shape[0]} x {vectors.shape[1]} ({vectors.nbytes / 1024:.0f} KB)")
+    print(f"   ⏱️  Tiempo: {time.time() - t0:.1f}s")
+    print(f"   🗂️  Archivos: {VECTORS_FILE.name}, {METADATA_FILE.name}")
+    print("="*60 + "\n")
+
+
+if __name__ == "__main__":
+    build_local_index()
@@ -0,0 +1,56 @@
+"""
+Corpus legal compartido por los scripts de indexación
+(Pinecone, índice vectorial local)
+"""
+
+import json
+import unicodedata
+from pathlib import Path
+from typing import List
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+DATA_FILE = DATA_DIR / "legal_knowledge.json"
+
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"  # Modelo local gratuito
+EMBEDDING_DIMENSION = 384 # Dimensión del modelo local
+
+
+def load_legal_data() -> List[dict]:
+    """Cargar los fragmentos legales generados por prepare_legal_data / process_pdfs"""
+    with open(DATA_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def prepare_text_for_embedding(article: dict) -> str:
+    """Preparar texto del artículo para generar embedding"""
+    return f"""
+Ley: {article.get('ley', '')}
+Número: {article.get('numero_ley', '')}
+Artículo: {article.get('articulo', '')}
+Título: {article.get('titulo', '')}
+Contenido: {article.get('texto', '')}
+Categoría: {article.get('categoria', '')}
+Libro: {article.get('libro', 'N/A')}
+""".strip()
+
+
+def sanitize_id(text: str) -> str:
+    """Convertir ID a ASCII para Pinecone"""
+    # Normalizar (eliminar tildes y caracteres especiales)
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    # Asegurar que sea seguro
+    return text.strip()
+
+
+def article_metadata(article: dict) -> dict:
+    """Metadatos que se guardan junto a cada vector"""
+    return {
+        "ley": article.get("ley", "Desconocido"),
+        "numero_ley": article.get("numero_ley", ""),
+        "articulo": article.get("articulo", ""),
+        "titulo": article.get("titulo", ""),
+        "texto": article.get("texto", "")[:30000], # Pinecone limit is 40KB (bytes), so 30k chars is safe buffer
+        "categoria": article.get("categoria", "general"),
+        "libro": article.get("libro", ""),
+        "jurisdiction": article.get("jurisdiction", "Peru")
+    }
@@ -10,11 +10,18 @@ Requisitos:
 import json
 import os
 import time
-import unicodedata
-from pathlib import Path
 from typing import List
 from dotenv import load_dotenv
 
+from scripts.legal_corpus import (
+    DATA_FILE,
+    EMBEDDING_DIMENSION,
+    EMBEDDING_MODEL,
+    article_metadata,
+    prepare_text_for_embedding,
+    sanitize_id,
+)
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -34,8 +41,6 @@ except ImportError:
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "") # Ya no se usa para embeddings
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY", "")
 INDEX_NAME = "legalbot-local-384" # Nuevo indice para dimensiones locales
-EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"  # Modelo local gratuito
-EMBEDDING_DIMENSION = 384 # Dimensión del modelo local
 
 # ═══════════════════════════════════════════════════════════════
 
@@ -79,30 +84,12 @@ def create_index_if_not_exists(pc: Pinecone) -> any:
 
 def generate_embedding(model, text: str) -> List[float]:
     """Generar embedding con FastEmbed"""
-    # FastEmbed retorna un generador, obtenemos el primer elemento
-    embeddings = list(model.embed([text]))
-    return embeddings[0].tolist()
-
-
-def prepare_text_for_embedding(article: dict) -> str:
-    """Preparar texto del artículo para generar embedding"""
-    return f"""
-Ley: {article.get('ley', '')}
-Número: {article.get('numero_ley', '')}
-Artículo: {article.get('articulo', '')}
-Título: {article.get('titulo', '')}
-Contenido: {article.get('texto', '')}
-Categoría: {article.get('categoria', '')}
-Libro: {article.get('libro', 'N/A')}
-""".strip()
+    return generate_embeddings(model, [text])[0]
 
 
-def sanitize_id(text: str) -> str:
-    """Convertir ID a ASCII para Pinecone"""
-    # Normalizar (eliminar tildes y caracteres especiales)
-    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
-    # Asegurar que sea seguro
-    return text.strip()
+def generate_embeddings(model, texts: List[str]) -> List[List[float]]:
+    """Generar embeddings de un lote de textos en una sola llamada a FastEmbed"""
+    return [vector.tolist() for vector in model.embed(texts, batch_size=len(texts))]
 
 
 def upload_legal_data():
@@ -132,7 +119,7 @@ def upload_legal_data():
     pc = Pinecone(api_key=PINECONE_API_KEY)
     
     # Cargar datos legales
-    data_file = Path(__file__).parent.parent / "data" / "legal_knowledge.json"
+    data_file = DATA_FILE
     
     if not data_file.exists():
         print(f"❌ No se encontró el archivo de datos: {data_file}")
@@ -149,58 +136,38 @@ def upload_legal_data():
     
     # Procesar y subir en lotes
     batch_size = 20
-    vectors_to_upsert = []
     total_processed = 0
     
     print(f"\n📤 Subiendo vectores (lotes de {batch_size})...\n")
     
-    for i, article in enumerate(legal_data):
+    for start in range(0, len(legal_data), batch_size):
+        batch = legal_data[start:start + batch_size]
         # Mostrar progreso
-        print(f"   [{i+1}/{len(legal_data)}] Procesando: {article['ley']} - {article['articulo']}")
-        print(f"   [{i+1}/{len(legal_data)}] Procesando: {article.get('ley', 'N/A')} - {article.get('articulo', 'N/A')}")
+        print(f"   [{start + 1}-{start + len(batch)}/{len(legal_data)}] Procesando: {batch[0].get('ley', 'N/A')} - {batch[0].get('articulo', 'N/A')}")
         
         try:
-            # Generar texto y embedding
-            text = prepare_text_for_embedding(article)
-            embedding = generate_embedding(embedding_model, text)
-            
-            # Preparar vector
-            vector = {
+            # Un solo llamado al modelo por lote (en vez de uno por artículo)
+            embeddings = generate_embeddings(embedding_model, [prepare_text_for_embedding(article) for article in batch])
+        except Exception as e:
+            print(f"   ⚠️  Error generando embeddings del lote: {e}")
+            continue
+        
+        vectors_to_upsert = [
+            {
                 "id": sanitize_id(article["id"]),
                 "values": embedding,
-                "metadata": {
-                    "ley": article.get("ley", "Desconocido"),
-                    "numero_ley": article.get("numero_ley", ""),
-                    "articulo": article.get("articulo", ""),
-                    "titulo": article.get("titulo", ""),
-                    "texto": article.get("texto", "")[:30000], # Pinecone limit is 40KB (bytes), so 30k chars is safe buffer
-                    "categoria": article.get("categoria", "general"),
-                    "libro": article.get("libro", ""),
-                    "jurisdiction": article.get("jurisdiction", "Peru")
-                }
+                "metadata": article_metadata(article)
             }
-            vectors_to_upsert.append(vector)
-            
-            # Subir en lotes
-            if len(vectors_to_upsert) >= batch_size:
-                try:
-                    index.upsert(vectors=vectors_to_upsert)
-                    total_processed += len(vectors_to_upsert)
-                    print(f"   ⬆️  Subidos {total_processed} vectores...")
-                except Exception as e:
-                    print(f"   ❌ Error subiendo lote: {e}")
-                vectors_to_upsert = []
-                time.sleep(0.5)  # Rate limiting
-                
+            for article, embedding in zip(batch, embeddings)
+        ]
+        
+        try:
+            index.upsert(vectors=vectors_to_upsert)
+            total_processed += len(vectors_to_upsert)
+            print(f"   ⬆️  Subidos {total_processed} vectores...")
         except Exception as e:
-            print(f"   ⚠️  Error en {article.get('id', 'N/A')}: {e}")
-            continue
-    
-    # Subir vectores restantes
-    if vectors_to_upsert:
-        index.upsert(vectors=vectors_to_upsert)
-        total_processed += len(vectors_to_upsert)
-        print(f"   ⬆️  Subidos {total_processed} vectores (final)")
+            print(f"   ❌ Error subiendo lote: {e}")
+        time.sleep(0.5)  # Rate limiting
     
     # Verificar resultado
     time.sleep(2)  # Esperar a que se indexen
@@ -16,12 +16,17 @@ interface LegalSource {
   category: string;
 }
 
+// Fuente sin su texto (historial pedido con includeSources: false)
+type LegalSourceRef = Omit<LegalSource, 'text'>;
+
 interface ChatMessage {
   id: string;
   conversation_id: string;
   role: 'user' | 'assistant';
   content: string;
-  sources?: LegalSource[];
+  sources?: (LegalSource | LegalSourceRef)[];
+  // Corrección de la verificación en segundo plano (llega después de la respuesta)
+  correction?: string | null;
   created_at: string;
 }
 
@@ -183,9 +188,22 @@ export async function getConversations(token: string): Promise<Conversation[]> {
 
 export async function getConversation(
   conversationId: string,
-  token: string
-): Promise<Conversation & { messages: ChatMessage[] }> {
-  return fetchApi(`/api/chat/conversations/${conversationId}`, {}, token);
+  token: string,
+  page: { before?: string; after?: string; limit?: number; includeSources?: boolean } = {}
+): Promise<Conversation & { messages: ChatMessage[]; has_older: boolean; has_newer: boolean }> {
+  // Sin `page` devuelve todos los mensajes; con `limit`, la página más reciente
+  // (las anteriores se piden con before = id del primer mensaje recibido)
+  const params = new URLSearchParams();
+  if (page.before) params.set('before', page.before);
+  if (page.after) params.set('after', page.after);
+  if (page.limit) params.set('limit', String(page.limit));
+  if (page.includeSources === false) params.set('include_sources', 'false');
+  const query = params.toString();
+  return fetchApi(
+    `/api/chat/conversations/${conversationId}${query ? `?${query}` : ''}`,
+    {},
+    token
+  );
 }
 
 export async function deleteConversation(